@@ -0,0 +1,287 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+客户端渲染基准测试
+功能：在Qt的offscreen平台下（不需要显示器）用100、1千、1万条合成消息（带图/不带图）驱动客户端的
+MessageUI.update_message_list、MessageClient.format_message_preview、
+MessageUI.display_image_in_separate_area 和 ImageViewerDialog.update_image_display，
+统计每次调用的耗时和内存峰值，输出JSON，用来跟踪界面刷新的性能回退。
+
+    python benchmarks/client_render.py --sizes 100,1000 --output client_baseline.json
+
+测试过程中自动保存的图片写到临时目录，不影响 client/saved_images 和已读状态文件。
+"""
+
+import os
+
+# 必须在导入PySide2之前设置
+os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+
+import argparse
+import base64
+import functools
+import gc
+import json
+import platform
+import random
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+CLIENT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'client')
+sys.path.insert(0, os.path.abspath(CLIENT_DIR))
+
+import PySide2
+from PySide2.QtWidgets import QApplication
+from PySide2.QtCore import QByteArray, QBuffer
+from PySide2.QtGui import QImage, QPainter, QColor
+
+import image_manager
+import ui_client
+from network_client import ConnectionState, MessageClient
+
+from server_load import make_bmp
+
+# 测试用的配置：指向一个没有服务端的端口。创建界面后后台消息线程立即停止，它发出的请求连不上也会很快失败；
+# update_message_list本身不发请求，只按client.connection里记录的连接状态重画状态栏（见BenchConnectionState）
+BENCH_CONFIG = {
+    'client': {
+        'server_host': '127.0.0.1',
+        'server_port': 9,
+        'reconnect_interval': 5
+    },
+    'logging': {
+        'level': 'CRITICAL',
+        'file': 'app.log'
+    }
+}
+
+
+class BenchConnectionState(ConnectionState):
+    """一直处于已连接状态的连接状态：按连接正常时的渲染路径测（状态栏要统计总数和已读/未读），
+    后台消息线程停止前那次连不上的请求不会把它改成断开"""
+
+    def __init__(self, probe_interval=5):
+        super().__init__(probe_interval)
+        self.record_success()
+
+    def record_failure(self, reason):
+        pass
+
+
+def peak_rss():
+    """进程的内存峰值（字节），不支持的系统返回None"""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux上单位是KB，macOS上是字节
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def make_png(width, height, rng):
+    """生成一张PNG图片的base64数据（随机色块）"""
+    image = QImage(width, height, QImage.Format_RGB32)
+    painter = QPainter(image)
+    for y in range(0, height, 32):
+        for x in range(0, width, 32):
+            painter.fillRect(x, y, 32, 32, QColor(rng.randrange(256), rng.randrange(256), rng.randrange(256)))
+    painter.end()
+    byte_array = QByteArray()
+    buffer = QBuffer(byte_array)
+    buffer.open(QBuffer.WriteOnly)
+    image.save(buffer, "PNG")
+    return base64.b64encode(byte_array.data()).decode('ascii')
+
+
+def make_messages(count, image_ratio, image_data, rng, first_id=1):
+    """生成count条合成消息，按服务端的顺序（新的在前），image_ratio比例的消息带图"""
+    now = datetime.now()
+    priorities = ['low', 'normal', 'normal', 'normal', 'high', 'critical']
+    messages = []
+    for i in range(count):
+        message_id = first_id + count - 1 - i
+        with_image = image_data and rng.random() < image_ratio
+        messages.append({
+            'id': message_id,
+            'type': 'mixed' if with_image else 'text',
+            'timestamp': (now - timedelta(seconds=i * 7)).isoformat(),
+            'title': f"合成消息 {message_id}",
+            'content': '\n'.join(f"第{line}行 " + '测试内容' * rng.randrange(1, 12) for line in range(rng.randrange(1, 5))),
+            'image_data': image_data if with_image else None,
+            'priority': rng.choice(priorities),
+            'channel': ''
+        })
+    return messages
+
+
+def measure(function, calls, setup=None):
+    """调用function共calls次（每次调用前执行setup，不计时），返回耗时统计和Python内存峰值"""
+    gc.collect()
+    tracemalloc.start()
+    durations = []
+    for _ in range(calls):
+        if setup:
+            setup()
+        start = time.perf_counter()
+        function()
+        durations.append(time.perf_counter() - start)
+    _, python_peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {
+        'calls': calls,
+        'per_call_ms': {
+            'min': round(min(durations) * 1000, 3),
+            'median': round(statistics.median(durations) * 1000, 3),
+            'max': round(max(durations) * 1000, 3),
+        },
+        'python_peak_bytes': python_peak,
+        'process_peak_rss_bytes': peak_rss(),
+    }
+
+
+class RenderBenchmark:
+    def __init__(self, args):
+        self.args = args
+        self.rng = random.Random(args.seed)
+        self.results = []
+        self.workdir = tempfile.mkdtemp(prefix='msg-client-bench-')
+
+        # 自动保存的图片写到临时目录
+        ui_client.save_image_automatically = functools.partial(
+            image_manager.save_image_automatically, save_directory=os.path.join(self.workdir, 'saved_images'))
+
+        self.client = MessageClient(BENCH_CONFIG, connection=BenchConnectionState())
+        self.small_image = make_png(320, 240, self.rng)
+        self.large_image = base64.b64encode(make_bmp(1920, 1080, self.rng)).decode('ascii')
+
+    def create_ui(self):
+        """创建主界面，停止后台的消息线程，已读状态和窗口位置使用临时文件"""
+        ui = ui_client.MessageUI(self.client)
+        ui.message_thread.stop()
+        ui.read_status = {}
+        ui.read_status_file = os.path.join(self.workdir, 'read_messages.json')
+        ui.position_file = os.path.join(self.workdir, 'position.json')
+        ui.resize(800, 600)
+        ui.show()
+        QApplication.processEvents()
+        return ui
+
+    def add_result(self, name, size, images, stats):
+        stats.update({'name': name, 'messages': size, 'images': images})
+        self.results.append(stats)
+        print(f"{name:32s} {size:>6} {'images' if images else 'text':6s} "
+              f"median {stats['per_call_ms']['median']:10.3f} ms", file=sys.stderr)
+
+    def bench_format_preview(self, size, images, messages):
+        def run():
+            for message in messages:
+                self.client.format_message_preview(message)
+        stats = measure(run, self.args.repeat)
+        # 换算成每条消息的耗时
+        stats['per_message_us'] = round(stats['per_call_ms']['median'] * 1000 / size, 3)
+        self.add_result('format_message_preview', size, images, stats)
+
+    def bench_update_message_list(self, size, images, messages):
+        """全量刷新：第一次显示整个列表，之后每来一条新消息界面都会重建整个列表"""
+        ui = self.create_ui()
+        stats = measure(lambda: ui.update_message_list(messages), 1)
+        self.add_result('update_message_list_initial', size, images, stats)
+
+        lists = [messages]
+        next_id = messages[0]['id'] + 1 if messages else 1
+        for i in range(self.args.repeat):
+            new_message = make_messages(1, 0, None, self.rng, first_id=next_id + i)[0]
+            lists.append([new_message] + lists[-1][:-1])
+        pending = iter(lists[1:])
+        stats = measure(lambda: ui.update_message_list(next(pending)), self.args.repeat)
+        self.add_result('update_message_list_new_message', size, images, stats)
+        ui.hide()
+        ui.deleteLater()
+        QApplication.processEvents()
+
+    def bench_display_image(self):
+        ui = self.create_ui()
+        for label, image_data in (('320x240_png', self.small_image), ('1920x1080_bmp', self.large_image)):
+            message = {'id': 1, 'image_data': image_data}
+            stats = measure(lambda: ui.display_image_in_separate_area(message), self.args.repeat)
+            stats['image'] = label
+            self.add_result('display_image_in_separate_area', 1, True, stats)
+        ui.hide()
+        ui.deleteLater()
+
+    def bench_image_viewer(self):
+        for label, image_data in (('320x240_png', self.small_image), ('1920x1080_bmp', self.large_image)):
+            viewer = image_manager.create_image_viewer(image_data)
+            for scale in (1.0, 0.5, 2.0):
+                def set_scale(scale=scale):
+                    viewer.current_scale = scale
+                stats = measure(viewer.update_image_display, self.args.repeat, setup=set_scale)
+                stats.update({'image': label, 'scale': scale})
+                self.add_result('update_image_display', 1, True, stats)
+            viewer.close()
+            viewer.deleteLater()
+        QApplication.processEvents()
+
+    def run(self):
+        try:
+            for size in self.args.sizes:
+                for images in (False, True):
+                    messages = make_messages(size, self.args.image_ratio, self.small_image if images else None, self.rng)
+                    self.bench_format_preview(size, images, messages)
+                    self.bench_update_message_list(size, images, messages)
+            self.bench_display_image()
+            self.bench_image_viewer()
+        finally:
+            shutil.rmtree(self.workdir, ignore_errors=True)
+
+        return {
+            'timestamp': datetime.now().isoformat(),
+            'host': {
+                'platform': platform.platform(),
+                'python': platform.python_version(),
+                'pyside2': PySide2.__version__,
+            },
+            'settings': {
+                'sizes': self.args.sizes,
+                'image_ratio': self.args.image_ratio,
+                'repeat': self.args.repeat,
+                'seed': self.args.seed,
+            },
+            'results': self.results,
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='客户端渲染基准测试（Qt offscreen）')
+    parser.add_argument('--sizes', default='100,1000,10000', help='消息列表的条数，逗号分隔')
+    parser.add_argument('--image-ratio', type=float, default=0.2, help='带图测试中带图消息的比例')
+    parser.add_argument('--repeat', type=int, default=5, help='每项测试重复的次数')
+    parser.add_argument('--seed', type=int, default=1, help='随机种子')
+    parser.add_argument('--output', help='结果JSON写入的文件，默认输出到标准输出')
+    args = parser.parse_args()
+    args.sizes = [int(size) for size in args.sizes.split(',')]
+
+    app = QApplication(sys.argv)
+    report = RenderBenchmark(args).run()
+    # 实际使用的Qt平台插件（环境变量QT_QPA_PLATFORM可以覆盖默认的offscreen）
+    report['host']['qt_platform'] = app.platformName()
+
+    output = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(output + '\n')
+    else:
+        print(output)
+
+
+if __name__ == '__main__':
+    main()
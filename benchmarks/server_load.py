@@ -0,0 +1,429 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+服务端压力测试
+功能：模拟N个发送端按固定速率发送文本、图文和大图消息，同时M个客户端按现在MessageThread的方式
+（列表只取不含图片的字段、缺的图片按ID批量补取、带版本号长轮询，间隔用客户端的PollScheduler计算）、
+旧版MessageThread的方式（每2秒检查连接并拉取完整列表）或单纯长轮询读取，统计吞吐量、延迟分位数和服务端内存，输出JSON。
+
+同样的参数和随机种子得到同样的负载，可以在同一台Linux机器上对比server/server.py改动前后的结果：
+    python benchmarks/server_load.py --spawn --duration 30 --output baseline.json
+    python benchmarks/server_load.py --url http://127.0.0.1:5001 --server-pid 12345
+"""
+
+import argparse
+import base64
+import json
+import math
+import os
+import platform
+import random
+import shutil
+import struct
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+
+import requests
+
+SERVER_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'server')
+CLIENT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'client')
+sys.path.insert(0, os.path.abspath(CLIENT_DIR))
+
+# 列表字段、按ID批量获取的条数和轮询间隔的计算直接用客户端的，客户端改了压测也跟着变
+from network_client import IDS_PER_REQUEST, LIST_FIELDS, PollScheduler, parse_seconds
+
+# 发送的消息种类 -> 图片尺寸（宽, 高），大图模拟dm.Capture截的全屏BMP
+MESSAGE_KINDS = {
+    'text': None,
+    'mixed': (320, 240),
+    'large': (1920, 1080),
+}
+
+
+def make_bmp(width, height, rng):
+    """生成一张24位BMP图片（随机色块，便于图片转码时有真实的压缩效果）"""
+    row_size = (width * 3 + 3) & ~3
+    block = 16
+    colors = [bytes(rng.randrange(256) for _ in range(3)) for _ in range(64)]
+    rows = []
+    for y in range(height):
+        row = b''.join(colors[(x // block + y // block) % len(colors)] * block for x in range(0, width, block))
+        rows.append(row[:width * 3].ljust(row_size, b'\0'))
+    pixels = b''.join(rows)
+    header = struct.pack('<2sIHHI', b'BM', 54 + len(pixels), 0, 0, 54)
+    info = struct.pack('<IiiHHIIiiII', 40, width, height, 1, 24, 0, len(pixels), 2835, 2835, 0, 0)
+    return header + info + pixels
+
+
+def percentile(sorted_values, p):
+    """最近秩法计算分位数"""
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, max(0, math.ceil(p / 100 * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+
+def read_rss(pid):
+    """读取进程及其所有子进程（多进程模式的工作进程）的常驻内存，单位字节，仅Linux"""
+    total = 0
+    pending = [pid]
+    while pending:
+        current = pending.pop()
+        try:
+            with open(f'/proc/{current}/status') as f:
+                for line in f:
+                    if line.startswith('VmRSS:'):
+                        total += int(line.split()[1]) * 1024
+                        break
+            for task in os.listdir(f'/proc/{current}/task'):
+                with open(f'/proc/{current}/task/{task}/children') as f:
+                    pending.extend(int(child) for child in f.read().split())
+        except (FileNotFoundError, ProcessLookupError, PermissionError):
+            continue
+    return total
+
+
+class Recorder:
+    """按操作类型记录每次请求的耗时和失败次数"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latencies = {}
+        self.errors = {}
+        self.bytes_sent = 0
+
+    def record(self, operation, seconds, ok, size=0):
+        with self.lock:
+            self.latencies.setdefault(operation, []).append(seconds)
+            self.bytes_sent += size
+            if not ok:
+                self.errors[operation] = self.errors.get(operation, 0) + 1
+
+    def summary(self, elapsed):
+        result = {}
+        with self.lock:
+            for operation, values in sorted(self.latencies.items()):
+                values = sorted(values)
+                result[operation] = {
+                    'count': len(values),
+                    'errors': self.errors.get(operation, 0),
+                    'throughput_per_second': round(len(values) / elapsed, 2),
+                    'latency_ms': {
+                        'p50': round(percentile(values, 50) * 1000, 2),
+                        'p95': round(percentile(values, 95) * 1000, 2),
+                        'p99': round(percentile(values, 99) * 1000, 2),
+                        'max': round(values[-1] * 1000, 2),
+                    },
+                }
+        return result
+
+
+class LoadGenerator:
+    def __init__(self, args):
+        self.args = args
+        self.base_url = args.url.rstrip('/')
+        self.recorder = Recorder()
+        self.stop_event = threading.Event()
+        self.rss_samples = []
+        self.kinds, self.weights = self.parse_mix(args.mix)
+        self.images = self.prepare_images()
+
+    @staticmethod
+    def parse_mix(mix):
+        """解析 text:6,mixed:3,large:1 形式的消息比例"""
+        kinds, weights = [], []
+        for item in mix.split(','):
+            kind, _, weight = item.partition(':')
+            if kind not in MESSAGE_KINDS:
+                raise ValueError(f"Unknown message kind: {kind}")
+            kinds.append(kind)
+            weights.append(float(weight or 1))
+        return kinds, weights
+
+    def prepare_images(self):
+        """预先生成并编码好图片，压测过程中不占用发送端的CPU"""
+        rng = random.Random(self.args.seed)
+        images = {}
+        for kind in self.kinds:
+            size = MESSAGE_KINDS[kind]
+            if size:
+                images[kind] = base64.b64encode(make_bmp(*size, rng)).decode('ascii')
+        return images
+
+    def http(self, session):
+        # 默认和现有客户端一样每次新建连接，--keep-alive时复用连接
+        return session if session else requests
+
+    def sender(self, index):
+        rng = random.Random(self.args.seed * 1000 + index)
+        session = requests.Session() if self.args.keep_alive else None
+        interval = 1.0 / self.args.rate
+        next_time = time.monotonic() + rng.random() * interval
+        sequence = 0
+        while not self.stop_event.is_set():
+            delay = next_time - time.monotonic()
+            if delay > 0 and self.stop_event.wait(delay):
+                break
+            next_time += interval
+            kind = rng.choices(self.kinds, self.weights)[0]
+            sequence += 1
+            message = {
+                'type': 'text' if kind == 'text' else 'mixed',
+                'title': f"压测消息 {index}-{sequence}",
+                'content': f"sender {index} message {sequence} " + 'x' * rng.randrange(20, 400),
+                'sender': f"bench-{index}",
+            }
+            if kind in self.images:
+                message['image_data'] = self.images[kind]
+            body = json.dumps(message)
+            start = time.perf_counter()
+            try:
+                response = self.http(session).post(f"{self.base_url}/api/messages", data=body,
+                                                   headers={'Content-Type': 'application/json'}, timeout=30)
+                ok = response.status_code in (200, 202)
+            except requests.RequestException:
+                ok = False
+            self.recorder.record(f"post_{kind}", time.perf_counter() - start, ok, len(body))
+
+    def current_client(self, index):
+        """模拟现在的MessageThread和MessageClient.get_messages：
+
+        列表只取LIST_FIELDS（不带图片），本地没有的图片按ID批量补取（fields=id,image_data）；
+        拿到版本号后带wait/version长轮询；两次轮询之间的等待由PollScheduler按服务端的
+        X-Poll-Interval和Retry-After计算。和客户端一样始终复用HTTP会话。
+        """
+        session = requests.Session()
+        scheduler = PollScheduler(interval=self.args.poll_interval)
+        offset = random.Random(self.args.seed + index).random() * self.args.poll_interval
+        if self.stop_event.wait(offset):
+            return
+        version = None
+        images = set()  # 本地已缓存图片的消息ID
+        failures = 0
+        while not self.stop_event.is_set():
+            long_polled = self.args.wait > 0 and version is not None
+            params = {'fields': ','.join(LIST_FIELDS)}
+            if long_polled:
+                params.update(wait=self.args.wait, version=version)
+            server_interval = retry_after = None
+            changed = False
+            messages = []
+            start = time.perf_counter()
+            try:
+                response = session.get(f"{self.base_url}/api/messages", params=params,
+                                       timeout=10 + (self.args.wait if long_polled else 0))
+                server_interval = parse_seconds(response.headers.get('X-Poll-Interval'))
+                if response.status_code in (429, 503):
+                    retry_after = parse_seconds(response.headers.get('Retry-After'))
+                ok = response.status_code == 200
+                if ok:
+                    data = response.json()
+                    messages = data.get('messages', [])
+                    changed = version is not None and data.get('version') != version
+                    version = data.get('version')
+            except (requests.RequestException, ValueError):
+                ok = False
+            elapsed = time.perf_counter() - start
+            self.recorder.record('long_poll' if long_polled else 'list', elapsed, ok)
+
+            missing = [message['id'] for message in messages
+                       if message['id'] not in images and message.get('type') != 'text']
+            for chunk_start in range(0, len(missing), IDS_PER_REQUEST):
+                chunk = missing[chunk_start:chunk_start + IDS_PER_REQUEST]
+                start = time.perf_counter()
+                try:
+                    response = session.get(f"{self.base_url}/api/messages", timeout=30, params={
+                        'ids': ','.join(str(message_id) for message_id in chunk), 'fields': 'id,image_data'})
+                    fetched = response.json().get('messages', []) if response.status_code == 200 else None
+                except (requests.RequestException, ValueError):
+                    fetched = None
+                self.recorder.record('fetch_images', time.perf_counter() - start, fetched is not None)
+                images.update(message['id'] for message in fetched or [])
+            if ok:
+                images &= {message['id'] for message in messages}
+
+            failures = 0 if ok else failures + 1
+            self.stop_event.wait(scheduler.next_delay(changed, ok, failures, server_interval, retry_after,
+                                                      long_polled and ok, elapsed))
+
+    def poll_client(self, index):
+        """模拟旧版MessageThread：每个周期先检查连接，再拉取完整的消息列表（消息不全时逐条补取）"""
+        session = requests.Session() if self.args.keep_alive else None
+        http = self.http(session)
+        offset = random.Random(self.args.seed + index).random() * self.args.poll_interval
+        if self.stop_event.wait(offset):
+            return
+        while not self.stop_event.is_set():
+            start = time.perf_counter()
+            try:
+                ok = http.get(f"{self.base_url}/api/health", timeout=5).status_code == 200
+            except requests.RequestException:
+                ok = False
+            self.recorder.record('health', time.perf_counter() - start, ok)
+
+            if ok:
+                start = time.perf_counter()
+                try:
+                    response = http.get(f"{self.base_url}/api/messages", timeout=30)
+                    data = response.json()
+                    ok = response.status_code == 200
+                    for message_id in range(len(data.get('messages', [])), data.get('total', 0)):
+                        http.get(f"{self.base_url}/api/messages/{message_id}", timeout=10)
+                except (requests.RequestException, ValueError):
+                    ok = False
+                self.recorder.record('list', time.perf_counter() - start, ok)
+            self.stop_event.wait(self.args.poll_interval)
+
+    def long_poll_client(self, index):
+        """长轮询客户端：带上版本号等待变更，有变更立即返回"""
+        session = requests.Session() if self.args.keep_alive else None
+        http = self.http(session)
+        version = None
+        while not self.stop_event.is_set():
+            params = {'wait': self.args.wait} if version is not None else {}
+            if version is not None:
+                params['version'] = version
+            start = time.perf_counter()
+            try:
+                response = http.get(f"{self.base_url}/api/messages", params=params, timeout=self.args.wait + 30)
+                version = response.json().get('version')
+                ok = response.status_code == 200
+            except (requests.RequestException, ValueError):
+                ok = False
+                self.stop_event.wait(1)
+            self.recorder.record('long_poll', time.perf_counter() - start, ok)
+
+    def sample_rss(self):
+        while not self.stop_event.is_set():
+            self.rss_samples.append(read_rss(self.args.server_pid))
+            self.stop_event.wait(0.5)
+
+    def run(self):
+        if self.args.clear:
+            requests.delete(f"{self.base_url}/api/messages", timeout=60)
+
+        client_target = {'client': self.current_client, 'poll': self.poll_client,
+                         'longpoll': self.long_poll_client}[self.args.client_mode]
+        threads = [threading.Thread(target=self.sender, args=(i,), daemon=True) for i in range(self.args.senders)]
+        threads += [threading.Thread(target=client_target, args=(i,), daemon=True) for i in range(self.args.clients)]
+        if self.args.server_pid:
+            threads.append(threading.Thread(target=self.sample_rss, daemon=True))
+
+        start = time.monotonic()
+        for thread in threads:
+            thread.start()
+        time.sleep(self.args.duration)
+        self.stop_event.set()
+        for thread in threads:
+            thread.join(timeout=self.args.wait + 35)
+        elapsed = time.monotonic() - start
+
+        report = {
+            'timestamp': datetime.now().isoformat(),
+            'host': {'platform': platform.platform(), 'python': platform.python_version(), 'cpus': os.cpu_count()},
+            'workload': {
+                'url': self.base_url,
+                'duration_seconds': self.args.duration,
+                'senders': self.args.senders,
+                'rate_per_sender': self.args.rate,
+                'mix': dict(zip(self.kinds, self.weights)),
+                'clients': self.args.clients,
+                'client_mode': self.args.client_mode,
+                'poll_interval': self.args.poll_interval,
+                'keep_alive': self.args.keep_alive,
+                'seed': self.args.seed,
+            },
+            'elapsed_seconds': round(elapsed, 3),
+            'bytes_sent': self.recorder.bytes_sent,
+            'operations': self.recorder.summary(elapsed),
+        }
+        if self.rss_samples:
+            report['server_rss_bytes'] = {
+                'start': self.rss_samples[0],
+                'end': self.rss_samples[-1],
+                'peak': max(self.rss_samples),
+            }
+        return report
+
+
+def spawn_server(port, workers):
+    """在临时目录里复制一份服务端并启动（使用全新的数据库），返回(进程, 临时目录)
+    
+    内存统计包含服务端的所有子进程（debug重载器或多进程模式的工作进程）。
+    """
+    workdir = tempfile.mkdtemp(prefix='msg-bench-')
+    for name in os.listdir(SERVER_DIR):
+        if name.endswith('.py') or name == 'config.json':
+            shutil.copy(os.path.join(SERVER_DIR, name), workdir)
+    config_path = os.path.join(workdir, 'config.json')
+    with open(config_path, 'r', encoding='utf-8') as f:
+        config = json.load(f)
+    config['server'].update({'host': '127.0.0.1', 'port': port, 'workers': workers})
+    config['logging'].update({'level': 'WARNING', 'file': os.path.join(workdir, 'server.log')})
+    with open(config_path, 'w', encoding='utf-8') as f:
+        json.dump(config, f, ensure_ascii=False, indent=2)
+
+    process = subprocess.Popen([sys.executable, 'server.py'], cwd=workdir,
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    url = f"http://127.0.0.1:{port}"
+    for _ in range(100):
+        try:
+            requests.get(f"{url}/api/health", timeout=1)
+            return process, workdir
+        except requests.RequestException:
+            time.sleep(0.1)
+    process.terminate()
+    raise RuntimeError('Server did not start')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='消息服务端压力测试')
+    parser.add_argument('--url', default='http://127.0.0.1:5001', help='服务端地址（--spawn时忽略）')
+    parser.add_argument('--spawn', action='store_true', help='在临时目录启动一个全新的服务端来测试')
+    parser.add_argument('--port', type=int, default=5099, help='--spawn时服务端使用的端口')
+    parser.add_argument('--workers', type=int, default=1, help='--spawn时服务端的工作进程数')
+    parser.add_argument('--server-pid', type=int, help='服务端进程ID，用于采样内存（--spawn时自动设置）')
+    parser.add_argument('--senders', type=int, default=4, help='发送端数量')
+    parser.add_argument('--rate', type=float, default=2, help='每个发送端每秒发送的消息数')
+    parser.add_argument('--mix', default='text:6,mixed:3,large:1', help='消息种类比例')
+    parser.add_argument('--clients', type=int, default=10, help='读取消息的客户端数量')
+    parser.add_argument('--client-mode', choices=['client', 'poll', 'longpoll'], default='client',
+                        help='client模拟现在的MessageThread（按字段拉列表、批量补取图片、长轮询），'
+                             'poll模拟旧版MessageThread的定时拉取，longpoll只做长轮询')
+    parser.add_argument('--poll-interval', type=float, default=2,
+                        help='poll模式的拉取间隔，client模式PollScheduler的基础间隔（秒）')
+    parser.add_argument('--wait', type=int, default=30, help='client和longpoll模式长轮询每次最多等待的秒数')
+    parser.add_argument('--keep-alive', action='store_true', help='复用HTTP连接（默认每次新建连接，同现有客户端）')
+    parser.add_argument('--duration', type=float, default=30, help='压测时长（秒）')
+    parser.add_argument('--clear', action='store_true', help='开始前清空服务端的消息')
+    parser.add_argument('--seed', type=int, default=1, help='随机种子，相同种子生成相同的负载')
+    parser.add_argument('--output', help='结果JSON写入的文件，默认输出到标准输出')
+    args = parser.parse_args()
+
+    process = workdir = None
+    if args.spawn:
+        process, workdir = spawn_server(args.port, args.workers)
+        args.url = f"http://127.0.0.1:{args.port}"
+        args.server_pid = process.pid
+    try:
+        report = LoadGenerator(args).run()
+    finally:
+        if process:
+            process.terminate()
+            process.wait(timeout=10)
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    output = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(output + '\n')
+    else:
+        print(output)
+
+
+if __name__ == '__main__':
+    main()
@@ -395,10 +395,7 @@ def main():
     try:
         client = MessageClient(config)
         print("网络客户端创建成功")
-        
-        # 启动连接监控
-        client.start_connection_monitor()
-        print("连接监控已启动")
+        # 连接状态由消息线程的轮询维护，断开时消息线程负责探测，不再单独启动连接监控线程
         
     except Exception as e:
         # 创建临时父窗口用于显示无边框弹窗
@@ -1,20 +1,198 @@
 import json
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import logging
+import random
 import time
 import threading
 from typing import List, Dict, Optional
 from datetime import datetime
 
+import codec
+
+# 高优先级消息在列表中的标题标记
+PRIORITY_MARKS = {
+    'critical': '[紧急]',
+    'high': '[重要]'
+}
+
+# 轮询消息列表时取的字段（不带image_data），图片按ID批量取一次后缓存在本地
+LIST_FIELDS = ('id', 'type', 'timestamp', 'title', 'content', 'priority', 'channel')
+
+# 每次按ID批量获取的最大条数（服务端limits.max_ids_per_request默认500）
+IDS_PER_REQUEST = 100
+
+# 服务器繁忙（429）也算请求失败，其他4xx说明服务器正常、只是请求本身有问题
+BUSY_STATUS = 429
+
+
+class ConnectionState:
+    """服务器连接状态
+    
+    所有请求都经过会话的ConnectionAdapter，收到正常响应就算连接正常，连接失败、5xx和429都算断开，
+    不需要另外定时请求/api/health。只有一段时间没有任何请求（空闲）或者已经断开时才需要探测，
+    状态变化时通知监听者（界面通过Qt信号接收，画状态栏时不用发请求）。
+    
+    参数:
+        probe_interval (float): 空闲或断开时两次探测的间隔（秒）
+    """
+    
+    def __init__(self, probe_interval=5):
+        self.probe_interval = probe_interval
+        self.lock = threading.Lock()
+        self.connected = False
+        self.message = "正在连接服务器"
+        self.last_activity = 0.0  # 最近一次请求结束的时间（成功或失败）
+        self.last_success = 0.0
+        self.failures = 0  # 连续失败次数
+        self.listeners = []
+    
+    def add_listener(self, callback):
+        """注册状态变化的回调 callback(connected, message)，回调在发请求的线程里调用"""
+        self.listeners.append(callback)
+    
+    def record_success(self):
+        self._update(True, "服务器已连接")
+    
+    def record_failure(self, reason):
+        self._update(False, f"服务器未连接: {reason}")
+    
+    def _update(self, connected, message):
+        now = time.monotonic()
+        with self.lock:
+            changed = connected != self.connected or (not connected and self.failures == 0)
+            self.connected = connected
+            self.last_activity = now
+            if connected:
+                self.last_success = now
+                self.failures = 0
+                if changed:
+                    self.message = message
+            else:
+                self.failures += 1
+                self.message = message
+        if changed:
+            for callback in list(self.listeners):
+                try:
+                    callback(connected, message)
+                except Exception:
+                    logging.getLogger('MessageClient').exception("Connection listener failed")
+    
+    def claim_probe(self) -> bool:
+        """空闲或断开超过probe_interval时返回True，同时记下这次探测（几个线程同时检查时只有一个去探测）"""
+        now = time.monotonic()
+        with self.lock:
+            if now - self.last_activity < self.probe_interval:
+                return False
+            self.last_activity = now
+            return True
+    
+    def snapshot(self):
+        with self.lock:
+            return self.connected, self.message
+
+
+class PollScheduler:
+    """计算消息线程下一次轮询前等待的秒数
+    
+    - 服务端支持长轮询时，新消息在等待中立即返回，返回后隔min_interval再发下一次长轮询，不需要逐步放慢
+    - 不支持长轮询时：刚收到新消息后的active_period秒内按min_interval快速轮询（一波消息通常接连到来），
+      之后从interval开始，每次没有变化就乘以1.5，最长idle_max_interval
+    - 断开时按interval*2^(连续失败次数-1)指数退避，最长reconnect_max_interval
+    - 服务端给出的X-Poll-Interval是两次请求开始时间的最小间隔（长轮询本身等待的时间算在内），Retry-After是下限
+    - 最后乘上±jitter的随机抖动，一屋子客户端不会同时轮询
+    """
+    
+    def __init__(self, interval=2, min_interval=1, idle_max_interval=10, reconnect_max_interval=60,
+                 active_period=30, jitter=0.2):
+        self.interval = interval
+        self.min_interval = min_interval
+        self.idle_max_interval = idle_max_interval
+        self.reconnect_max_interval = reconnect_max_interval
+        self.active_period = active_period
+        self.jitter = jitter
+        self.idle_delay = interval
+        self.last_change = 0.0
+    
+    def next_delay(self, changed: bool, connected: bool, failures: int = 0,
+                   server_interval: Optional[float] = None, retry_after: Optional[float] = None,
+                   long_polled: bool = False, elapsed: float = 0) -> float:
+        """
+        Args:
+            long_polled: 这次请求是长轮询（服务端已经替客户端等待过）
+            elapsed: 这次请求花的秒数
+        """
+        now = time.monotonic()
+        if changed:
+            self.last_change = now
+            self.idle_delay = self.interval
+        if not connected:
+            delay = min(self.reconnect_max_interval, self.interval * 2 ** max(0, failures - 1))
+        elif long_polled or now - self.last_change < self.active_period:
+            delay = self.min_interval
+        else:
+            delay = self.idle_delay
+            self.idle_delay = min(self.idle_max_interval, self.idle_delay * 1.5)
+        delay = max(delay, (server_interval or 0) - elapsed, retry_after or 0)
+        return delay * random.uniform(1 - self.jitter, 1 + self.jitter)
+
+
+def parse_seconds(value) -> Optional[float]:
+    """解析X-Poll-Interval/Retry-After的秒数，不是数字（例如HTTP日期格式）时返回None"""
+    try:
+        seconds = float(value)
+    except (TypeError, ValueError):
+        return None
+    return seconds if seconds >= 0 else None
+
+
+class ConnectionAdapter(HTTPAdapter):
+    """在连接池适配器上记录每个请求的结果，用来判断连接状态"""
+    
+    def __init__(self, connection: ConnectionState, **kwargs):
+        self.connection = connection
+        super().__init__(**kwargs)
+    
+    def send(self, request, **kwargs):
+        try:
+            response = super().send(request, **kwargs)
+        except requests.RequestException as e:
+            self.connection.record_failure(type(e).__name__)
+            raise
+        if response.status_code >= 500 or response.status_code == BUSY_STATUS:
+            self.connection.record_failure(f"HTTP {response.status_code}")
+        else:
+            self.connection.record_success()
+        return response
+
+
 class MessageClient:
-    def __init__(self, config: Dict):
+    def __init__(self, config: Dict, connection: Optional[ConnectionState] = None):
+        """
+        Args:
+            connection: 记录连接状态的对象，默认新建一个（测试时可以传入自己的）
+        """
         self.config = config
         self.server_url = f"http://{config['client']['server_host']}:{config['client']['server_port']}"
         self.reconnect_interval = config['client']['reconnect_interval']
-        self.is_connected = False
+        # 只拉取指定优先级的消息（如网络较差时只要high和critical），为空表示全部
+        self.priority_filter = config['client'].get('priority_filter', [])
+        self.setup_logging()
+        self.setup_wire_format()
+        self.connection = connection or ConnectionState(self.reconnect_interval)
+        self.connection.add_listener(self.log_connection_change)
+        self.setup_session()
+        # 消息ID -> 图片数据，列表轮询不再重复下载图片
+        self.image_cache = {}
+        self.cache_lock = threading.Lock()
+        # 服务端在列表响应里建议的轮询间隔（X-Poll-Interval）和繁忙时要求等待的秒数（Retry-After）
+        self.server_poll_interval = None
+        self.retry_after = None
+        # 最近一次消息列表响应的版本号，用于长轮询
+        self.version = None
         self.monitor_thread = None
         self.should_stop = False
-        self.setup_logging()
     
     def setup_logging(self):
         logging.basicConfig(
@@ -23,61 +201,183 @@ class MessageClient:
         )
         self.logger = logging.getLogger('MessageClient')
     
+    def setup_wire_format(self):
+        """选择JSON库和传输格式（client.wire_format为msgpack时使用MessagePack，需要安装msgpack）"""
+        backend = codec.select_json_backend(self.config['client'].get('json_backend', 'auto'))
+        self.wire_format = self.config['client'].get('wire_format', 'json')
+        if self.wire_format == 'msgpack' and not codec.msgpack_available():
+            self.logger.warning("msgpack is not installed, falling back to JSON")
+            self.wire_format = 'json'
+        if self.wire_format == 'msgpack':
+            self.accept_header = f"{codec.MSGPACK_MIMETYPE}, {codec.JSON_MIMETYPE};q=0.5"
+        else:
+            self.accept_header = codec.JSON_MIMETYPE
+        self.logger.info(f"JSON backend: {backend}, wire format: {self.wire_format}")
+    
+    def setup_session(self):
+        """创建所有请求共用的HTTP会话
+        
+        监控线程、消息线程和界面操作都复用连接池里已建立的长连接，不再每个请求都重新握手。
+        连接池里的连接是线程安全的，pool_size要不少于同时发请求的线程数，否则多出来的连接用完就关闭。
+        连接失败时自动重试；GET/DELETE遇到502/503/504也重试（遵守Retry-After），发送消息的POST只重试连接失败。
+        每个请求的结果都记录到self.connection。
+        """
+        pool_size = self.config['client'].get('pool_size', 4)
+        retry = Retry(
+            total=self.config['client'].get('max_retries', 2),
+            connect=self.config['client'].get('max_retries', 2),
+            read=0,
+            backoff_factor=0.3,
+            status_forcelist=(502, 503, 504),
+            allowed_methods=frozenset(['GET', 'HEAD', 'DELETE']),
+            respect_retry_after_header=True,
+            raise_on_status=False
+        )
+        adapter = ConnectionAdapter(self.connection, pool_connections=1, pool_maxsize=pool_size, max_retries=retry)
+        self.session = requests.Session()
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+    
+    def log_connection_change(self, connected: bool, message: str):
+        if connected:
+            self.logger.info("Connected to server")
+        else:
+            self.logger.error(f"Connection lost: {message}")
+    
+    def decode_response(self, response):
+        """按响应的Content-Type解析JSON或MessagePack"""
+        if response.headers.get('Content-Type', '').split(';')[0].strip() in codec.MSGPACK_MIMETYPES:
+            return codec.msgpack_loads(response.content)
+        return codec.json_loads(response.content)
+    
+    def encode_request(self, data):
+        """按传输格式序列化请求体，返回(请求体, 请求头)"""
+        if self.wire_format == 'msgpack':
+            return codec.msgpack_dumps(data), {'Content-Type': codec.MSGPACK_MIMETYPE, 'Accept': self.accept_header}
+        return codec.json_dumps(data), {'Content-Type': codec.JSON_MIMETYPE}
+    
+    @property
+    def is_connected(self) -> bool:
+        """最近一次请求的结果，不发请求"""
+        return self.connection.connected
+    
     def check_connection(self) -> bool:
-        """检查服务器连接状态"""
+        """请求/api/health探测服务器（只在空闲或断开时需要，正常收发消息已经能说明连接状态）"""
         try:
-            response = requests.get(f"{self.server_url}/api/health", timeout=5)
+            response = self.session.get(f"{self.server_url}/api/health", timeout=5)
             if response.status_code == 200:
-                self.is_connected = True
-                self.logger.info("Connected to server")
                 return True
             else:
-                self.is_connected = False
                 self.logger.warning(f"Server returned status code: {response.status_code}")
                 return False
         except Exception as e:
-            self.is_connected = False
             self.logger.error(f"Connection error: {str(e)}")
             return False
     
-    def get_messages(self) -> List[Dict]:
-        """获取所有消息"""
+    def probe_if_due(self) -> bool:
+        """空闲或断开超过reconnect_interval时探测一次，返回当前连接状态"""
+        if self.connection.claim_probe():
+            self.check_connection()
+        return self.connection.connected
+    
+    def get_messages(self, priorities: Optional[List[str]] = None, wait: float = 0,
+                     version: Optional[int] = None) -> Optional[List[Dict]]:
+        """获取所有消息，请求失败时返回None（和服务端确实没有消息的空列表区分开）
+        
+        列表只取不含图片的字段，本地没有缓存图片的消息再按ID一次批量取回图片，
+        断线重连后补齐的新消息也只需要一次请求。
+        
+        Args:
+            priorities: 只获取这些优先级的消息，默认使用配置中的priority_filter
+            wait: 长轮询：version没变时服务端最多等待的秒数，有新消息立即返回
+            version: 上次响应里的版本号（self.version），配合wait使用
+        """
+        if priorities is None:
+            priorities = self.priority_filter
+        params = {'fields': ','.join(LIST_FIELDS)}
+        if priorities:
+            params['priority'] = ','.join(priorities)
+        if wait > 0 and version is not None:
+            params['wait'] = wait
+            params['version'] = version
+        else:
+            wait = 0
         try:
-            response = requests.get(f"{self.server_url}/api/messages", timeout=10)
+            response = self.session.get(f"{self.server_url}/api/messages", params=params,
+                                         headers={'Accept': self.accept_header}, timeout=10 + wait)
+            self.server_poll_interval = parse_seconds(response.headers.get('X-Poll-Interval'))
+            self.retry_after = parse_seconds(response.headers.get('Retry-After')) if response.status_code in (429, 503) else None
             if response.status_code == 200:
-                data = response.json()
+                data = self.decode_response(response)
                 messages = data.get('messages', [])
-                total = data.get('total', 0)
-                
-                # 如果总消息数大于当前返回的消息数，说明有分页
-                if total > len(messages):
-                    self.logger.info(f"Found {total} total messages, but only {len(messages)} returned. Fetching all messages...")
-                    all_messages = messages.copy()
-                    
-                    # 获取每个消息的详情
-                    for i in range(len(messages), total):
-                        message_detail = self.get_message(i)
-                        if message_detail:
-                            all_messages.append(message_detail)
-                        else:
-                            self.logger.warning(f"Failed to get message {i}")
-                    
-                    return all_messages
-                else:
-                    return messages
+                # 旧版本服务端没有version，不支持长轮询
+                self.version = data.get('version')
+                self.attach_images(messages)
+                return messages
             else:
                 self.logger.error(f"Failed to get messages: {response.status_code}")
-                return []
+                return None
         except Exception as e:
             self.logger.error(f"Error getting messages: {str(e)}")
-            return []
+            return None
+    
+    def attach_images(self, messages: List[Dict]):
+        """给列表里的消息补上图片数据：先查本地缓存，缺的按ID批量获取；清理已不在列表里的缓存"""
+        with self.cache_lock:
+            # 旧版本服务端不支持fields，列表里本来就带图片
+            for message in messages:
+                if 'image_data' in message:
+                    self.image_cache[message['id']] = message['image_data']
+            missing = [message['id'] for message in messages
+                       if message['id'] not in self.image_cache and message.get('type') != 'text']
+        
+        if missing:
+            for message in self.get_messages_by_ids(missing, fields=('id', 'image_data')):
+                with self.cache_lock:
+                    self.image_cache[message['id']] = message.get('image_data')
+        
+        with self.cache_lock:
+            current_ids = {message['id'] for message in messages}
+            for message_id in list(self.image_cache):
+                if message_id not in current_ids:
+                    del self.image_cache[message_id]
+            for message in messages:
+                # 批量获取失败的图片暂时为空，下次轮询再取
+                message['image_data'] = self.image_cache.get(message['id'], '')
+    
+    def get_messages_by_ids(self, message_ids: List[int], fields: Optional[tuple] = None) -> List[Dict]:
+        """按ID列表批量获取消息（GET /api/messages?ids=1,2,3），每次最多IDS_PER_REQUEST条
+        
+        Args:
+            fields: 只获取这些字段，默认全部
+        """
+        messages = []
+        for start in range(0, len(message_ids), IDS_PER_REQUEST):
+            chunk = message_ids[start:start + IDS_PER_REQUEST]
+            params = {'ids': ','.join(str(message_id) for message_id in chunk)}
+            if fields:
+                params['fields'] = ','.join(fields)
+            try:
+                response = self.session.get(f"{self.server_url}/api/messages", params=params,
+                                             headers={'Accept': self.accept_header}, timeout=30)
+                if response.status_code != 200:
+                    self.logger.error(f"Failed to get messages by ids: {response.status_code}")
+                    continue
+                wanted = set(chunk)
+                # 旧版本服务端不认识ids参数，会返回整个列表，按ID过滤
+                messages.extend(message for message in self.decode_response(response).get('messages', [])
+                                if message.get('id') in wanted)
+            except Exception as e:
+                self.logger.error(f"Error getting messages by ids: {str(e)}")
+        return messages
     
     def get_message(self, message_id: int) -> Optional[Dict]:
         """获取单个消息详情"""
         try:
-            response = requests.get(f"{self.server_url}/api/messages/{message_id}", timeout=10)
+            response = self.session.get(f"{self.server_url}/api/messages/{message_id}",
+                                         headers={'Accept': self.accept_header}, timeout=10)
             if response.status_code == 200:
-                return response.json()
+                return self.decode_response(response)
             else:
                 self.logger.error(f"Failed to get message {message_id}: {response.status_code}")
                 return None
@@ -85,7 +385,8 @@ class MessageClient:
             self.logger.error(f"Error getting message {message_id}: {str(e)}")
             return None
     
-    def send_message(self, message_type: str, content: str = "", image_data: str = "", title: str = "") -> bool:
+    def send_message(self, message_type: str, content: str = "", image_data: str = "", title: str = "",
+                     priority: str = "normal") -> bool:
         """发送消息到服务器
         
         Args:
@@ -93,6 +394,7 @@ class MessageClient:
             content: 文本内容
             image_data: base64编码的图片数据
             title: 消息标题
+            priority: 优先级 ('low', 'normal', 'high', 'critical')
         
         Returns:
             bool: 发送是否成功
@@ -102,17 +404,20 @@ class MessageClient:
                 'type': message_type,
                 'content': content,
                 'image_data': image_data,
-                'title': title or f"{message_type.upper()}消息"
+                'title': title or f"{message_type.upper()}消息",
+                'priority': priority
             }
             
-            response = requests.post(
+            body, headers = self.encode_request(message_data)
+            response = self.session.post(
                 f"{self.server_url}/api/messages",
-                json=message_data,
+                data=body,
+                headers=headers,
                 timeout=10
             )
             
             if response.status_code == 200:
-                result = response.json()
+                result = self.decode_response(response)
                 self.logger.info(f"Message sent successfully: {result.get('message_id')}")
                 return True
             else:
@@ -126,7 +431,7 @@ class MessageClient:
     def delete_message(self, message_id: int) -> bool:
         """删除消息"""
         try:
-            response = requests.delete(f"{self.server_url}/api/messages/{message_id}", timeout=10)
+            response = self.session.delete(f"{self.server_url}/api/messages/{message_id}", timeout=10)
             if response.status_code == 200:
                 self.logger.info(f"Message deleted successfully: {message_id}")
                 return True
@@ -137,10 +442,29 @@ class MessageClient:
             self.logger.error(f"Error deleting message {message_id}: {str(e)}")
             return False
     
+    def delete_messages(self, message_ids: List[int]) -> Optional[int]:
+        """批量删除消息，一次请求在服务端一个事务内完成
+        
+        Returns:
+            实际删除的条数，失败返回None
+        """
+        try:
+            response = self.session.delete(f"{self.server_url}/api/messages", json={'ids': list(message_ids)}, timeout=30)
+            if response.status_code == 200:
+                deleted_count = response.json().get('deleted_count', 0)
+                self.logger.info(f"Messages deleted successfully: {deleted_count} of {len(message_ids)}")
+                return deleted_count
+            else:
+                self.logger.error(f"Failed to delete messages: {response.status_code}")
+                return None
+        except Exception as e:
+            self.logger.error(f"Error deleting messages: {str(e)}")
+            return None
+    
     def delete_all_messages(self) -> bool:
         """删除所有消息"""
         try:
-            response = requests.delete(f"{self.server_url}/api/messages", timeout=30)
+            response = self.session.delete(f"{self.server_url}/api/messages", timeout=30)
             if response.status_code == 200:
                 result = response.json()
                 deleted_count = result.get('deleted_count', 0)
@@ -154,11 +478,11 @@ class MessageClient:
             return False
     
     def start_connection_monitor(self):
-        """启动连接监控线程"""
+        """启动连接监控线程：只在空闲（没有其他请求）或断开时探测，消息线程正常轮询时不会多发请求"""
         def monitor():
             while not self.should_stop:
-                self.check_connection()
-                time.sleep(self.reconnect_interval)
+                self.probe_if_due()
+                time.sleep(1)
         
         self.monitor_thread = threading.Thread(target=monitor, daemon=True)
         self.monitor_thread.start()
@@ -176,11 +500,16 @@ class MessageClient:
             if self.monitor_thread.is_alive():
                 self.logger.warning("Monitor thread did not stop gracefully")
         
+        self.session.close()
         self.logger.info("MessageClient closed")
     
     def format_message_preview(self, message: Dict) -> str:
         """格式化消息预览文本 - 显示标题、时间和部分内容"""
         title = message.get('title', '无标题')
+        # 高优先级消息在标题前加标记
+        priority_mark = PRIORITY_MARKS.get(message.get('priority'), '')
+        if priority_mark:
+            title = f"{priority_mark}{title}"
         timestamp = message.get('timestamp', '')
         content = message.get('content', '')
         
@@ -251,7 +580,10 @@ class MessageClient:
         except:
             time_str = timestamp
         
-        detail = f"标题: {title}  |  时间: {time_str}  |  类型: {msg_type}  |  ID: {message.get('id', 'N/A')}\n"
+        detail = f"标题: {title}  |  时间: {time_str}  |  类型: {msg_type}  |  ID: {message.get('id', 'N/A')}"
+        if message.get('priority') in PRIORITY_MARKS:
+            detail += f"  |  优先级: {message['priority']}"
+        detail += "\n"
         detail += "-" * 82 + "\n"
         
         if content:
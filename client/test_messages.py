@@ -18,6 +18,9 @@ config = {
 
 client = MessageClient(config)
 messages = client.get_messages()
+if messages is None:
+    print('Failed to get messages')
+    sys.exit(1)
 print(f'Got {len(messages)} messages')
 for msg in messages:
     print(f'Message ID: {msg.get("id")}, Title: {msg.get("title")}')
\ No newline at end of file
@@ -10,6 +10,7 @@ from PySide2.QtUiTools import QUiLoader
 import json
 import base64
 import threading
+import time
 from datetime import datetime
 from typing import List, Dict
 
@@ -251,7 +252,7 @@ class CustomMessageBox(QDialog):
         dialog.exec_()
 
 # 导入网络客户端
-from network_client import MessageClient
+from network_client import MessageClient, PollScheduler
 # 导入图片管理器
 from image_manager import ImageManager, create_image_viewer, save_image_automatically
 
@@ -264,23 +265,44 @@ class MessageThread(QThread):
         super().__init__()
         self.client = client
         self.running = True
-        self.update_interval = 2  # 更新间隔（秒）
+        self.wakeup = threading.Event()
+        # 当前这次获取消息列表完成（或被stop打断）的事件，和等待轮询间隔用的wakeup分开
+        self.fetch_done = threading.Event()
+        # 轮询间隔随消息活跃程度、连接状态和服务端建议自动调整
+        settings = client.config['client']
+        self.scheduler = PollScheduler(
+            interval=settings.get('poll_interval', 2),
+            min_interval=settings.get('poll_min_interval', 1),
+            idle_max_interval=settings.get('poll_max_interval', 10),
+            reconnect_max_interval=settings.get('reconnect_max_interval', 60),
+            jitter=settings.get('poll_jitter', 0.2)
+        )
+        # 长轮询时服务端最多等待的秒数（有新消息立即返回），0表示不用长轮询
+        self.long_poll_wait = settings.get('long_poll_wait', 25)
+        # 连接状态由客户端根据每个请求的结果判断，变化时通过信号通知界面
+        self.client.connection.add_listener(self.connection_status.emit)
     
     def run(self):
         """线程主循环"""
         last_messages = None
         while self.running:
+            changed = False
+            long_polled = False
+            elapsed = 0
             try:
-                # 检查连接状态
-                is_connected = self.client.check_connection()
-                status_msg = "服务器已连接" if is_connected else "服务器未连接"
-                self.connection_status.emit(is_connected, status_msg)
-                
-                # 获取消息列表
-                if is_connected:
-                    messages = self.client.get_messages()
+                # 连接正常时直接轮询（轮询成功本身就说明连接正常），断开时按退避间隔探测
+                if self.client.is_connected or self.client.check_connection():
+                    # 拿到过版本号（服务端支持长轮询）之后都用长轮询，新消息（尤其是critical）不用等下一个轮询间隔
+                    long_polled = self.long_poll_wait > 0 and self.client.version is not None
+                    started = time.monotonic()
+                    messages = self.fetch_messages(self.long_poll_wait if long_polled else 0)
+                    elapsed = time.monotonic() - started
+                    if not self.running:
+                        break
+                    # 请求失败时返回None，保留界面上原来的列表
                     # 只有在消息列表发生变化时才发送更新信号
-                    if messages != last_messages:
+                    if messages is not None and messages != last_messages:
+                        changed = last_messages is not None
                         self.messages_updated.emit(messages)
                         last_messages = messages
                 
@@ -288,11 +310,35 @@ class MessageThread(QThread):
                 self.connection_status.emit(False, f"错误: {str(e)}")
             
             # 等待下一次更新
-            self.msleep(self.update_interval * 1000)
+            delay = self.scheduler.next_delay(changed, self.client.is_connected, self.client.connection.failures,
+                                              self.client.server_poll_interval, self.client.retry_after,
+                                              long_polled, elapsed)
+            self.wakeup.wait(delay)
+            self.wakeup.clear()
+    
+    def fetch_messages(self, wait):
+        """在守护线程里获取消息列表，长轮询挂起期间stop()也能立即返回（返回None）"""
+        result = {}
+        # 先换上新的事件再检查running，stop()总能打断这一次等待
+        done = self.fetch_done = threading.Event()
+        if not self.running:
+            return None
+        
+        def fetch():
+            try:
+                result['messages'] = self.client.get_messages(wait=wait, version=self.client.version)
+            finally:
+                done.set()
+        
+        threading.Thread(target=fetch, daemon=True).start()
+        done.wait()
+        return result.get('messages')
     
     def stop(self):
         """停止线程"""
         self.running = False
+        self.wakeup.set()
+        self.fetch_done.set()
         self.wait()
 
 class MessageUI(QWidget):
@@ -325,6 +371,7 @@ class MessageUI(QWidget):
         self.message_thread = MessageThread(client)
         self.message_thread.messages_updated.connect(self.update_message_list)
         self.message_thread.connection_status.connect(self.update_connection_status)
+        self.update_connection_status(*client.connection.snapshot())
         self.message_thread.start()
     
     def setup_ui(self):
@@ -448,6 +495,8 @@ class MessageUI(QWidget):
             self.message_list.setWordWrap(True)
             # 通过设置item委托来控制高度，而不是样式表
             self.message_list.setItemDelegate(QListWidget.itemDelegate(self.message_list))
+            # 支持Ctrl/Shift多选，用于批量删除
+            self.message_list.setSelectionMode(QListWidget.ExtendedSelection)
         
         # 设置窗口属性
         self.setWindowTitle("消息客户端")
@@ -525,11 +574,7 @@ class MessageUI(QWidget):
         
         # 如果消息列表没有变化，只更新统计信息
         if not messages_changed:
-            # 更新状态栏显示消息统计信息
-            if hasattr(self, 'message_thread') and self.message_thread:
-                is_connected = self.client.check_connection()
-                status_msg = "服务器已连接" if is_connected else "服务器未连接"
-                self.update_connection_status(is_connected, status_msg)
+            self.refresh_status_bar()
             return
         
         # 消息列表有变化，进行完整更新
@@ -601,11 +646,11 @@ class MessageUI(QWidget):
             self.message_list.verticalScrollBar().setValue(scroll_position)
         
         # 更新状态栏显示消息统计信息
-        if hasattr(self, 'message_thread') and self.message_thread:
-            # 模拟连接状态更新来触发统计信息显示
-            is_connected = self.client.check_connection()
-            status_msg = "服务器已连接" if is_connected else "服务器未连接"
-            self.update_connection_status(is_connected, status_msg)
+        self.refresh_status_bar()
+    
+    def refresh_status_bar(self):
+        """用最近一次请求得到的连接状态重画状态栏（不发请求）"""
+        self.update_connection_status(*self.client.connection.snapshot())
     
     def update_connection_status(self, is_connected: bool, status_msg: str):
         """更新连接状态"""
@@ -753,11 +798,14 @@ class MessageUI(QWidget):
         self.messages_cleared = False
         try:
             messages = self.client.get_messages()
+            if messages is None:
+                self.info_label.setText("刷新失败: 无法获取消息列表")
+                return
             self.update_message_list(messages)
             # update_message_list方法中已经会更新统计信息，这里不需要重复设置
             self.info_label.setText("消息列表已刷新")
             # 延迟更新统计信息
-            QTimer.singleShot(100, lambda: self.update_connection_status(True, "已连接"))
+            QTimer.singleShot(100, self.refresh_status_bar)
         except Exception as e:
             self.info_label.setText(f"刷新失败: {str(e)}")
     
@@ -1019,10 +1067,16 @@ class MessageUI(QWidget):
                 """)
                 
                 # 添加删除动作
-                delete_action = menu.addAction("删除消息")
-                # 使用functools.partial传递message_id和index，而不是item对象
                 import functools
-                delete_action.triggered.connect(functools.partial(self.delete_message_by_id, message_id, index))
+                selected_items = self.message_list.selectedItems()
+                if len(selected_items) > 1 and item in selected_items:
+                    # 多选时批量删除选中的消息
+                    delete_action = menu.addAction(f"删除选中的 {len(selected_items)} 条消息")
+                    delete_action.triggered.connect(self.delete_selected_messages)
+                else:
+                    delete_action = menu.addAction("删除消息")
+                    # 使用functools.partial传递message_id和index，而不是item对象
+                    delete_action.triggered.connect(functools.partial(self.delete_message_by_id, message_id, index))
                 
                 # 显示菜单
                 menu.exec_(self.message_list.mapToGlobal(position))
@@ -1083,7 +1137,7 @@ class MessageUI(QWidget):
                     self.info_label.setText(f"消息 {message_id} 已删除")
 
                     # 9. 延迟更新统计信息
-                    QTimer.singleShot(100, lambda: self.update_connection_status(True, "已连接"))
+                    QTimer.singleShot(100, self.refresh_status_bar)
                     
                     print(f"消息 {message_id} 删除成功")
                     
@@ -1120,6 +1174,71 @@ class MessageUI(QWidget):
         # 调用原来的delete_message方法
         self.delete_message(message_id, item)
     
+    def delete_selected_messages(self):
+        """批量删除选中的消息（服务端一次请求、一个事务完成）"""
+        # 确认之前先记下选中消息的ID：对话框打开期间消息线程可能重建列表，行号会变
+        rows = sorted(self.message_list.row(item) for item in self.message_list.selectedItems())
+        message_ids = [self.current_messages[i]['id'] for i in rows
+                       if 0 <= i < len(self.current_messages) and self.current_messages[i].get('id')]
+        if not message_ids:
+            return
+        
+        # 确认对话框
+        reply = CustomMessageBox.custom_question(
+            self, 
+            "批量删除----确认删除", 
+            f"确定要删除选中的 {len(message_ids)} 条消息吗？\n\n此操作将同时删除本地记录和服务端数据库中的数据。",
+            QMessageBox.Yes | QMessageBox.No,
+            QMessageBox.No
+        )
+        if reply != QMessageBox.Yes:
+            return
+        
+        try:
+            # 1. 从服务端批量删除
+            deleted_count = self.client.delete_messages(message_ids)
+            if deleted_count is None:
+                CustomMessageBox.custom_warning(
+                    self, 
+                    "删除失败", 
+                    "无法从服务端删除选中的消息，请检查网络连接。"
+                )
+                return
+            
+            # 2. 清理本地状态和保存的图片
+            from image_manager import delete_saved_image
+            for message_id in message_ids:
+                self.read_status.pop(message_id, None)
+                self.processed_messages.discard(message_id)
+                try:
+                    delete_saved_image(message_id)
+                except Exception as e:
+                    print(f"删除本地图片文件失败: {e}")
+            
+            # 3. 按ID在当前列表里重新找到这些消息，从当前消息列表和UI列表中移除（倒序，保证索引有效）
+            deleted_ids = set(message_ids)
+            indexes = [i for i, message in enumerate(self.current_messages) if message.get('id') in deleted_ids]
+            current_row = self.message_list.currentRow()
+            for index in reversed(indexes):
+                del self.current_messages[index]
+                self.message_list.takeItem(index)
+            if current_row in indexes:
+                self.clear_display()
+            
+            # 4. 保存状态并提示
+            self.save_read_status()
+            self.info_label.setText(f"已删除 {len(message_ids)} 条消息")
+            QTimer.singleShot(100, self.refresh_status_bar)
+            print(f"批量删除 {len(message_ids)} 条消息成功，服务端删除 {deleted_count} 条")
+            
+        except Exception as e:
+            CustomMessageBox.custom_critical(
+                self, 
+                "删除错误", 
+                f"批量删除消息时发生错误：\n{str(e)}"
+            )
+            print(f"批量删除消息时发生错误: {e}")
+    
     def mark_all_as_read(self):
         """将所有未读消息标记为已读"""
         print("调试: mark_all_as_read 方法被调用")
@@ -1152,7 +1271,7 @@ class MessageUI(QWidget):
 
             
             # 延迟更新统计信息
-            QTimer.singleShot(100, lambda: self.update_connection_status(True, "已连接"))
+            QTimer.singleShot(100, self.refresh_status_bar)
         else:
             # 如果没有未读消息，显示提示
             self.info_label.setText("没有未读消息需要标记")
@@ -1193,7 +1312,7 @@ class MessageUI(QWidget):
 
             
             # 延迟更新统计信息
-            QTimer.singleShot(100, lambda: self.update_connection_status(True, "已连接"))
+            QTimer.singleShot(100, self.refresh_status_bar)
         else:
             # 如果没有未读消息，显示提示
             self.info_label.setText("没有未读消息需要标记")
@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+截图感知哈希去重
+功能：脚本每一轮都发截图，画面其实没变化。这里给每张图算一个差值哈希（dHash），
+和同一个标题（或频道）上一次发出去的图比较，汉明距离不超过阈值就认为是同一画面，不发送，只计数。
+
+需要Pillow和NumPy（pip install pillow numpy），没有安装时不做去重，所有图片照常发送。
+"""
+
+import logging
+import threading
+
+# Pillow和NumPy是可选依赖
+try:
+    import numpy as np
+    from PIL import Image
+    HASH_AVAILABLE = True
+except ImportError:
+    HASH_AVAILABLE = False
+
+logger = logging.getLogger('sender')
+
+
+def dhash(image, hash_size=8):
+    """计算图片的差值哈希：缩成(hash_size+1)*hash_size的灰度图，比较每行相邻像素的明暗
+
+    参数:
+        image: 图片文件路径或PIL图片
+
+    返回:
+        int: hash_size*hash_size位的哈希值
+    """
+    if not isinstance(image, Image.Image):
+        with Image.open(image) as opened:
+            return dhash(opened, hash_size)
+    # JPEG可以在解码时直接缩小，省掉大部分解码时间
+    image.draft('L', (image.width // 8 or 1, image.height // 8 or 1))
+    small = image.convert('L').resize((hash_size + 1, hash_size), Image.BOX)
+    pixels = np.asarray(small, dtype=np.int16)
+    bits = pixels[:, 1:] > pixels[:, :-1]
+    return int.from_bytes(np.packbits(bits).tobytes(), 'big')
+
+
+def hamming_distance(a, b):
+    return bin(a ^ b).count('1')
+
+
+class ScreenshotDeduper:
+    """按标题（或频道）记住上一次发出去的图片哈希，相似的图片跳过
+
+    参数:
+        max_distance (int): 汉明距离不超过这个值就算相同画面（64位哈希，0表示完全一样，一般取4~8）
+        key (str): 按 'title' 还是 'channel' 区分不同的画面
+        hash_size (int): 哈希的边长，哈希位数是它的平方
+    """
+
+    def __init__(self, max_distance=5, key='title', hash_size=8):
+        if key not in ('title', 'channel'):
+            raise ValueError(f"Unknown dedupe key: {key}")
+        self.max_distance = max_distance
+        self.key = key
+        self.hash_size = hash_size
+        self.enabled = HASH_AVAILABLE
+        if not self.enabled:
+            logger.warning("Screenshot dedupe needs Pillow and NumPy, sending every image")
+        self.lock = threading.Lock()
+        self.last_hashes = {}
+        self.suppressed = {}  # 每个标题/频道跳过的图片数
+        self.stats = {'checked': 0, 'suppressed': 0, 'errors': 0}
+
+    def is_duplicate(self, message, image=None):
+        """判断消息里的图片和同一标题/频道上一次发出的图片是否相同画面；不相同时记下它的哈希
+
+        参数:
+            message: sender里的消息字典
+            image: 已经打开的图片（可选），没有时读取message['image_path']
+        """
+        if not self.enabled or not (image or message.get('image_path')):
+            return False
+        try:
+            value = dhash(image if image is not None else message['image_path'], self.hash_size)
+        except Exception as e:
+            logger.warning(f"Cannot hash image for '{message['title']}': {str(e)}")
+            with self.lock:
+                self.stats['errors'] += 1
+            return False
+        key = message.get(self.key, '')
+        with self.lock:
+            self.stats['checked'] += 1
+            last = self.last_hashes.get(key)
+            if last is not None and hamming_distance(last, value) <= self.max_distance:
+                self.suppressed[key] = self.suppressed.get(key, 0) + 1
+                self.stats['suppressed'] += 1
+                return True
+            self.last_hashes[key] = value
+            return False
+
+    def snapshot(self):
+        with self.lock:
+            return dict(self.stats, by_key=dict(self.suppressed))
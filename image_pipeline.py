@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+发送前的图片处理
+功能：截图往往是整屏1366x768的BMP（3MB），真正要看的只是血条、提示框这样的一小块。
+发送前先裁剪出关心的区域（可以有多块，竖着拼成一张），再把最长边缩到max_edge以内，
+最后编码成PNG/WebP/JPEG，上传的数据量通常能小几十倍。处理在发送器的后台线程里进行。
+
+需要Pillow（pip install pillow），没有安装时图片原样发送。
+"""
+
+import atexit
+import logging
+import os
+import shutil
+import tempfile
+
+# Pillow是可选依赖
+try:
+    from PIL import Image
+    PIL_AVAILABLE = True
+except ImportError:
+    PIL_AVAILABLE = False
+
+logger = logging.getLogger('sender')
+
+FORMAT_EXTENSIONS = {'PNG': '.png', 'WEBP': '.webp', 'JPEG': '.jpg'}
+
+
+class ImagePipeline:
+    """裁剪、缩小、编码
+
+    参数:
+        regions: 关心的区域列表，每个区域是(left, top, right, bottom)；都在0~1之间（写成小数）时按图片宽高的比例计算，
+                 方便不同分辨率共用一套配置。None表示不裁剪
+        max_edge (int): 最长边的上限（像素），0表示不缩小
+        format (str): 输出格式 png/webp/jpeg
+        quality (int): webp/jpeg的质量
+        output_dir (str): 处理后图片的临时目录，None时新建一个临时目录，close()或程序退出时删除；
+                          传入的目录不会被删除
+    """
+
+    def __init__(self, regions=None, max_edge=0, format='png', quality=80, output_dir=None):
+        self.regions = [tuple(region) for region in regions or []]
+        for region in self.regions:
+            if len(region) != 4 or region[0] >= region[2] or region[1] >= region[3]:
+                raise ValueError(f"Invalid region: {region}")
+        self.max_edge = max_edge
+        self.format = format.upper().replace('JPG', 'JPEG')
+        if self.format not in FORMAT_EXTENSIONS:
+            raise ValueError(f"Unsupported image format: {format}")
+        self.quality = quality
+        self.enabled = PIL_AVAILABLE
+        if not self.enabled:
+            logger.warning("Image pipeline needs Pillow, images will be sent as-is")
+        self.owns_output_dir = output_dir is None
+        if self.owns_output_dir:
+            self.output_dir = tempfile.mkdtemp(prefix='msg-sender-')
+            atexit.register(self.close)
+        else:
+            self.output_dir = os.path.abspath(output_dir)
+            os.makedirs(self.output_dir, exist_ok=True)
+        self.stats = {'processed': 0, 'errors': 0, 'input_bytes': 0, 'output_bytes': 0}
+
+    def _box(self, region, width, height):
+        """把区域换算成像素坐标，并限制在图片范围内"""
+        if all(0 <= value <= 1 for value in region) and any(isinstance(value, float) for value in region):
+            region = (region[0] * width, region[1] * height, region[2] * width, region[3] * height)
+        left, top, right, bottom = (int(round(value)) for value in region)
+        return max(0, left), max(0, top), min(width, right), min(height, bottom)
+
+    def load(self, image_path):
+        """读取图片并裁剪、缩小，返回处理后的图片；Pillow不可用或读取失败时返回None（原图照常发送）"""
+        if not self.enabled:
+            return None
+        try:
+            with Image.open(image_path) as image:
+                if image.mode not in ('RGB', 'RGBA', 'L'):
+                    image = image.convert('RGBA' if 'A' in image.getbands() else 'RGB')
+                if self.regions:
+                    image = self.crop(image)
+                else:
+                    image.load()
+                if self.max_edge and max(image.size) > self.max_edge:
+                    scale = self.max_edge / max(image.size)
+                    size = (max(1, round(image.width * scale)), max(1, round(image.height * scale)))
+                    image = image.resize(size, Image.LANCZOS, reducing_gap=3.0)
+                return image
+        except Exception as e:
+            logger.warning(f"Cannot process image {image_path}, sending original: {str(e)}")
+            self.stats['errors'] += 1
+            return None
+
+    def crop(self, image):
+        """裁剪出所有区域，多块时竖着拼成一张（左对齐）"""
+        boxes = [self._box(region, image.width, image.height) for region in self.regions]
+        boxes = [box for box in boxes if box[0] < box[2] and box[1] < box[3]]
+        if not boxes:
+            raise ValueError(f"No region inside the {image.width}x{image.height} image")
+        parts = [image.crop(box) for box in boxes]
+        if len(parts) == 1:
+            return parts[0]
+        canvas = Image.new(image.mode, (max(part.width for part in parts), sum(part.height for part in parts)))
+        top = 0
+        for part in parts:
+            canvas.paste(part, (0, top))
+            top += part.height
+        return canvas
+
+    def encode(self, image, message):
+        """把处理后的图片编码写到临时文件，返回指向它的新消息字典（image_path换成临时文件）"""
+        extension = FORMAT_EXTENSIONS[self.format]
+        output_path = os.path.join(self.output_dir, f"{message['client_msg_id']}{extension}")
+        if self.format == 'JPEG' and image.mode != 'RGB':
+            image = image.convert('RGB')
+        options = {'optimize': True} if self.format == 'PNG' else {'quality': self.quality}
+        image.save(output_path, self.format, **options)
+
+        self.stats['processed'] += 1
+        try:
+            self.stats['input_bytes'] += os.path.getsize(message['image_path'])
+        except OSError:
+            pass
+        self.stats['output_bytes'] += os.path.getsize(output_path)
+        name = os.path.splitext(os.path.basename(message['image_path']))[0] + extension
+        return dict(message, image_path=output_path, image_name=name)
+
+    def cleanup(self, message):
+        """删除encode生成的临时文件"""
+        if message.get('image_path', '').startswith(self.output_dir + os.sep):
+            try:
+                os.remove(message['image_path'])
+            except OSError:
+                pass
+
+    def close(self):
+        """删除自己创建的临时目录（之后不能再encode）；程序退出时会自动调用"""
+        if self.owns_output_dir:
+            atexit.unregister(self.close)
+            shutil.rmtree(self.output_dir, ignore_errors=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+命令行发送工具（msg-send）
+功能：在shell脚本里发消息，不用每条消息都启动一次Python、建一次TCP连接。
+可以直接用参数发一条，也可以从标准输入一行一行读（每行一条JSON消息，或者一行普通文本）。
+发送用的是sender.py里的MessageSender（和游戏脚本同一套逻辑）：一个HTTP长连接，
+排队的多条文字消息用批量接口（POST /api/messages/batch）一次发出，带图片的消息流式上传，
+连不上或服务端5xx时退避重试，指定 --spool 后发不出去的消息暂存到本地，下次运行时补发。
+
+    python msg_send.py -s http://192.168.41.1:5001 -t 角色死亡 -c 已经飘了 -i screen.png -p high
+    tail -f game.log | grep 掉线 | python msg_send.py -s http://192.168.41.1:5001 -t 掉线日志
+    python msg_send.py -s http://192.168.41.1:5001 < messages.ndjson
+
+JSON行的字段和 POST /api/messages 一样（title、content、priority、channel、sender、client_msg_id），
+另外可以用 image 指定图片路径。全部发送成功返回0，有消息发送失败返回1。
+"""
+
+import argparse
+import json
+import logging
+import os
+import sys
+
+from sender import BLOCK, MessageSender
+
+# 连接失败或服务端5xx时重试的次数
+RETRIES = 3
+
+
+def parse_line(line, args):
+    """把标准输入的一行转成消息：JSON对象按字段读取，其他内容当作消息正文"""
+    defaults = {'title': args.title, 'priority': args.priority, 'channel': args.channel, 'sender': args.sender}
+    if args.format != 'lines' and line.startswith('{'):
+        try:
+            message = json.loads(line)
+            if isinstance(message, dict):
+                return dict(defaults, **message)
+        except ValueError:
+            if args.format == 'ndjson':
+                raise
+    if args.format == 'ndjson':
+        raise ValueError('not a JSON object')
+    return dict(defaults, content=line)
+
+
+def submit(sender, message):
+    """把一条消息放进发送队列（队列满时等待）"""
+    return sender.send(
+        str(message.get('title') or '无标题'),
+        str(message.get('content') or ''),
+        image_path=message.get('image') or None,
+        priority=message.get('priority') or 'normal',
+        channel=str(message.get('channel') or ''),
+        sender=message.get('sender'),
+        client_msg_id=message.get('client_msg_id')
+    )
+
+
+def pump_stdin(sender, args):
+    """从标准输入读消息，返回无法解析的行数；发送器在后台边读边发，积压的文字消息自动成批发送"""
+    invalid = 0
+    for line in sys.stdin:
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            submit(sender, parse_line(line, args))
+        except ValueError as e:
+            print(f"❌ 无法解析的行: {line[:100]} ({str(e)})", file=sys.stderr)
+            invalid += 1
+    return invalid
+
+
+def main():
+    parser = argparse.ArgumentParser(description='发送消息到消息服务器；不带 -c/-i 时从标准输入读取')
+    parser.add_argument('-s', '--server', default=os.environ.get('MSG_SERVER', 'http://127.0.0.1:5001'),
+                        help='服务器地址，默认取环境变量MSG_SERVER')
+    parser.add_argument('-t', '--title', default='无标题', help='消息标题（读标准输入时是每条消息的默认标题）')
+    parser.add_argument('-c', '--content', help='消息内容')
+    parser.add_argument('-i', '--image', help='图片文件路径')
+    parser.add_argument('-p', '--priority', default='normal', choices=['low', 'normal', 'high', 'critical'])
+    parser.add_argument('--channel', default='', help='频道')
+    parser.add_argument('--sender', help='发送者ID（服务端按它限流）')
+    parser.add_argument('--stdin', action='store_true', help='从标准输入读取消息')
+    parser.add_argument('--format', default='auto', choices=['auto', 'ndjson', 'lines'],
+                        help='标准输入的格式：auto按行判断，ndjson每行一条JSON，lines每行一条文本')
+    parser.add_argument('--batch-size', type=int, default=100, help='每批最多发送的消息数')
+    parser.add_argument('--no-batch', action='store_true', help='不用批量接口，逐条发送')
+    parser.add_argument('--timeout', type=float, default=30, help='请求超时（秒）')
+    parser.add_argument('--spool', help='离线暂存文件路径：发不出去的消息存到这里，下次运行时补发')
+    args = parser.parse_args()
+
+    # 发送器的错误日志直接输出到标准错误
+    logging.basicConfig(level=logging.WARNING, format='❌ %(message)s')
+    sender = MessageSender(args.server, max_queue=args.batch_size * 4, policy=BLOCK, timeout=args.timeout,
+                           batch_size=args.batch_size, use_batch=not args.no_batch, retries=RETRIES,
+                           spool_path=args.spool)
+    invalid = 0
+    if args.stdin or (args.content is None and args.image is None):
+        invalid = pump_stdin(sender, args)
+    else:
+        submit(sender, {
+            'title': args.title,
+            'content': args.content,
+            'image': args.image,
+            'priority': args.priority,
+            'channel': args.channel,
+            'sender': args.sender
+        })
+    # 有离线暂存时顺便把以前暂存的消息补发掉（服务器连不上时不等）
+    sender.flush(spool=True)
+    sender.close()
+
+    stats = sender.stats
+    failed = stats['failed'] + invalid
+    summary = f"发送完成: 成功 {stats['sent'] + stats['replayed']} 条, 失败 {failed} 条"
+    pending = len(sender.spool) if sender.spool is not None else 0
+    if pending:
+        summary += f", 暂存待补发 {pending} 条"
+    print(summary, file=sys.stderr)
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,630 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+后台消息发送器
+功能：游戏脚本里调用send只是把消息放进内存队列，马上返回；读图片、base64编码和HTTP请求都在后台线程里做，
+服务器慢或者连不上都不会卡住脚本。队列有上限，满了按策略丢弃；脚本退出时会尽量把队列里的消息发完。
+带图片的消息默认走二进制上传接口，按块从文件读取直接发送，不把整张图读进内存，
+大截图在32位Python里也只占固定的几十KB；服务端没有这个接口时自动改用原来的JSON方式。
+传入pipeline（image_pipeline.ImagePipeline）后，发送前先裁剪出关心的区域、缩小并重新编码，再去重和上传。
+传入dedupe（image_hash.ScreenshotDeduper）后，和同一标题上一次发出的截图几乎一样的图片不再发送，只计数。
+超过resumable_threshold的图片用断点续传会话分块上传，Wi-Fi不稳中途超时后从已收到的位置接着传，不用从头再来。
+指定spool_path后，服务器连不上（或返回5xx）的消息会存到本地暂存文件，服务器恢复后按顺序补发，脚本重启也不会丢。
+
+用法：
+    from sender import MessageSender
+    sender = MessageSender("http://192.168.41.1:5001", spool_path=r"D:\\scripts\\spool\\outbox.db")
+    sender.send("角色真正死亡", "游戏角色已经飘了。", image_path=r"D:\\scripts\\screen.bmp", priority="high")
+
+注意：图片是后台线程发送时才读的，如果脚本马上又截图覆盖了同一个文件，发出去的是新的那张。
+"""
+
+import atexit
+import base64
+import collections
+import logging
+import os
+import random
+import re
+import sys
+import threading
+import time
+import uuid
+
+import requests
+
+from spool import MessageSpool
+
+# 队列满时的处理策略
+DROP_NEW = 'drop_new'          # 丢弃新来的消息
+DROP_OLDEST = 'drop_oldest'    # 丢弃队列里最早的消息
+OVERWRITE = 'overwrite'        # 同一个key（默认是标题）还没发出去的消息直接被新消息替换；队列满时丢弃最早的
+BLOCK = 'block'                # send等到队列有空位再返回，不丢消息（命令行工具这种不怕被卡住的调用方用）
+POLICIES = (DROP_NEW, DROP_OLDEST, OVERWRITE, BLOCK)
+
+# 一次发送的结果
+SENT = 'sent'
+RETRY = 'retry'        # 连不上、超时或服务端5xx，稍后重试
+THROTTLED = 'throttled'  # 服务端限流（429），按Retry-After等待后重试
+REJECTED = 'rejected'  # 服务端拒绝（其他4xx）或图片读不到，重试也没用
+RETRYABLE = (RETRY, THROTTLED)
+
+# 没有离线暂存时，被限流的消息按Retry-After等待后最多重试的次数（不受retries限制）
+THROTTLE_RETRIES = 3
+
+# 流式上传时每次从文件读取的字节数
+UPLOAD_CHUNK_SIZE = 64 * 1024
+
+# 断点续传时一块数据中途失败后，查询偏移量重新上传的次数
+CHUNK_RETRIES = 3
+
+
+def iter_file_chunks(f, chunk_size=UPLOAD_CHUNK_SIZE):
+    """按块读取已打开的文件，作为requests的生成器请求体（分块传输编码），内存占用和文件大小无关"""
+    while True:
+        chunk = f.read(chunk_size)
+        if not chunk:
+            return
+        yield chunk
+
+logger = logging.getLogger('sender')
+
+
+class MessageSender:
+    """后台发送器
+
+    参数:
+        server_url (str): 服务器地址，如 "http://192.168.41.1:5001"
+        max_queue (int): 队列里最多积压的消息数
+        policy (str): 队列满时的处理策略，见 DROP_NEW / DROP_OLDEST / OVERWRITE
+        timeout (float): 每次HTTP请求的超时时间（秒）
+        flush_timeout (float): 脚本退出时最多等待多久把剩下的消息发完（秒）
+        spool_path (str): 离线暂存文件路径，None表示不暂存（发送失败的消息直接丢弃）
+        spool_max_bytes (int): 暂存总大小上限，超过时淘汰最早的消息
+        spool_max_messages (int): 暂存条数上限
+        retry_base (float): 补发失败后第一次等待的秒数，之后每次翻倍
+        retry_max (float): 补发等待时间的上限（秒）
+        batch_size (int): 每批发送的消息条数：队列里积压的多条文字消息用批量接口一次发出，离线补发也按这个分批
+        use_batch (bool): 是否使用批量接口（POST /api/messages/batch），服务端没有时自动逐条发送
+        retries (int): 没有离线暂存时，连不上或服务端5xx的消息在内存里重试的次数（之后计入failed）
+            被限流（429）的消息按Retry-After最多重试THROTTLE_RETRIES次
+        stream_upload (bool): 带图片的消息是否走二进制流式上传接口
+        resumable_threshold (int): 图片超过这个大小（字节）时用断点续传会话上传，0表示不用
+        chunk_size (int): 断点续传每块的字节数
+        dedupe: image_hash.ScreenshotDeduper，相似截图去重，None表示不去重
+        pipeline: image_pipeline.ImagePipeline，发送前裁剪、缩小、编码图片，None表示原图发送
+    """
+
+    def __init__(self, server_url, max_queue=100, policy=DROP_OLDEST, timeout=10, flush_timeout=5,
+                 spool_path=None, spool_max_bytes=200 * 1024 * 1024, spool_max_messages=10000,
+                 retry_base=1, retry_max=300, batch_size=20, stream_upload=True,
+                 resumable_threshold=4 * 1024 * 1024, chunk_size=1024 * 1024, dedupe=None,
+                 pipeline=None, use_batch=True, retries=0):
+        if policy not in POLICIES:
+            raise ValueError(f"Unknown queue policy: {policy}")
+        self.server_url = server_url.rstrip('/')
+        self.max_queue = max_queue
+        self.policy = policy
+        self.timeout = timeout
+        self.flush_timeout = flush_timeout
+        self.session = requests.Session()
+        self.stream_upload = stream_upload
+        self.resumable_threshold = resumable_threshold
+        self.chunk_size = chunk_size
+        self.dedupe = dedupe
+        self.pipeline = pipeline
+        self.use_batch = use_batch
+        self.retries = retries
+
+        self.condition = threading.Condition()
+        self.queue = collections.deque()
+        self.in_flight = 0
+        self.closing = False
+        self.stats = {'queued': 0, 'sent': 0, 'failed': 0, 'dropped': 0, 'overwritten': 0,
+                      'spooled': 0, 'replayed': 0, 'evicted': 0, 'suppressed': 0}
+
+        # 离线暂存和补发状态：failures是连续失败次数，retry_at之前认为服务器不可用
+        self.spool = MessageSpool(spool_path, spool_max_bytes, spool_max_messages) if spool_path else None
+        self.retry_base = retry_base
+        self.retry_max = retry_max
+        self.batch_size = batch_size
+        self.failures = 0
+        self.retry_at = 0
+
+        self.worker = threading.Thread(target=self._run, name='MessageSender', daemon=True)
+        self.worker.start()
+        if self.spool is not None:
+            # 上次没补发完的消息也会在启动后补发
+            self.replayer = threading.Thread(target=self._replay, name='MessageSpoolReplayer', daemon=True)
+            self.replayer.start()
+        atexit.register(self.close)
+
+    def send(self, title, content='', image_path=None, priority='normal', channel='', key=None,
+             sender=None, client_msg_id=None):
+        """把消息放进发送队列，立即返回
+
+        参数:
+            title (str): 消息标题
+            content (str): 文字内容
+            image_path (str): 图片文件路径，没有图片时为None
+            priority (str): 优先级 low/normal/high/critical
+            channel (str): 频道
+            key (str): overwrite策略下用来判断“同一条消息”的键，默认是标题
+            sender (str): 发送者ID（服务端按它限流），None表示不带
+            client_msg_id (str): 幂等键，默认随机生成；同一条消息重复运行脚本时可以指定固定值
+
+        返回:
+            bool: 放进队列返回True，被丢弃返回False
+        """
+        message = {
+            'title': title,
+            'content': content,
+            'image_path': image_path,
+            'priority': priority,
+            'channel': channel,
+            'key': key if key is not None else title,
+            'sender': sender,
+            # 幂等键：超时重试时服务端不会重复入库
+            'client_msg_id': client_msg_id or uuid.uuid4().hex
+        }
+        with self.condition:
+            if self.closing:
+                return False
+            if self.policy == OVERWRITE:
+                for index, queued in enumerate(self.queue):
+                    if queued['key'] == message['key']:
+                        self.queue[index] = message
+                        self.stats['overwritten'] += 1
+                        return True
+            if len(self.queue) >= self.max_queue and self.policy == BLOCK:
+                self.condition.wait_for(lambda: len(self.queue) < self.max_queue or self.closing)
+                if self.closing:
+                    return False
+            if len(self.queue) >= self.max_queue:
+                if self.policy == DROP_NEW:
+                    self.stats['dropped'] += 1
+                    return False
+                self.queue.popleft()
+                self.stats['dropped'] += 1
+            self.queue.append(message)
+            self.stats['queued'] += 1
+            self.condition.notify_all()
+        return True
+
+    def flush(self, timeout=None, spool=False):
+        """等待队列里的消息全部处理完，超时返回False
+
+        spool=True时还要等离线暂存里的消息补发完（服务器不可用、补发正在退避时不再等待），
+        适合命令行这种发完就退出的场合。
+        """
+        def done():
+            if self.queue or self.in_flight:
+                return False
+            return not (spool and self.spool is not None and time.time() >= self.retry_at and len(self.spool))
+
+        with self.condition:
+            return self.condition.wait_for(done, timeout)
+
+    def close(self, timeout=None):
+        """停止接收新消息，最多等待timeout秒（默认flush_timeout）把剩下的发完"""
+        if timeout is None:
+            timeout = self.flush_timeout
+        atexit.unregister(self.close)
+        with self.condition:
+            self.closing = True
+            self.condition.notify_all()
+        self.worker.join(timeout)
+        with self.condition:
+            remaining = len(self.queue)
+        if remaining:
+            logger.warning(f"Sender closed with {remaining} unsent messages")
+        if self.spool is not None:
+            pending = len(self.spool)
+            if pending:
+                logger.info(f"{pending} messages left in spool, will be replayed next time")
+        return remaining == 0
+
+    def _run(self):
+        while True:
+            with self.condition:
+                self.condition.wait_for(lambda: self.queue or self.closing)
+                if not self.queue:
+                    return
+                batch = [self.queue.popleft()]
+                # 接着排队的文字消息一起用批量接口发（带图片的消息各自上传）
+                if self.use_batch and not batch[0]['image_path']:
+                    while self.queue and len(batch) < self.batch_size and not self.queue[0]['image_path']:
+                        batch.append(self.queue.popleft())
+                self.in_flight += len(batch)
+                self.condition.notify_all()
+            try:
+                if len(batch) > 1:
+                    self._deliver_batch(batch)
+                else:
+                    self._process(batch[0])
+            except Exception:
+                # 一条消息出错（例如图片编码失败）不能让后台线程退出，否则之后的消息都只会堆在队列里
+                logger.exception(f"Error processing message '{batch[0]['title']}'")
+                for message in batch:
+                    self._discard(message)
+            finally:
+                with self.condition:
+                    self.in_flight -= len(batch)
+                    self.condition.notify_all()
+
+    def _discard(self, message):
+        """处理出错的消息：有离线暂存时原样暂存（补发时不再经过裁剪和去重，服务端按client_msg_id去重），否则丢弃"""
+        if self.spool is not None:
+            self._spool(message)
+            return
+        with self.condition:
+            self.stats['failed'] += 1
+
+    def _process(self, message):
+        """后台线程里处理一条消息：裁剪缩小 -> 相似截图去重（用处理后的图） -> 编码 -> 发送"""
+        image = None
+        if self.pipeline and message['image_path']:
+            image = self.pipeline.load(message['image_path'])
+        if self.dedupe and self.dedupe.is_duplicate(message, image):
+            with self.condition:
+                self.stats['suppressed'] += 1
+            return
+        if image is None:
+            self._deliver(message)
+            return
+        processed = self.pipeline.encode(image, message)
+        try:
+            self._deliver(processed)
+        finally:
+            # 进离线暂存的消息已经复制了一份图片，临时文件可以直接删除
+            self.pipeline.cleanup(processed)
+
+    def build_payload(self, message):
+        """在后台线程里读取图片并组装请求体"""
+        payload = {
+            'type': 'text',
+            'title': message['title'],
+            'content': message['content'],
+            'priority': message['priority'],
+            'channel': message['channel'],
+            'client_msg_id': message['client_msg_id']
+        }
+        if message.get('sender'):
+            payload['sender'] = message['sender']
+        if message['image_path']:
+            with open(message['image_path'], 'rb') as f:
+                payload['image_data'] = base64.b64encode(f.read()).decode('ascii')
+            # 暂存的图片文件名是client_msg_id，用原来的文件名
+            payload['image_name'] = message.get('image_name') or os.path.basename(message['image_path'])
+            payload['type'] = 'mixed'
+        return payload
+
+    def _upload(self, message):
+        """二进制流式上传带图片的消息：字段放在查询参数里，请求体是按块读取的图片文件
+
+        返回:
+            服务端的响应；服务端没有上传接口时返回None
+        """
+        params = {
+            'title': message['title'],
+            'content': message['content'],
+            'priority': message['priority'],
+            'channel': message['channel'],
+            'client_msg_id': message['client_msg_id']
+        }
+        if message.get('sender'):
+            params['sender'] = message['sender']
+        with open(message['image_path'], 'rb') as f:
+            response = self.session.post(f"{self.server_url}/api/messages/upload", params=params,
+                                         data=iter_file_chunks(f), timeout=self.timeout,
+                                         headers={'Content-Type': 'application/octet-stream'})
+        if response.status_code in (404, 405):
+            logger.info("Server has no binary upload endpoint, falling back to JSON")
+            self.stream_upload = False
+            return None
+        return response
+
+    def _upload_offset(self, upload_id):
+        """查询会话已收到的字节数，会话不存在（已过期或已提交）时返回None"""
+        response = self.session.get(f"{self.server_url}/api/uploads/{upload_id}", timeout=self.timeout)
+        if response.status_code == 404:
+            return None
+        response.raise_for_status()
+        return response.json()['offset']
+
+    def _upload_resumable(self, message):
+        """用断点续传会话分块上传带图片的消息
+
+        会话ID记在message['upload_id']里，发送失败进了离线暂存后，补发时接着上次的偏移量上传。
+
+        返回:
+            服务端提交后的响应；服务端没有断点续传接口、或会话已失效需要改用普通上传时返回None
+        """
+        size = os.path.getsize(message['image_path'])
+        upload_id = message.get('upload_id')
+        offset = self._upload_offset(upload_id) if upload_id else None
+        if offset is None:
+            metadata = {
+                'title': message['title'],
+                'content': message['content'],
+                'priority': message['priority'],
+                'channel': message['channel'],
+                'client_msg_id': message['client_msg_id'],
+                'size': size
+            }
+            if message.get('sender'):
+                metadata['sender'] = message['sender']
+            response = self.session.post(f"{self.server_url}/api/uploads", json=metadata, timeout=self.timeout)
+            if response.status_code in (404, 405):
+                logger.info("Server has no upload session endpoint, uploading in one request")
+                self.resumable_threshold = 0
+                return None
+            if response.status_code != 201:
+                return response
+            upload_id = message['upload_id'] = response.json()['upload_id']
+            offset = 0
+        elif offset:
+            logger.info(f"Resuming upload of '{message['title']}' at {offset}/{size} bytes")
+
+        url = f"{self.server_url}/api/uploads/{upload_id}"
+        retries = 0
+        with open(message['image_path'], 'rb') as f:
+            while offset < size:
+                f.seek(offset)
+                chunk = f.read(self.chunk_size)
+                try:
+                    response = self.session.put(url, params={'offset': offset}, data=chunk, timeout=self.timeout,
+                                                headers={'Content-Type': 'application/octet-stream'})
+                except requests.RequestException as e:
+                    # 这一块没传完：查询服务端实际收到了多少，从那里接着传
+                    retries += 1
+                    if retries > CHUNK_RETRIES:
+                        raise
+                    logger.warning(f"Upload chunk at {offset} failed, retrying: {str(e)}")
+                    time.sleep(min(2 ** retries, 10))
+                    offset = self._upload_offset(upload_id)
+                    if offset is None:
+                        message.pop('upload_id', None)
+                        return None
+                    continue
+                if response.status_code == 409:
+                    offset = response.json()['offset']
+                    continue
+                if response.status_code == 404:
+                    message.pop('upload_id', None)
+                    return None
+                if response.status_code != 200:
+                    return response
+                offset = response.json()['offset']
+                retries = 0
+
+        response = self.session.post(f"{url}/commit", timeout=self.timeout)
+        if response.status_code == 404:
+            # 会话已失效（可能上次已经提交成功，只是没收到响应），改用普通上传，服务端按client_msg_id去重
+            message.pop('upload_id', None)
+            return None
+        return response
+
+    def _post(self, message):
+        """发送一条消息，返回(SENT/RETRY/THROTTLED/REJECTED, 服务端要求的最短重试等待秒数)"""
+        try:
+            response = None
+            if (message['image_path'] and self.resumable_threshold
+                    and os.path.getsize(message['image_path']) > self.resumable_threshold):
+                response = self._upload_resumable(message)
+            if response is None and message['image_path'] and self.stream_upload:
+                response = self._upload(message)
+            if response is None:
+                payload = self.build_payload(message)
+                response = self.session.post(f"{self.server_url}/api/messages", json=payload, timeout=self.timeout)
+        except requests.RequestException as e:
+            logger.warning(f"Server unreachable, message '{message['title']}': {str(e)}")
+            return RETRY, 0
+        except OSError as e:
+            logger.error(f"Cannot read image for message '{message['title']}': {str(e)}")
+            return REJECTED, 0
+        if response.status_code in (200, 202):
+            return SENT, 0
+        logger.error(f"Failed to send message '{message['title']}': {response.status_code} {response.text[:200]}")
+        return self._failure(response)
+
+    def _failure(self, response):
+        """失败响应的处理方式：5xx和408稍后重试，429按Retry-After等待后重试，其他4xx不重试"""
+        try:
+            retry_after = float(response.headers.get('Retry-After', 0))
+        except ValueError:
+            retry_after = 0
+        if response.status_code >= 500 or response.status_code == 408:
+            return RETRY, retry_after
+        if response.status_code == 429:
+            # 限流（合并模式的202不会走到这里）：消息不丢，等服务端给的时间再发
+            return THROTTLED, retry_after
+        return REJECTED, 0
+
+    def _post_batch(self, messages):
+        """用批量接口发送几条文字消息，返回(每条的SENT/RETRY/THROTTLED/REJECTED, Retry-After秒数)
+
+        服务端没有批量接口或整批超过大小限制时返回(None, 0)，由调用方逐条发送。
+        """
+        payloads = [self.build_payload(message) for message in messages]
+        try:
+            response = self.session.post(f"{self.server_url}/api/messages/batch", json={'messages': payloads},
+                                         timeout=self.timeout)
+        except requests.RequestException as e:
+            logger.warning(f"Server unreachable, batch of {len(messages)} messages: {str(e)}")
+            return [RETRY] * len(messages), 0
+        if response.status_code in (404, 405):
+            logger.info("Server has no batch endpoint, sending messages one by one")
+            self.use_batch = False
+            return None, 0
+        if response.status_code == 413:
+            return None, 0
+        if response.status_code != 200:
+            logger.error(f"Failed to send batch: {response.status_code} {response.text[:200]}")
+            result, retry_after = self._failure(response)
+            return [result] * len(messages), retry_after
+        results = []
+        retry_after = 0
+        for message, item in zip(messages, response.json()['results']):
+            if 'error' not in item:
+                results.append(SENT)
+            elif item.get('status') == 429:
+                logger.warning(f"Message '{message['title']}' rate limited, retry in {item.get('retry_after')}s")
+                results.append(THROTTLED)
+                retry_after = max(retry_after, item.get('retry_after') or 0)
+            else:
+                logger.error(f"Failed to send message '{message['title']}': {item.get('status')} {item['error']}")
+                results.append(REJECTED)
+        return results, retry_after
+
+    def _deliver_batch(self, messages):
+        """发送一批文字消息，失败的处理和_deliver一样（连不上或被限流时退避一次，把没发出去的暂存）"""
+        if self.spool is not None and (time.time() < self.retry_at or len(self.spool)):
+            for message in messages:
+                self._spool(message)
+            return
+        attempt = 0
+        while True:
+            results, retry_after = self._post_batch(messages)
+            if results is None:
+                for message in messages:
+                    self._deliver(message)
+                return
+            pending = []
+            for message, result in zip(messages, results):
+                if result in RETRYABLE:
+                    pending.append(message)
+                    continue
+                with self.condition:
+                    self.stats['sent' if result == SENT else 'failed'] += 1
+            limit = self.retries if RETRY in results else THROTTLE_RETRIES
+            if not pending or self.spool is not None or attempt >= limit:
+                break
+            # 只重发没发出去的（被限流的）那几条
+            time.sleep(max(min(2 ** attempt, 10), retry_after))
+            messages = pending
+            attempt += 1
+        if not pending:
+            return
+        if self.spool is not None:
+            self._backoff(retry_after)
+            for message in pending:
+                self._spool(message)
+            return
+        with self.condition:
+            self.stats['failed'] += len(pending)
+
+    def _deliver(self, message):
+        # 服务器已知不可用（补发还在退避中）时不再逐条等超时，直接暂存，也保证了先后顺序
+        if self.spool is not None and (time.time() < self.retry_at or len(self.spool)):
+            self._spool(message)
+            return False
+        for attempt in range(max(self.retries, THROTTLE_RETRIES) + 1):
+            result, retry_after = self._post(message)
+            # 有离线暂存时交给补发线程退避重试，不在这里等
+            if result not in RETRYABLE or self.spool is not None:
+                break
+            if attempt >= (self.retries if result == RETRY else THROTTLE_RETRIES):
+                break
+            time.sleep(max(min(2 ** attempt, 10), retry_after))
+        if result == SENT:
+            with self.condition:
+                self.stats['sent'] += 1
+            return True
+        if result in RETRYABLE and self.spool is not None:
+            self._backoff(retry_after)
+            self._spool(message)
+            return False
+        with self.condition:
+            self.stats['failed'] += 1
+        return False
+
+    def _spool(self, message):
+        try:
+            evicted = self.spool.put(message)
+        except Exception as e:
+            logger.error(f"Cannot spool message '{message['title']}': {str(e)}")
+            with self.condition:
+                self.stats['failed'] += 1
+            return
+        with self.condition:
+            self.stats['spooled'] += 1
+            self.stats['evicted'] += evicted
+            self.condition.notify_all()
+
+    def _backoff(self, retry_after=0):
+        """连续失败后指数退避，等待时间在[delay/2, delay]之间随机，避免多个脚本同时重连"""
+        with self.condition:
+            self.failures += 1
+            delay = min(self.retry_max, self.retry_base * 2 ** (self.failures - 1))
+            delay = max(random.uniform(delay / 2, delay), retry_after)
+            self.retry_at = time.time() + delay
+            self.condition.notify_all()
+        logger.info(f"Spool replay retry in {delay:.1f}s (failure {self.failures})")
+
+    def _replay(self):
+        """补发线程：服务器恢复后按暂存顺序分批补发，失败则退避"""
+        while True:
+            with self.condition:
+                while not self.closing and (time.time() < self.retry_at or not len(self.spool)):
+                    timeout = self.retry_at - time.time() if time.time() < self.retry_at else None
+                    self.condition.wait(timeout)
+                if self.closing:
+                    return
+            batch = self.spool.peek(self.batch_size)
+            done = []
+            for row_id, message in batch:
+                result, retry_after = self._post(message)
+                if result in RETRYABLE:
+                    self.spool.mark_attempt(row_id, message)
+                    self._backoff(retry_after)
+                    break
+                done.append(row_id)
+                with self.condition:
+                    self.stats['replayed' if result == SENT else 'failed'] += 1
+            else:
+                with self.condition:
+                    self.failures = 0
+                    self.retry_at = 0
+            self.spool.remove(done)
+            with self.condition:
+                self.condition.notify_all()
+
+
+_default_senders = {}  # 服务器地址 -> 后台发送器
+_default_lock = threading.Lock()
+
+
+def user_data_dir():
+    """当前用户的应用数据目录：Windows是%LOCALAPPDATA%，macOS是~/Library/Application Support，其他是$XDG_DATA_HOME或~/.local/share"""
+    if os.name == 'nt':
+        return os.environ.get('LOCALAPPDATA') or os.path.join(os.path.expanduser('~'), 'AppData', 'Local')
+    if sys.platform == 'darwin':
+        return os.path.join(os.path.expanduser('~'), 'Library', 'Application Support')
+    return os.environ.get('XDG_DATA_HOME') or os.path.join(os.path.expanduser('~'), '.local', 'share')
+
+
+# 默认发送器的离线暂存目录，放在当前用户的数据目录里（不放在代码目录，多个用户、多份代码互不影响）
+DEFAULT_SPOOL_DIR = os.path.join(user_data_dir(), 'msg-sender', 'spool')
+
+
+def default_spool_path(server_url):
+    """默认发送器的离线暂存文件：每个服务器地址一个子目录，暂存的消息只补发给原来的服务器"""
+    name = re.sub(r'[^0-9A-Za-z.-]+', '_', server_url.split('://', 1)[-1].rstrip('/'))
+    return os.path.join(DEFAULT_SPOOL_DIR, name, 'outbox.db')
+
+
+def send_mixed_message_async(image_path, text_content, title="图文消息", server_url="http://127.0.0.1:5001"):
+    """和simple_test.py里的send_mixed_message用法一样，但只是放进后台队列，立即返回
+
+    每个server_url一个后台发送器，服务器连不上时消息暂存到default_spool_path(server_url)。
+    """
+    server_url = server_url.rstrip('/')
+    with _default_lock:
+        sender = _default_senders.get(server_url)
+        if sender is None:
+            sender = _default_senders[server_url] = MessageSender(server_url, spool_path=default_spool_path(server_url))
+    if image_path and not os.path.exists(image_path):
+        print(f"❌ 图片文件不存在: {image_path}")
+        return False
+    return sender.send(title, text_content, image_path=image_path or None)
@@ -0,0 +1,158 @@
+"""
+多进程运行
+功能：预先fork多个工作进程，共享同一个监听端口和同一个SQLite数据库（WAL模式）。
+某个进程写入后通过本地Unix数据报套接字通知其他进程，各进程里等待的长轮询请求都能被唤醒。
+只支持有fork和Unix套接字的系统（Linux/macOS），Windows上仍以单进程运行。
+"""
+
+import logging
+import os
+import signal
+import socket
+import threading
+import time
+
+from werkzeug.serving import make_server
+
+# 子进程异常退出后，等待多久再重新拉起（秒）
+RESPAWN_DELAY = 1
+
+
+def prefork_supported():
+    """当前系统是否支持多进程模式"""
+    return hasattr(os, 'fork') and hasattr(socket, 'AF_UNIX')
+
+
+def socket_path(run_dir, pid):
+    return os.path.join(run_dir, f"worker-{pid}.sock")
+
+
+class ChangeBroadcaster:
+    """进程间变更广播
+
+    每个工作进程在run_dir下绑定一个 worker-<pid>.sock 数据报套接字并在后台线程接收；
+    publish把变更（优先级和版本号）发给目录下其他进程的套接字。
+    对方已退出（套接字文件残留）时顺手删除文件。
+    """
+
+    def __init__(self, run_dir, on_change):
+        self.run_dir = run_dir
+        self.on_change = on_change
+        self.path = socket_path(run_dir, os.getpid())
+
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+        self.receiver = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        self.receiver.bind(self.path)
+
+        # 发送用非阻塞套接字，对方接收缓冲区满时直接丢弃（对方积压的通知已经足够唤醒等待者）
+        self.sender = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        self.sender.setblocking(False)
+
+        threading.Thread(target=self._listen, daemon=True).start()
+
+    def _listen(self):
+        while True:
+            try:
+                data = self.receiver.recv(256)
+                priority, version = data.decode('ascii').split()
+                self.on_change(priority, int(version))
+            except Exception as e:
+                logging.error(f"Error handling change broadcast: {str(e)}")
+
+    def publish(self, priority, version):
+        """把一次变更通知给其他工作进程"""
+        payload = f"{priority} {version}".encode('ascii')
+        try:
+            names = os.listdir(self.run_dir)
+        except FileNotFoundError:
+            return
+        for name in names:
+            path = os.path.join(self.run_dir, name)
+            if path == self.path or not name.endswith('.sock'):
+                continue
+            try:
+                self.sender.sendto(payload, path)
+            except (ConnectionRefusedError, FileNotFoundError):
+                # 进程已退出，删除残留的套接字文件
+                try:
+                    os.unlink(path)
+                except FileNotFoundError:
+                    pass
+            except OSError as e:
+                logging.warning(f"Change broadcast to {name} dropped: {str(e)}")
+
+
+def run_prefork(app, host, port, workers, run_dir, on_worker_start=None):
+    """以workers个预先fork的工作进程运行app
+
+    主进程创建监听套接字后fork出工作进程，各工作进程在同一个套接字上accept（由内核分配连接）。
+    主进程只负责监管：工作进程退出后重新拉起，收到SIGTERM/SIGINT时停止所有工作进程。
+
+    参数:
+        on_worker_start: 在每个工作进程里、开始处理请求之前调用，参数为进程序号（0起）
+    """
+    os.makedirs(run_dir, exist_ok=True)
+    for name in os.listdir(run_dir):
+        if name.startswith('worker-') and name.endswith('.sock'):
+            os.unlink(os.path.join(run_dir, name))
+
+    listener = socket.create_server((host, port), backlog=128)
+    listener.set_inheritable(True)
+    children = {}
+    stopping = False
+
+    def spawn(index):
+        pid = os.fork()
+        if pid:
+            children[pid] = index
+            return
+        # 工作进程：由主进程统一处理Ctrl+C
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+        signal.signal(signal.SIGTERM, signal.SIG_DFL)
+        exit_code = 0
+        try:
+            if on_worker_start:
+                on_worker_start(index)
+            server = make_server(host, port, app, threaded=True, fd=listener.fileno())
+            logging.info(f"Worker {index} (pid {os.getpid()}) serving on {host}:{port}")
+            server.serve_forever()
+        except BaseException as e:
+            logging.error(f"Worker {index} exited: {str(e)}")
+            exit_code = 1
+        finally:
+            os._exit(exit_code)
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+        for pid in list(children):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    for index in range(workers):
+        spawn(index)
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    logging.info(f"Started {workers} worker processes, run dir: {run_dir}")
+
+    while children:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+        index = children.pop(pid, None)
+        try:
+            os.unlink(socket_path(run_dir, pid))
+        except FileNotFoundError:
+            pass
+        if index is None or stopping:
+            continue
+        logging.warning(f"Worker {index} (pid {pid}) died with status {status}, restarting")
+        time.sleep(RESPAWN_DELAY)
+        spawn(index)
+
+    listener.close()
+    logging.info("All workers stopped")
@@ -0,0 +1,84 @@
+"""
+序列化
+功能：JSON编解码优先使用orjson或msgspec（都没有安装时用标准库json），
+另外支持MessagePack作为可选的传输格式（需要msgpack或msgspec），客户端通过Accept/Content-Type选择。
+"""
+
+import json
+
+# 以下都是可选依赖
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgspec
+except ImportError:
+    msgspec = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+JSON_MIMETYPE = 'application/json'
+MSGPACK_MIMETYPE = 'application/msgpack'
+MSGPACK_MIMETYPES = (MSGPACK_MIMETYPE, 'application/x-msgpack')
+
+JSON_BACKENDS = ('orjson', 'msgspec', 'json')
+
+# 当前使用的JSON库，由select_json_backend设置
+json_backend = 'json'
+
+
+def select_json_backend(name='auto'):
+    """选择JSON库，auto时按orjson、msgspec、json的顺序选第一个可用的；指定的库不可用时退回标准库
+
+    返回:
+        str: 实际使用的库名
+    """
+    global json_backend
+    available = {'orjson': orjson is not None, 'msgspec': msgspec is not None, 'json': True}
+    candidates = JSON_BACKENDS if name == 'auto' else (name, 'json')
+    json_backend = next(backend for backend in candidates if available.get(backend))
+    return json_backend
+
+
+def json_dumps(obj):
+    """序列化为JSON，返回UTF-8字节串（非ASCII字符不转义）"""
+    if json_backend == 'orjson':
+        return orjson.dumps(obj)
+    if json_backend == 'msgspec':
+        return msgspec.json.encode(obj)
+    return json.dumps(obj, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+
+def json_loads(data):
+    """解析JSON，data可以是字节串或字符串，格式错误时抛出ValueError"""
+    if json_backend == 'orjson':
+        return orjson.loads(data)
+    if json_backend == 'msgspec':
+        try:
+            return msgspec.json.decode(data)
+        except msgspec.DecodeError as e:
+            raise ValueError(str(e)) from e
+    return json.loads(data)
+
+
+def msgpack_available():
+    return msgpack is not None or msgspec is not None
+
+
+def msgpack_dumps(obj):
+    """序列化为MessagePack"""
+    if msgpack is not None:
+        return msgpack.packb(obj, use_bin_type=True)
+    return msgspec.msgpack.encode(obj)
+
+
+def msgpack_loads(data):
+    """解析MessagePack"""
+    if msgpack is not None:
+        return msgpack.unpackb(data, raw=False)
+    return msgspec.msgpack.decode(data)
@@ -0,0 +1,171 @@
+"""
+增量JSON解析
+功能：边读请求体边解析一个扁平的JSON对象（值只能是字符串、数字、true/false/null），
+读取过程中就检查每个字段和整体的大小，超限立即中止，不必先把整个请求体读进内存。
+"""
+
+import codecs
+import json
+import re
+
+# 每次从流中读取的字节数
+READ_SIZE = 64 * 1024
+
+# JSON转义后一个字符最多占6个字符（\uXXXX），流式读取时按这个倍数粗略限制原始长度
+ESCAPE_FACTOR = 6
+
+# 值是对象或数组时的错误信息，小请求体（get_json）的检查也用它，两条路径的结果一致
+NESTED_VALUE_ERROR = 'Only flat objects are supported'
+
+_STRING_SPECIAL = re.compile(r'["\\]')
+_WHITESPACE = ' \t\r\n'
+
+
+class PayloadTooLarge(ValueError):
+    """请求体或某个字段超过大小限制"""
+
+    def __init__(self, field, limit):
+        super().__init__(f"Field '{field}' exceeds {limit} characters" if field else f"Payload exceeds {limit} bytes")
+        self.field = field
+        self.limit = limit
+
+
+class StreamingObjectParser:
+    """从二进制流中增量解析一个扁平JSON对象"""
+
+    def __init__(self, stream, field_limits=None, default_field_limit=None, max_bytes=None):
+        self.stream = stream
+        self.field_limits = field_limits or {}
+        self.default_field_limit = default_field_limit
+        self.max_bytes = max_bytes
+        self.decoder = codecs.getincrementaldecoder('utf-8')()
+        self.buf = ''
+        self.pos = 0
+        self.bytes_read = 0
+        self.eof = False
+
+    def _fill(self):
+        """读取下一块数据到缓冲区，流结束返回False"""
+        if self.eof:
+            return False
+        chunk = self.stream.read(READ_SIZE)
+        if not chunk:
+            self.eof = True
+            tail = self.decoder.decode(b'', final=True)
+            self.buf = self.buf[self.pos:] + tail
+            self.pos = 0
+            return bool(tail)
+        self.bytes_read += len(chunk)
+        if self.max_bytes and self.bytes_read > self.max_bytes:
+            raise PayloadTooLarge(None, self.max_bytes)
+        self.buf = self.buf[self.pos:] + self.decoder.decode(chunk)
+        self.pos = 0
+        return True
+
+    def _peek(self):
+        """跳过空白，返回下一个字符（不消耗），流结束返回空字符串"""
+        while True:
+            while self.pos < len(self.buf) and self.buf[self.pos] in _WHITESPACE:
+                self.pos += 1
+            if self.pos < len(self.buf):
+                return self.buf[self.pos]
+            if not self._fill():
+                return ''
+
+    def _expect(self, char):
+        if self._peek() != char:
+            raise ValueError(f"Expected '{char}' at byte {self.bytes_read}")
+        self.pos += 1
+
+    def _read_string(self, field, limit):
+        """读取一个字符串（开头的引号已确认），超过limit时抛出PayloadTooLarge"""
+        self.pos += 1
+        pieces = []
+        raw_length = 0
+        raw_limit = limit * ESCAPE_FACTOR if limit else None
+        while True:
+            match = _STRING_SPECIAL.search(self.buf, self.pos)
+            end = match.start() if match else len(self.buf)
+            if end > self.pos:
+                pieces.append(self.buf[self.pos:end])
+                raw_length += end - self.pos
+                self.pos = end
+                if raw_limit and raw_length > raw_limit:
+                    raise PayloadTooLarge(field, limit)
+            if not match:
+                if not self._fill():
+                    raise ValueError('Unterminated string')
+                continue
+            if self.buf[self.pos] == '"':
+                self.pos += 1
+                break
+            # 转义序列，\uXXXX需要再多读4个字符
+            while len(self.buf) - self.pos < 6 and self._fill():
+                pass
+            length = 6 if self.buf[self.pos + 1:self.pos + 2] == 'u' else 2
+            pieces.append(self.buf[self.pos:self.pos + length])
+            raw_length += length
+            self.pos += length
+
+        raw = ''.join(pieces)
+        value = json.loads(f'"{raw}"') if '\\' in raw else raw
+        if limit and len(value) > limit:
+            raise PayloadTooLarge(field, limit)
+        return value
+
+    def _read_scalar(self):
+        """读取数字或true/false/null"""
+        token = []
+        while True:
+            while self.pos < len(self.buf) and self.buf[self.pos] not in ',}' + _WHITESPACE:
+                token.append(self.buf[self.pos])
+                self.pos += 1
+                if len(token) > 64:
+                    raise ValueError('Scalar value too long')
+            if self.pos < len(self.buf) or not self._fill():
+                break
+        if not token or token[0] in '[{':
+            raise ValueError(NESTED_VALUE_ERROR)
+        return json.loads(''.join(token))
+
+    def parse(self):
+        """解析整个对象，返回字典"""
+        result = {}
+        self._expect('{')
+        if self._peek() == '}':
+            self.pos += 1
+        else:
+            while True:
+                if self._peek() != '"':
+                    raise ValueError('Expected field name')
+                key = self._read_string('(field name)', 64)
+                self._expect(':')
+                if self._peek() == '"':
+                    limit = self.field_limits.get(key, self.default_field_limit)
+                    result[key] = self._read_string(key, limit)
+                else:
+                    result[key] = self._read_scalar()
+                separator = self._peek()
+                self.pos += 1
+                if separator == '}':
+                    break
+                if separator != ',':
+                    raise ValueError('Expected , or }')
+        if self._peek() != '':
+            raise ValueError('Unexpected data after object')
+        return result
+
+
+def parse_object_stream(stream, field_limits=None, default_field_limit=None, max_bytes=None):
+    """从流中增量解析扁平JSON对象
+
+    参数:
+        stream: 二进制流（有read方法）
+        field_limits (dict): 字段名 -> 最大字符数
+        default_field_limit (int): 未单独配置的字符串字段的最大字符数，None表示不限制
+        max_bytes (int): 整个请求体的最大字节数，None表示不限制
+
+    返回:
+        dict: 解析出的对象
+    """
+    return StreamingObjectParser(stream, field_limits, default_field_limit, max_bytes).parse()
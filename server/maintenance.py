@@ -0,0 +1,233 @@
+"""
+定时任务和数据库维护
+功能：定时任务线程按下次运行时间睡眠到最近的任务到期（不再每分钟轮询）；
+数据库维护包括增量回收空闲页（incremental_vacuum）、更新查询统计（PRAGMA optimize/ANALYZE）
+和WAL检查点，每次维护记录回收的字节数和耗时。维护操作分小步执行，每步只短暂持有写锁，服务运行中也可以执行。
+"""
+
+import heapq
+import logging
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+
+# 每步回收的空闲页数，控制单次持有写锁的时间
+VACUUM_STEP_PAGES = 256
+
+
+def every(seconds):
+    """每隔seconds秒运行一次"""
+    return lambda now: now + seconds
+
+
+def daily_at(at):
+    """每天在指定时间（HH:MM）运行"""
+    hour, minute = (int(part) for part in at.split(':'))
+
+    def next_run(now):
+        current = datetime.fromtimestamp(now)
+        run = current.replace(hour=hour, minute=minute, second=0, microsecond=0)
+        if run <= current:
+            run += timedelta(days=1)
+        return run.timestamp()
+    return next_run
+
+
+def weekly_at(weekday, at):
+    """每周在指定的星期几（0为周一）和时间（HH:MM）运行"""
+    daily = daily_at(at)
+
+    def next_run(now):
+        run = daily(now)
+        while datetime.fromtimestamp(run).weekday() != weekday:
+            run = daily(run)
+        return run
+    return next_run
+
+
+class Scheduler:
+    """定时任务线程
+
+    任务按下次运行时间放在堆里，线程睡到最近的任务到期再执行；
+    run_soon可以让某个任务立即执行（例如清空数据库后马上回收空间）。
+    """
+
+    def __init__(self):
+        self.condition = threading.Condition()
+        self.queue = []  # (下次运行时间, 序号, 任务名, 执行后是否按计划排下一次)
+        self.jobs = {}  # 任务名 -> (函数, 计算下次运行时间的函数)
+        self.sequence = 0
+        self.thread = None
+
+    def add(self, name, func, next_run):
+        with self.condition:
+            self.jobs[name] = (func, next_run)
+            self._push(next_run(time.time()), name)
+
+    def run_soon(self, name):
+        """让任务尽快执行一次，不影响它原来的计划"""
+        with self.condition:
+            if name in self.jobs:
+                self._push(time.time(), name, reschedule=False)
+
+    def _push(self, when, name, reschedule=True):
+        self.sequence += 1
+        heapq.heappush(self.queue, (when, self.sequence, name, reschedule))
+        self.condition.notify()
+
+    def start(self):
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def _run(self):
+        while True:
+            with self.condition:
+                while not self.queue or self.queue[0][0] > time.time():
+                    timeout = self.queue[0][0] - time.time() if self.queue else None
+                    self.condition.wait(timeout)
+                when, _, name, reschedule = heapq.heappop(self.queue)
+                func, next_run = self.jobs[name]
+                if reschedule:
+                    self._push(next_run(max(when, time.time())), name)
+            try:
+                func()
+            except Exception as e:
+                logging.error(f"Scheduled job {name} failed: {str(e)}")
+
+    def snapshot(self):
+        with self.condition:
+            upcoming = {}
+            for when, _, name, _ in sorted(self.queue):
+                upcoming.setdefault(name, datetime.fromtimestamp(when).isoformat())
+            return upcoming
+
+
+class DatabaseMaintenance:
+    """数据库维护：incremental_vacuum、optimize/ANALYZE、WAL检查点
+
+    参数:
+        connect: 返回数据库连接的函数（带busy_timeout）
+        database_path: 数据库文件路径，用来统计文件大小
+        settings: 配置文件中的maintenance部分
+    """
+
+    def __init__(self, connect, database_path, settings):
+        self.connect = connect
+        self.database_path = database_path
+        self.vacuum_min_free_bytes = settings.get('vacuum_min_free_bytes', 1024 * 1024)
+        self.vacuum_max_seconds = settings.get('vacuum_max_seconds', 30)
+        self.wal_truncate_bytes = settings.get('wal_truncate_bytes', 16 * 1024 * 1024)
+        self.lock = threading.Lock()
+        self.last_reports = {}
+
+    def file_sizes(self):
+        """数据库文件和WAL文件的大小"""
+        sizes = []
+        for path in (self.database_path, self.database_path + '-wal'):
+            try:
+                sizes.append(os.path.getsize(path))
+            except OSError:
+                sizes.append(0)
+        return sizes
+
+    def enable_incremental_vacuum(self):
+        """把数据库切换为auto_vacuum=INCREMENTAL（需要整库VACUUM一次，只在启动时、开始服务之前调用）
+
+        返回:
+            bool: 是否做了切换
+        """
+        conn = self.connect()
+        try:
+            if conn.execute('PRAGMA auto_vacuum').fetchone()[0] == 2:
+                return False
+            start = time.monotonic()
+            before = sum(self.file_sizes())
+            conn.execute('PRAGMA auto_vacuum=INCREMENTAL')
+            conn.execute('VACUUM')
+            after = sum(self.file_sizes())
+            logging.info(f"Database switched to incremental auto_vacuum: reclaimed {before - after} bytes "
+                         f"in {time.monotonic() - start:.2f}s")
+            return True
+        finally:
+            conn.close()
+
+    def _run(self, task, func):
+        """执行一项维护并记录报告（同一时间只执行一项维护）"""
+        with self.lock:
+            start = time.monotonic()
+            before = self.file_sizes()
+            details = func()
+            after = self.file_sizes()
+            report = {
+                'task': task,
+                'finished_at': datetime.now().isoformat(),
+                'duration_seconds': round(time.monotonic() - start, 3),
+                'reclaimed_bytes': sum(before) - sum(after),
+                'database_bytes': after[0],
+                'wal_bytes': after[1],
+                **details
+            }
+            self.last_reports[task] = report
+        logging.info(f"Maintenance {task}: reclaimed {report['reclaimed_bytes']} bytes "
+                     f"in {report['duration_seconds']}s {details}")
+        return report
+
+    def vacuum(self):
+        """回收空闲页：空闲空间超过vacuum_min_free_bytes时分小步incremental_vacuum"""
+        def run():
+            conn = self.connect()
+            try:
+                page_size = conn.execute('PRAGMA page_size').fetchone()[0]
+                free_pages = conn.execute('PRAGMA freelist_count').fetchone()[0]
+                if conn.execute('PRAGMA auto_vacuum').fetchone()[0] != 2:
+                    return {'skipped': 'auto_vacuum is not incremental', 'free_pages': free_pages}
+                if free_pages * page_size < self.vacuum_min_free_bytes:
+                    return {'skipped': 'below threshold', 'free_pages': free_pages}
+                deadline = time.monotonic() + self.vacuum_max_seconds
+                freed = 0
+                while free_pages and time.monotonic() < deadline:
+                    # execute只执行一步（只回收一页），executescript才会把这条PRAGMA执行完
+                    conn.executescript(f'BEGIN IMMEDIATE; PRAGMA incremental_vacuum({VACUUM_STEP_PAGES}); COMMIT;')
+                    remaining = conn.execute('PRAGMA freelist_count').fetchone()[0]
+                    freed += free_pages - remaining
+                    free_pages = remaining
+                    # 让出写锁给正在等待的请求
+                    time.sleep(0.01)
+                # 回收的页先写进WAL，检查点之后数据库文件才真正变小
+                if freed and conn.execute('PRAGMA journal_mode').fetchone()[0] == 'wal':
+                    conn.execute('PRAGMA wal_checkpoint(TRUNCATE)').fetchone()
+                return {'freed_pages': freed, 'free_pages': free_pages}
+            finally:
+                conn.close()
+        return self._run('vacuum', run)
+
+    def optimize(self):
+        """更新查询规划器的统计信息（PRAGMA optimize只分析需要的表）"""
+        def run():
+            conn = self.connect()
+            try:
+                conn.execute('PRAGMA analysis_limit=1000')
+                conn.execute('PRAGMA optimize')
+                return {}
+            finally:
+                conn.close()
+        return self._run('optimize', run)
+
+    def checkpoint(self):
+        """WAL检查点：WAL超过wal_truncate_bytes时截断WAL文件，否则做一次不阻塞的PASSIVE检查点"""
+        def run():
+            conn = self.connect()
+            try:
+                if conn.execute('PRAGMA journal_mode').fetchone()[0] != 'wal':
+                    return {'skipped': 'not in WAL mode'}
+                mode = 'TRUNCATE' if self.file_sizes()[1] >= self.wal_truncate_bytes else 'PASSIVE'
+                busy, log_pages, checkpointed = conn.execute(f'PRAGMA wal_checkpoint({mode})').fetchone()
+                return {'mode': mode, 'busy': bool(busy), 'wal_pages': log_pages, 'checkpointed_pages': checkpointed}
+            finally:
+                conn.close()
+        return self._run('checkpoint', run)
+
+    def snapshot(self):
+        with self.lock:
+            return dict(self.last_reports)
@@ -1,14 +1,35 @@
 import json
 import logging
 import os
-from datetime import datetime
+from datetime import datetime, timedelta
 from flask import Flask, request, jsonify, Response
+from flask.json.provider import DefaultJSONProvider
 from flask_cors import CORS
 import base64
 import threading
 import time
 import sqlite3
-import schedule
+import math
+import io
+import tarfile
+import gzip
+import tempfile
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from json_stream import parse_object_stream, PayloadTooLarge, NESTED_VALUE_ERROR
+import storage
+import cluster
+import codec
+import maintenance
+import uploads
+
+# Pillow是可选依赖，没有安装时不做图片转码
+try:
+    from PIL import Image
+    PIL_AVAILABLE = True
+except ImportError:
+    PIL_AVAILABLE = False
 
 app = Flask(__name__)
 CORS(app)
@@ -16,55 +37,137 @@ CORS(app)
 # 数据库配置
 DATABASE_PATH = os.path.join(os.path.dirname(__file__), 'messages.db')
 
+# 运行时配置（启动时由load_config填充）
+CONFIG = {}
+
+def get_config_value(section, key, default=None):
+    """读取配置项，配置文件中没有时返回默认值"""
+    return CONFIG.get(section, {}).get(key, default)
+
+# 消息优先级，从低到高
+PRIORITIES = ['low', 'normal', 'high', 'critical']
+
 def init_database():
     """初始化SQLite数据库"""
     conn = sqlite3.connect(DATABASE_PATH)
     cursor = conn.cursor()
     
-    # 创建消息表
+    # WAL模式下读写互不阻塞，多个工作进程可以同时读同一个数据库
+    journal_mode = get_config_value('storage', 'journal_mode', 'wal')
+    cursor.execute(f'PRAGMA journal_mode={journal_mode}')
+    
+    # 消息按时间分区存储，旧版的单表messages登记为一个分区
+    if storage.init_storage(conn):
+        logging.info("Database migrated: legacy messages table registered as a partition")
+    
+    # 创建幂等键表：记录最近的Idempotency-Key及其对应的消息ID，用于发送端安全重试
     cursor.execute('''
-        CREATE TABLE IF NOT EXISTS messages (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            type TEXT NOT NULL,
-            timestamp TEXT NOT NULL,
-            content TEXT,
-            image_data TEXT,
-            title TEXT
+        CREATE TABLE IF NOT EXISTS idempotency_keys (
+            key TEXT PRIMARY KEY,
+            message_id INTEGER NOT NULL,
+            created_at REAL NOT NULL
         )
     ''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_idempotency_created ON idempotency_keys(created_at)')
     
     conn.commit()
     conn.close()
     logging.info("Database initialized")
 
 def get_db_connection():
-    """获取数据库连接"""
-    conn = sqlite3.connect(DATABASE_PATH)
+    """获取数据库连接
+    
+    写锁被其他线程或工作进程占用时最多等待storage.busy_timeout秒。
+    """
+    conn = sqlite3.connect(DATABASE_PATH, timeout=get_config_value('storage', 'busy_timeout', 10))
     conn.row_factory = sqlite3.Row
     return conn
 
+def get_partition_mode():
+    """消息分区粒度：day 或 week"""
+    return get_config_value('storage', 'partition', 'day')
+
+def drop_all_messages(conn):
+    """删除所有消息（在写事务中调用）
+    
+    drop_all会重置ID序列，之后的新消息会重新用到旧ID，幂等键要一起删掉，
+    否则重发的旧键会命中一条不相干的新消息而被当成重复丢掉。
+    """
+    count = storage.drop_all(conn)
+    conn.execute('DELETE FROM idempotency_keys')
+    return count
+
 def clear_database():
-    """清空数据库"""
+    """清空数据库（直接删除所有分区表）"""
     conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute("DELETE FROM messages")
-    cursor.execute("DELETE FROM sqlite_sequence WHERE name='messages'")
+    storage.begin_write(conn)
+    count = drop_all_messages(conn)
     conn.commit()
     conn.close()
-    logging.info("Database cleared")
+    logging.info(f"Database cleared: {count} messages removed")
+    notifier.notify()
+    # 删除的分区留下大量空闲页，马上回收
+    if scheduler:
+        scheduler.run_soon('vacuum')
+
+def apply_retention():
+    """删除超过保留天数的整个分区"""
+    retention_days = get_config_value('storage', 'retention_days', 0)
+    cutoff = (datetime.now() - timedelta(days=retention_days)).isoformat()
+    conn = get_db_connection()
+    storage.begin_write(conn)
+    dropped = storage.drop_partitions_before(conn, cutoff)
+    conn.commit()
+    conn.close()
+    for name, count in dropped:
+        logging.info(f"Retention dropped partition {name}: {count} messages")
+    if dropped:
+        notifier.notify()
+        if scheduler:
+            scheduler.run_soon('vacuum')
+
+scheduler = None
+db_maintenance = None
+
+def setup_maintenance():
+    """创建数据库维护对象；配置了maintenance.incremental_vacuum时把数据库切换为增量回收模式
+    
+    切换需要整库VACUUM一次，在启动时、开始服务之前完成。
+    """
+    global db_maintenance
+    settings = CONFIG.get('maintenance', {})
+    db_maintenance = maintenance.DatabaseMaintenance(get_db_connection, DATABASE_PATH, settings)
+    if settings.get('incremental_vacuum', True):
+        db_maintenance.enable_incremental_vacuum()
 
 def setup_scheduler():
-    """设置定时任务 - 每周日23:00清空数据库"""
-    schedule.every().sunday.at("23:00").do(clear_database)
-    logging.info("Scheduler setup: database will be cleared every Sunday at 23:00")
+    """设置定时任务
     
-    def run_scheduler():
-        while True:
-            schedule.run_pending()
-            time.sleep(60)  # 每分钟检查一次
+    配置了storage.retention_days时，每天00:05删除过期的分区；
+    否则保持原来的行为，每周日23:00清空数据库。
+    另外按maintenance中的间隔（秒，0表示不执行）定期回收空闲页、WAL检查点和更新统计信息。
+    """
+    global scheduler
+    scheduler = maintenance.Scheduler()
+    retention_days = get_config_value('storage', 'retention_days', 0)
+    if retention_days:
+        scheduler.add('retention', apply_retention, maintenance.daily_at("00:05"))
+        logging.info(f"Scheduler setup: partitions older than {retention_days} days will be dropped daily")
+    else:
+        scheduler.add('clear', clear_database, maintenance.weekly_at(6, "23:00"))
+        logging.info("Scheduler setup: database will be cleared every Sunday at 23:00")
+    
+    if db_maintenance:
+        for task, default_interval in (('checkpoint', 300), ('vacuum', 3600), ('optimize', 21600)):
+            interval = get_config_value('maintenance', f'{task}_interval', default_interval)
+            if interval:
+                scheduler.add(task, getattr(db_maintenance, task), maintenance.every(interval))
+                logging.info(f"Scheduler setup: database {task} every {interval} seconds")
     
-    scheduler_thread = threading.Thread(target=run_scheduler, daemon=True)
-    scheduler_thread.start()
+    # 清理过期的断点续传会话
+    scheduler.add('uploads', expire_upload_sessions, maintenance.every(3600))
+    
+    scheduler.start()
 
 # 配置日志
 def setup_logging():
@@ -83,78 +186,1210 @@ def load_config():
     with open(config_path, 'r', encoding='utf-8') as f:
         return json.load(f)
 
-@app.route('/api/messages', methods=['POST'])
-def receive_message():
+class FastJSONProvider(DefaultJSONProvider):
+    """用orjson/msgspec编解码的Flask JSON实现，遇到它们不支持的类型时退回默认实现"""
+    
+    def dumps(self, obj, **kwargs):
+        try:
+            return codec.json_dumps(obj).decode('utf-8')
+        except TypeError:
+            return super().dumps(obj, **kwargs)
+    
+    def loads(self, s, **kwargs):
+        return codec.json_loads(s)
+
+def setup_serialization():
+    """选择JSON库（serialization.json_backend：auto/orjson/msgspec/json），jsonify和get_json都会使用它"""
+    backend = codec.select_json_backend(get_config_value('serialization', 'json_backend', 'auto'))
+    if backend != 'json':
+        app.json = FastJSONProvider(app)
+    logging.info(f"JSON backend: {backend}, MessagePack: "
+                 f"{'enabled' if msgpack_enabled() else 'disabled'}")
+
+def msgpack_enabled():
+    return get_config_value('serialization', 'msgpack', True) and codec.msgpack_available()
+
+def wants_msgpack():
+    """客户端的Accept头是否优先要MessagePack"""
+    if not msgpack_enabled():
+        return False
+    best = request.accept_mimetypes.best_match((codec.JSON_MIMETYPE,) + codec.MSGPACK_MIMETYPES,
+                                               default=codec.JSON_MIMETYPE)
+    return best in codec.MSGPACK_MIMETYPES
+
+def make_data_response(payload, status=200):
+    """按客户端的Accept头返回JSON或MessagePack"""
+    if wants_msgpack():
+        response = Response(codec.msgpack_dumps(payload), status=status, mimetype=codec.MSGPACK_MIMETYPE)
+    else:
+        response = Response(codec.json_dumps(payload), status=status, mimetype=codec.JSON_MIMETYPE)
+    response.vary.add('Accept')
+    return response
+
+class MessageNotifier:
+    """消息变更通知，长轮询的客户端在这里等待新消息
+    
+    每次变更更新版本号并唤醒等待者。high/critical/normal消息立即唤醒，
+    low消息攒一段时间（low_priority_delay秒）后合并唤醒一次，减少无关紧要的推送。
+    版本号取当前毫秒时间戳（保证递增），多进程模式下通过broadcaster把版本号发给其他工作进程，
+    各进程的版本号保持一致，长轮询请求落到哪个进程都能正确等待。
+    changes是数据变更计数，每次写入立即加一（low消息也不延迟），列表响应缓存以它判断是否过期。
+    """
+    
+    def __init__(self):
+        self.condition = threading.Condition()
+        self.version = 0
+        self.changes = 0
+        self.lazy_timer = None
+        self.broadcaster = None
+    
+    def notify(self, priority='normal'):
+        """记录一次变更，按优先级决定立即唤醒还是延迟合并唤醒"""
+        if priority == 'low':
+            with self.condition:
+                self.changes += 1
+                if self.lazy_timer is None:
+                    delay = get_config_value('delivery', 'low_priority_delay', 10)
+                    self.lazy_timer = threading.Timer(delay, self._flush_lazy)
+                    self.lazy_timer.daemon = True
+                    self.lazy_timer.start()
+            # 版本号0表示只有数据变更，不唤醒等待者
+            if self.broadcaster:
+                self.broadcaster.publish(priority, 0)
+            return
+        self._bump(priority)
+    
+    def _flush_lazy(self):
+        with self.condition:
+            self.lazy_timer = None
+        self._bump('low')
+    
+    def _bump(self, priority):
+        with self.condition:
+            self.version = max(self.version + 1, int(time.time() * 1000))
+            self.changes += 1
+            version = self.version
+            self.condition.notify_all()
+        if self.broadcaster:
+            self.broadcaster.publish(priority, version)
+    
+    def apply_remote(self, priority, version):
+        """其他工作进程广播来的变更（low消息已在发出方合并过，这里直接唤醒）"""
+        with self.condition:
+            self.changes += 1
+            if version:
+                self.version = version if version > self.version else self.version + 1
+                self.condition.notify_all()
+    
+    def state(self):
+        """当前的(数据变更计数, 版本号)，两者都没变时列表查询的结果不变"""
+        with self.condition:
+            return self.changes, self.version
+    
+    def wait_for_change(self, since_version, timeout):
+        """等待版本号变化，返回当前版本号（超时则返回原版本号）"""
+        with self.condition:
+            self.condition.wait_for(lambda: self.version != since_version, timeout)
+            return self.version
+
+notifier = MessageNotifier()
+
+def insert_message(cursor, message):
+    """插入一条消息到所属的时间分区，返回新消息ID"""
+    return storage.insert_message(cursor.connection, message, get_partition_mode())
+
+# 消息的字段，fields查询参数只能从中选择
+MESSAGE_FIELDS = ('id', 'type', 'timestamp', 'content', 'image_data', 'title', 'priority', 'channel')
+
+def parse_fields(value):
+    """解析fields查询参数（逗号分隔），返回字段元组（总是包含id），参数非法返回None"""
+    fields = [field.strip() for field in value.split(',') if field.strip()]
+    if not fields or any(field not in MESSAGE_FIELDS for field in fields):
+        return None
+    return tuple(field for field in MESSAGE_FIELDS if field == 'id' or field in fields)
+
+def parse_id_list(value):
+    """解析ids查询参数（逗号分隔），按出现顺序去重，参数非法返回None"""
     try:
-        data = request.get_json()
+        ids = [int(part) for part in value.split(',') if part.strip()]
+    except ValueError:
+        return None
+    return list(dict.fromkeys(ids)) or None
+
+def row_to_message(row, fields=None):
+    """数据库行转换为消息字典，fields给出时只包含这些字段"""
+    if fields:
+        return {field: row[field] for field in fields}
+    return {
+        'id': row['id'],
+        'type': row['type'],
+        'timestamp': row['timestamp'],
+        'content': row['content'],
+        'image_data': row['image_data'],
+        'title': row['title'],
+        'priority': row['priority'],
+        'channel': row['channel']
+    }
+
+def parse_priority_filter(value):
+    """解析priority查询参数（逗号分隔），返回优先级列表，参数非法返回None"""
+    priorities = [p.strip() for p in value.split(',') if p.strip()]
+    if not priorities or any(p not in PRIORITIES for p in priorities):
+        return None
+    return priorities
+
+def get_idempotency_key(data, use_header=True):
+    """从请求头Idempotency-Key或消息字段client_msg_id中获取幂等键（批量接口每条消息只用client_msg_id）"""
+    key = (use_header and request.headers.get('Idempotency-Key')) or data.get('client_msg_id')
+    if key is None:
+        return None
+    return str(key).strip() or None
+
+def find_idempotent_message(cursor, key):
+    """查找幂等键对应的原消息，返回(message_id, timestamp)，不存在返回None
+    
+    先清理过期的幂等键，再查找，保证过期键不会被命中。
+    """
+    ttl = get_config_value('idempotency', 'ttl_seconds', 86400)
+    cursor.execute('DELETE FROM idempotency_keys WHERE created_at < ?', (time.time() - ttl,))
+    cursor.execute('SELECT message_id FROM idempotency_keys WHERE key = ?', (key,))
+    row = cursor.fetchone()
+    if not row:
+        return None
+    original = storage.find_message(cursor.connection, row['message_id'], 'timestamp')
+    return row['message_id'], original['timestamp'] if original else None
+
+def remember_idempotency_key(cursor, key, message_id):
+    """记录幂等键，超过上限时淘汰最旧的键"""
+    max_keys = get_config_value('idempotency', 'max_keys', 10000)
+    cursor.execute('INSERT INTO idempotency_keys (key, message_id, created_at) VALUES (?, ?, ?)',
+                   (key, message_id, time.time()))
+    cursor.execute('SELECT COUNT(*) FROM idempotency_keys')
+    overflow = cursor.fetchone()[0] - max_keys
+    if overflow > 0:
+        cursor.execute('''
+            DELETE FROM idempotency_keys WHERE key IN (
+                SELECT key FROM idempotency_keys ORDER BY created_at LIMIT ?
+            )
+        ''', (overflow,))
+
+class RateLimiter:
+    """按发送者（或IP）分桶的令牌桶限流器
+    
+    每个键一个令牌桶，以rate个/秒的速度补充，最多攒burst个。
+    coalesce模式下，超限的消息不直接拒绝，而是合并成该发送者的一条待发消息，
+    等令牌恢复后由后台线程写入数据库。
+    """
+    
+    def __init__(self, rate, burst, mode='reject', idle_seconds=600):
+        self.rate = float(rate)
+        self.burst = float(burst)
+        self.mode = mode
+        self.idle_seconds = idle_seconds
+        self.lock = threading.Lock()
+        self.buckets = {}  # key -> [剩余令牌数, 上次补充时间]
+        self.pending = {}  # key -> {'message': 最新的消息, 'count': 合并的条数}
+        self.stats = {'allowed': 0, 'rejected': 0, 'coalesced': 0, 'flushed': 0}
+    
+    def _refill(self, key, now):
+        bucket = self.buckets.get(key)
+        if bucket is None:
+            bucket = self.buckets[key] = [self.burst, now]
+        else:
+            bucket[0] = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+            bucket[1] = now
+        return bucket
+    
+    def _take(self, key, now):
+        """尝试取一个令牌，返回(是否成功, 需要等待的秒数)"""
+        bucket = self._refill(key, now)
+        if bucket[0] >= 1:
+            bucket[0] -= 1
+            return True, 0
+        return False, (1 - bucket[0]) / self.rate if self.rate > 0 else 60
+    
+    def acquire(self, key):
+        """为一次请求取令牌，返回(是否放行, 建议的Retry-After秒数)"""
+        with self.lock:
+            now = time.monotonic()
+            allowed, wait = self._take(key, now)
+            if allowed:
+                self.stats['allowed'] += 1
+            else:
+                self.stats['rejected'] += 1
+            self._prune(now)
+            return allowed, wait
+    
+    def refund(self, key):
+        """退还一个令牌（取了令牌之后发现是已成功消息的重试）"""
+        with self.lock:
+            bucket = self.buckets.get(key)
+            if bucket is not None:
+                bucket[0] = min(self.burst, bucket[0] + 1)
+            self.stats['allowed'] -= 1
+    
+    def coalesce(self, key, message):
+        """把超限的消息合并到待发槽位，返回当前已合并的条数"""
+        with self.lock:
+            slot = self.pending.get(key)
+            count = slot['count'] + 1 if slot else 1
+            self.pending[key] = {'message': message, 'count': count}
+            self.stats['coalesced'] += 1
+            return count
+    
+    def take_ready_pending(self):
+        """取出令牌已恢复的待发消息，返回[(key, message, count)]"""
+        ready = []
+        with self.lock:
+            now = time.monotonic()
+            for key in list(self.pending):
+                allowed, _ = self._take(key, now)
+                if allowed:
+                    slot = self.pending.pop(key)
+                    ready.append((key, slot['message'], slot['count']))
+                    self.stats['flushed'] += 1
+        return ready
+    
+    def _prune(self, now):
+        """清理长时间空闲且已经攒满令牌的桶，避免键无限增长"""
+        if len(self.buckets) < 1000:
+            return
+        for key in list(self.buckets):
+            tokens, last = self.buckets[key]
+            if key not in self.pending and now - last > self.idle_seconds:
+                del self.buckets[key]
+    
+    def snapshot(self):
+        """返回限流器状态，用于/api/metrics"""
+        with self.lock:
+            now = time.monotonic()
+            buckets = {}
+            # 只展示令牌最少的前100个键，便于排查是谁在刷消息
+            for key in sorted(self.buckets, key=lambda k: self.buckets[k][0])[:100]:
+                tokens, last = self.buckets[key]
+                buckets[key] = round(min(self.burst, tokens + (now - last) * self.rate), 2)
+            return {
+                'enabled': True,
+                'mode': self.mode,
+                'rate_per_second': self.rate,
+                'burst': self.burst,
+                'active_keys': len(self.buckets),
+                'pending_coalesced': {key: slot['count'] for key, slot in self.pending.items()},
+                'tokens': buckets,
+                **self.stats
+            }
+
+# 全局限流器，由setup_rate_limiter根据配置创建，未启用时为None
+rate_limiter = None
+
+def setup_rate_limiter(workers=1):
+    """根据配置创建限流器，coalesce模式下启动合并消息的写入线程
+    
+    多进程模式下每个工作进程各有一份令牌桶，连接由内核在进程间大致平均分配，
+    所以速率和突发量按进程数均分，合计起来不超过配置值。
+    """
+    global rate_limiter
+    settings = CONFIG.get('rate_limit', {})
+    if not settings.get('enabled', False):
+        logging.info("Rate limiting disabled")
+        return
+    
+    rate_limiter = RateLimiter(
+        rate=settings.get('rate_per_second', 1) / workers,
+        burst=max(1, settings.get('burst', 10) / workers),
+        mode=settings.get('mode', 'reject')
+    )
+    logging.info(f"Rate limiting enabled: {rate_limiter.rate}/s, burst {rate_limiter.burst}, mode {rate_limiter.mode}")
+    
+    if rate_limiter.mode == 'coalesce':
+        def run_flusher():
+            while True:
+                time.sleep(1)
+                try:
+                    flush_coalesced_messages()
+                except Exception as e:
+                    logging.error(f"Error flushing coalesced messages: {str(e)}")
         
-        # 验证必要字段
-        if 'type' not in data:
-            return jsonify({'error': 'Message type is required'}), 400
-            
-        if data['type'] not in ['text', 'image', 'mixed']:
-            return jsonify({'error': 'Invalid message type'}), 400
-            
-        # 创建消息对象
-        message = {
-            'type': data['type'],
-            'timestamp': datetime.now().isoformat(),
-            'content': data.get('content', ''),
-            'image_data': data.get('image_data', ''),  # base64编码的图片数据
-            'title': data.get('title', '无标题')
-        }
+        threading.Thread(target=run_flusher, daemon=True).start()
+
+def get_rate_limit_key(data):
+    """获取限流键：按配置使用发送者ID（X-Sender-Id头或sender字段）或客户端IP"""
+    if get_config_value('rate_limit', 'key', 'sender') == 'sender':
+        sender = request.headers.get('X-Sender-Id') or data.get('sender')
+        if sender:
+            return f"sender:{sender}"
+    return f"ip:{request.remote_addr}"
+
+def flush_coalesced_messages():
+    """把令牌已恢复的合并消息写入数据库
+    
+    待发槽位里存的是原始字段和收到的时间，图片在这里才转码（每个槽位只转一次），转码在写事务之外完成。
+    """
+    ready = rate_limiter.take_ready_pending()
+    if not ready:
+        return
+    
+    messages = []
+    for key, (data, received_at), count in ready:
+        message, _, error = prepare_message(data, use_header=False)
+        if error:
+            logging.warning(f"Dropped coalesced message from {key}: {error[0]}")
+            continue
+        message['timestamp'] = received_at
+        if count > 1:
+            message['content'] = f"{message['content']}\n\n（限流期间合并了 {count} 条消息，仅保留最新一条）"
+        messages.append((key, message, count))
+    
+    conn = get_db_connection()
+    try:
+        cursor = conn.cursor()
+        storage.begin_write(conn)
+        for key, message, count in messages:
+            message_id = insert_message(cursor, message)
+            logging.info(f"Flushed coalesced message: {message_id}, key: {key}, merged: {count}")
+        conn.commit()
+    finally:
+        conn.close()
+    
+    for key, message, count in messages:
+        notifier.notify(message['priority'])
+
+def rate_limit_response(key, message, retry_after):
+    """生成超限时的响应：reject模式返回429，coalesce模式合并后返回202"""
+    if rate_limiter.mode == 'coalesce':
+        count = rate_limiter.coalesce(key, message)
+        return jsonify({
+            'success': True,
+            'coalesced': True,
+            'pending_count': count
+        }), 202
+    
+    response = jsonify({
+        'error': 'Rate limit exceeded',
+        'retry_after': math.ceil(retry_after)
+    })
+    response.headers['Retry-After'] = str(math.ceil(retry_after))
+    return response, 429
+
+class ImagePolicy:
+    """入库时的图片处理策略：把BMP这类无损但巨大的格式转成PNG/WebP/JPEG，并可限制最长边
+    
+    转码在独立的线程池中进行（Pillow编解码时会释放GIL），同时转码的数量不超过workers。
+    """
+    
+    def __init__(self, settings):
+        self.target_format = settings.get('format', 'png').upper()
+        if self.target_format == 'JPG':
+            self.target_format = 'JPEG'
+        self.quality = settings.get('quality', 85)
+        self.max_edge = settings.get('max_edge', 0)
+        self.keep_original = settings.get('keep_original', False)
+        self.transcode_formats = {f.upper() for f in settings.get('transcode_formats', ['BMP', 'TIFF', 'PPM'])}
+        self.executor = ThreadPoolExecutor(max_workers=settings.get('workers', 2), thread_name_prefix='image-policy')
+        self.lock = threading.Lock()
+        self.stats = {'processed': 0, 'transcoded': 0, 'failed': 0, 'bytes_in': 0, 'bytes_out': 0}
+    
+    def process(self, image_data):
+        """按策略处理base64图片，返回处理后的base64数据；无需处理或处理失败时返回原数据"""
+        try:
+            result = self.executor.submit(self._transcode, image_data).result()
+        except Exception as e:
+            logging.warning(f"Image transcoding failed, storing original: {str(e)}")
+            with self.lock:
+                self.stats['failed'] += 1
+            return image_data
         
-        # 插入数据库
-        conn = get_db_connection()
+        with self.lock:
+            self.stats['processed'] += 1
+            if result is not None:
+                self.stats['transcoded'] += 1
+                self.stats['bytes_in'] += len(image_data)
+                self.stats['bytes_out'] += len(result)
+        return image_data if result is None else result
+    
+    def _transcode(self, image_data):
+        """在线程池中执行：解码、缩放、重新编码，不需要处理时返回None"""
+        binary_data = base64.b64decode(image_data)
+        image = Image.open(io.BytesIO(binary_data))
+        needs_resize = self.max_edge and max(image.size) > self.max_edge
+        if image.format == self.target_format and not needs_resize:
+            return None
+        if image.format not in self.transcode_formats and not needs_resize:
+            return None
+        
+        if needs_resize:
+            image.thumbnail((self.max_edge, self.max_edge), Image.LANCZOS)
+        if self.target_format == 'JPEG' and image.mode not in ('RGB', 'L'):
+            image = image.convert('RGB')
+        elif image.mode not in ('RGB', 'RGBA', 'L', 'LA', 'P'):
+            image = image.convert('RGBA')
+        
+        output = io.BytesIO()
+        if self.target_format == 'PNG':
+            image.save(output, 'PNG', optimize=True)
+        else:
+            image.save(output, self.target_format, quality=self.quality)
+        # 没有缩放且转码后反而更大时保留原图
+        if not needs_resize and output.tell() >= len(binary_data):
+            return None
+        return base64.b64encode(output.getvalue()).decode('utf-8')
+    
+    def snapshot(self):
+        """返回图片处理统计，用于/api/metrics"""
+        with self.lock:
+            return {
+                'enabled': True,
+                'format': self.target_format,
+                'max_edge': self.max_edge,
+                **self.stats
+            }
+
+# 全局图片处理策略，由setup_image_policy根据配置创建，未启用时为None
+image_policy = None
+
+def setup_image_policy():
+    """根据配置创建入库图片处理策略"""
+    global image_policy
+    settings = CONFIG.get('image_policy', {})
+    if not settings.get('enabled', False):
+        return
+    if not PIL_AVAILABLE:
+        logging.warning("Image policy enabled but Pillow is not installed, images will be stored as-is")
+        return
+    image_policy = ImagePolicy(settings)
+    logging.info(f"Image policy enabled: {image_policy.target_format}, max edge {image_policy.max_edge}")
+
+# 请求体大小限制的默认值，可在config.json的limits中修改
+DEFAULT_MAX_CONTENT_LENGTH = 32 * 1024 * 1024
+DEFAULT_FIELD_LIMITS = {
+    'type': 16,
+    'title': 200,
+    'priority': 16,
+    'channel': 64,
+    'client_msg_id': 200,
+    'sender': 200,
+    'image_name': 260,
+    'content': 64 * 1024,
+    'image_data': DEFAULT_MAX_CONTENT_LENGTH
+}
+# 不受请求体大小限制的接口（批量导入的请求体可能有几个G）
+UNLIMITED_ENDPOINTS = {'import_messages'}
+
+# 同时进行流式解析的大请求数量上限，由setup_upload_limits根据配置设置
+large_upload_slots = threading.BoundedSemaphore(4)
+
+def setup_upload_limits():
+    """根据配置设置大请求并发数"""
+    global large_upload_slots
+    large_upload_slots = threading.BoundedSemaphore(get_config_value('limits', 'max_concurrent_large_uploads', 4))
+
+def get_field_limits():
+    """获取各字段的长度限制（字符数）"""
+    limits = dict(DEFAULT_FIELD_LIMITS)
+    limits.update(get_config_value('limits', 'max_field_length', {}))
+    return limits
+
+@app.before_request
+def reject_oversized_request():
+    """根据Content-Length提前拒绝过大的请求，不读取请求体"""
+    if request.endpoint in UNLIMITED_ENDPOINTS:
+        return None
+    max_length = get_config_value('limits', 'max_content_length', DEFAULT_MAX_CONTENT_LENGTH)
+    if request.content_length is not None and request.content_length > max_length:
+        logging.warning(f"Rejected oversized request: {request.content_length} bytes to {request.path}")
+        return jsonify({'error': f'Request body exceeds {max_length} bytes'}), 413
+    return None
+
+def check_field_limits(data, field_limits):
+    """检查已解析的请求体各字段长度，返回(data, 错误响应)
+    
+    和大请求体的增量解析一样，字段值不能是对象或数组，同一个请求体不会因为大小不同而结果不同。
+    """
+    for field, value in data.items():
+        if isinstance(value, (dict, list)):
+            return None, (jsonify({'error': f'Invalid JSON body: {NESTED_VALUE_ERROR}'}), 400)
+        limit = field_limits.get(field)
+        if isinstance(value, str) and limit and len(value) > limit:
+            return None, (jsonify({'error': f"Field '{field}' exceeds {limit} characters"}), 413)
+    return data, None
+
+def read_message_payload():
+    """读取并校验消息请求体，返回(data, 错误响应)
+    
+    小请求直接用get_json解析；大请求（或没有Content-Length的分块请求）
+    用增量解析器边读边检查字段长度，超限立即中止，并限制同时解析的大请求数量。
+    """
+    max_length = get_config_value('limits', 'max_content_length', DEFAULT_MAX_CONTENT_LENGTH)
+    stream_threshold = get_config_value('limits', 'stream_threshold', 1024 * 1024)
+    field_limits = get_field_limits()
+    
+    if request.mimetype in codec.MSGPACK_MIMETYPES:
+        # MessagePack请求体没有增量解析，按总大小上限读取后整体解析
+        if not msgpack_enabled():
+            return None, (jsonify({'error': 'MessagePack is not supported'}), 415)
+        body = request.stream.read(max_length + 1)
+        if len(body) > max_length:
+            return None, (jsonify({'error': f'Request body exceeds {max_length} bytes'}), 413)
+        try:
+            data = codec.msgpack_loads(body)
+        except Exception:
+            data = None
+        if not isinstance(data, dict):
+            return None, (jsonify({'error': 'Invalid MessagePack body'}), 400)
+        return check_field_limits(data, field_limits)
+    
+    if request.content_length is not None and request.content_length <= stream_threshold:
+        data = request.get_json(silent=True)
+        if not isinstance(data, dict):
+            return None, (jsonify({'error': 'Invalid JSON body'}), 400)
+        return check_field_limits(data, field_limits)
+    
+    if not large_upload_slots.acquire(timeout=10):
+        response = jsonify({'error': 'Too many large uploads in progress'})
+        response.headers['Retry-After'] = '5'
+        return None, (response, 503)
+    try:
+        data = parse_object_stream(request.stream, field_limits, max_bytes=max_length)
+        return data, None
+    except PayloadTooLarge as e:
+        logging.warning(f"Rejected oversized message: {str(e)}")
+        return None, (jsonify({'error': str(e)}), 413)
+    except ValueError as e:
+        return None, (jsonify({'error': f'Invalid JSON body: {str(e)}'}), 400)
+    finally:
+        large_upload_slots.release()
+
+def validate_message(data):
+    """检查消息的必要字段（不解码图片，开销很小），返回错误(错误信息, 状态码)，没问题返回None"""
+    if 'type' not in data:
+        return 'Message type is required', 400
+        
+    if data['type'] not in ['text', 'image', 'mixed']:
+        return 'Invalid message type', 400
+        
+    if data.get('priority', 'normal') not in PRIORITIES:
+        return 'Invalid message priority', 400
+    return None
+
+def prepare_message(data, use_header=True):
+    """校验消息字段并创建消息对象（图片按策略转码），返回(message, 幂等键, 错误)，错误是(错误信息, 状态码)"""
+    error = validate_message(data)
+    if error:
+        return None, None, error
+    
+    # 创建消息对象
+    message = {
+        'type': data['type'],
+        'timestamp': datetime.now().isoformat(),
+        'content': data.get('content', ''),
+        'image_data': data.get('image_data', ''),  # base64编码的图片数据
+        'title': data.get('title', '无标题'),
+        'priority': data.get('priority', 'normal'),
+        'channel': str(data.get('channel', ''))
+    }
+    
+    idempotency_key = get_idempotency_key(data, use_header)
+    if idempotency_key and len(idempotency_key) > 200:
+        return None, None, ('Idempotency key too long', 400)
+    
+    # 按策略转码/缩小图片，在打开数据库连接之前完成，不占用写锁
+    if image_policy and message['image_data']:
+        processed = image_policy.process(message['image_data'])
+        if processed is not message['image_data'] and image_policy.keep_original:
+            message['original_image_data'] = message['image_data']
+        message['image_data'] = processed
+    return message, idempotency_key, None
+
+def check_rate_limit(data):
+    """在解码图片和打开写事务之前取令牌，返回(限流键, 超限时的响应)，未启用限流时限流键为None
+    
+    超限的消息不做转码、不占写锁就直接返回：reject模式429，coalesce模式把原始字段合并到待发槽位，
+    等令牌恢复后再由后台线程转码入库。
+    """
+    if not rate_limiter:
+        return None, None
+    limit_key = get_rate_limit_key(data)
+    allowed, retry_after = rate_limiter.acquire(limit_key)
+    if allowed:
+        return limit_key, None
+    logging.warning(f"Rate limit exceeded: {limit_key}")
+    return limit_key, rate_limit_response(limit_key, (data, datetime.now().isoformat()), retry_after)
+
+def save_message(data):
+    """校验已解析的消息字段并入库，返回响应（POST /api/messages和二进制上传接口共用）"""
+    error = validate_message(data)
+    if error:
+        return jsonify({'error': error[0]}), error[1]
+    limit_key, limited_response = check_rate_limit(data)
+    if limited_response:
+        return limited_response
+    
+    message, idempotency_key, error = prepare_message(data)
+    if error:
+        return jsonify({'error': error[0]}), error[1]
+    priority = message['priority']
+    
+    # 插入数据库
+    conn = get_db_connection()
+    try:
         cursor = conn.cursor()
-        cursor.execute('''
-            INSERT INTO messages (type, timestamp, content, image_data, title)
-            VALUES (?, ?, ?, ?, ?)
-        ''', (message['type'], message['timestamp'], message['content'], 
-              message['image_data'], message['title']))
-        message_id = cursor.lastrowid
+        # 立即获取写锁：避免同一个幂等键的并发重试同时插入，也避免多进程写入时读后写的锁升级冲突
+        storage.begin_write(conn)
+        if idempotency_key:
+            existing = find_idempotent_message(cursor, idempotency_key)
+            if existing:
+                conn.commit()
+                # 重试已成功的消息不消耗令牌
+                if limit_key:
+                    rate_limiter.refund(limit_key)
+                message_id, timestamp = existing
+                logging.info(f"Duplicate message ignored: {message_id}, key: {idempotency_key}")
+                return jsonify({
+                    'success': True,
+                    'message_id': message_id,
+                    'timestamp': timestamp,
+                    'duplicate': True
+                }), 200
+        
+        message_id = insert_message(cursor, message)
+        if idempotency_key:
+            remember_idempotency_key(cursor, idempotency_key, message_id)
         conn.commit()
+    finally:
         conn.close()
+    
+    logging.info(f"Received message: {message_id}, type: {message['type']}, priority: {priority}")
+    
+    # 唤醒长轮询的客户端，高优先级消息立即推送，低优先级延迟合并推送
+    notifier.notify(priority)
+    return jsonify({
+        'success': True,
+        'message_id': message_id,
+        'timestamp': message['timestamp']
+    }), 200
+
+@app.route('/api/messages', methods=['POST'])
+def receive_message():
+    try:
+        data, error_response = read_message_payload()
+        if error_response:
+            return error_response
+        
+        return save_message(data)
+        
+    except Exception as e:
+        logging.error(f"Error receiving message: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/messages/batch', methods=['POST'])
+def receive_message_batch():
+    """批量发送：请求体是 {"messages": [消息, ...]}，所有消息在一个事务里入库，只唤醒一次等待的客户端
+
+    每条消息单独校验、去重（client_msg_id）和限流，返回和消息一一对应的results，
+    单条失败不影响其他消息（失败的那条带error和status）。
+    """
+    try:
+        data = request.get_json(silent=True)
+        if not isinstance(data, dict) or not isinstance(data.get('messages'), list):
+            return jsonify({'error': 'Request body must be {"messages": [...]}'}), 400
+        max_messages = get_config_value('limits', 'max_batch_messages', 500)
+        if len(data['messages']) > max_messages:
+            return jsonify({'error': f'Batch exceeds {max_messages} messages'}), 413
         
-        logging.info(f"Received message: {message_id}, type: {message['type']}")
+        field_limits = get_field_limits()
+        results = []
+        prepared = []
+        for item in data['messages']:
+            if not isinstance(item, dict):
+                results.append({'error': 'Invalid message', 'status': 400})
+                continue
+            item, error_response = check_field_limits(item, field_limits)
+            if error_response:
+                response, status = error_response
+                results.append({'error': response.get_json()['error'], 'status': status})
+                continue
+            error = validate_message(item)
+            if error:
+                results.append({'error': error[0], 'status': error[1]})
+                continue
+            # 先取令牌，超限的消息不转码、不进写事务
+            limit_key, limited_response = check_rate_limit(item)
+            if limited_response:
+                response, status = limited_response
+                body = response.get_json()
+                if status == 202:
+                    results.append({'coalesced': True, 'pending_count': body['pending_count']})
+                else:
+                    results.append({'error': body['error'], 'status': status, 'retry_after': body['retry_after']})
+                continue
+            message, idempotency_key, error = prepare_message(item, use_header=False)
+            if error:
+                results.append({'error': error[0], 'status': error[1]})
+                continue
+            results.append(None)
+            prepared.append((len(results) - 1, limit_key, message, idempotency_key))
         
-        # 转发消息给所有连接的客户端（这里简化处理，实际可能需要WebSocket）
+        inserted = []
+        conn = get_db_connection()
+        try:
+            cursor = conn.cursor()
+            storage.begin_write(conn)
+            for index, limit_key, message, idempotency_key in prepared:
+                if idempotency_key:
+                    existing = find_idempotent_message(cursor, idempotency_key)
+                    if existing:
+                        if limit_key:
+                            rate_limiter.refund(limit_key)
+                        results[index] = {'message_id': existing[0], 'timestamp': existing[1], 'duplicate': True}
+                        continue
+                message_id = insert_message(cursor, message)
+                if idempotency_key:
+                    remember_idempotency_key(cursor, idempotency_key, message_id)
+                results[index] = {'message_id': message_id, 'timestamp': message['timestamp']}
+                inserted.append(message['priority'])
+            conn.commit()
+        finally:
+            conn.close()
+        
+        logging.info(f"Received batch: {len(inserted)} of {len(results)} messages stored")
+        if inserted:
+            # 按这批里最高的优先级唤醒一次
+            notifier.notify(max(inserted, key=PRIORITIES.index))
         return jsonify({
             'success': True,
-            'message_id': message_id,
-            'timestamp': message['timestamp']
+            'accepted': sum(1 for result in results if 'error' not in result),
+            'results': results
         }), 200
         
     except Exception as e:
-        logging.error(f"Error receiving message: {str(e)}")
+        logging.error(f"Error receiving message batch: {str(e)}")
         return jsonify({'error': str(e)}), 500
 
+# 二进制上传时每次从请求体读取的字节数
+UPLOAD_READ_SIZE = 64 * 1024
+
+def get_max_upload_bytes(field_limits):
+    """二进制上传的图片大小上限：图片按base64入库，原始字节数按base64后的字段长度限制折算"""
+    max_length = get_config_value('limits', 'max_content_length', DEFAULT_MAX_CONTENT_LENGTH)
+    return min(max_length, field_limits['image_data'] // 4 * 3)
+
+def read_binary_upload(max_bytes):
+    """按块读取二进制请求体（可以是分块传输），超过max_bytes立即中止，返回(base64字符串, 错误响应)
+
+    接收过程中数据先写进临时文件（小于stream_threshold时留在内存），慢速上传不会长时间占用大块内存。
+    """
+    stream_threshold = get_config_value('limits', 'stream_threshold', 1024 * 1024)
+    if not large_upload_slots.acquire(timeout=10):
+        response = jsonify({'error': 'Too many large uploads in progress'})
+        response.headers['Retry-After'] = '5'
+        return None, (response, 503)
+    try:
+        with tempfile.SpooledTemporaryFile(max_size=stream_threshold) as buffer:
+            size = 0
+            while True:
+                chunk = request.stream.read(UPLOAD_READ_SIZE)
+                if not chunk:
+                    break
+                size += len(chunk)
+                if size > max_bytes:
+                    logging.warning(f"Rejected oversized upload: more than {max_bytes} bytes")
+                    return None, (jsonify({'error': f'Upload exceeds {max_bytes} bytes'}), 413)
+                buffer.write(chunk)
+            buffer.seek(0)
+            return base64.b64encode(buffer.read()).decode('ascii'), None
+    finally:
+        large_upload_slots.release()
+
+@app.route('/api/messages/upload', methods=['POST'])
+def upload_message():
+    """二进制上传：请求体是图片文件本身（application/octet-stream，可以分块传输），
+    其他字段（title、content、priority、channel、client_msg_id）放在查询参数里，
+    省去发送端base64编码和JSON拼接的内存开销。
+    """
+    try:
+        field_limits = get_field_limits()
+        data, error_response = check_field_limits(request.args.to_dict(), field_limits)
+        if error_response:
+            return error_response
+
+        image_data, error_response = read_binary_upload(get_max_upload_bytes(field_limits))
+        if error_response:
+            return error_response
+
+        data['image_data'] = image_data
+        data.setdefault('type', 'mixed' if image_data else 'text')
+        return save_message(data)
+
+    except Exception as e:
+        logging.error(f"Error receiving upload: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
+upload_store = None
+
+def setup_upload_sessions():
+    """创建断点续传的会话存储，目录默认是服务端目录下的uploads"""
+    global upload_store
+    directory = get_config_value('uploads', 'directory', 'uploads')
+    if not os.path.isabs(directory):
+        directory = os.path.join(os.path.dirname(os.path.abspath(__file__)), directory)
+    upload_store = uploads.UploadStore(directory, get_max_upload_bytes(get_field_limits()),
+                                       get_config_value('uploads', 'session_ttl', 86400))
+    logging.info(f"Upload sessions stored in {directory}")
+
+def expire_upload_sessions():
+    if upload_store:
+        upload_store.expire()
+
+def upload_offset_response(upload_id, offset, status=200):
+    response = jsonify({'upload_id': upload_id, 'offset': offset})
+    response.headers['Upload-Offset'] = str(offset)
+    return response, status
+
+@app.route('/api/uploads', methods=['POST'])
+def create_upload():
+    """创建断点续传会话，请求体是消息字段（JSON，不含image_data），可以带总大小size"""
+    try:
+        data = request.get_json(silent=True)
+        if not isinstance(data, dict):
+            return jsonify({'error': 'Invalid JSON body'}), 400
+        data, error_response = check_field_limits(data, get_field_limits())
+        if error_response:
+            return error_response
+        size = data.pop('size', None)
+        if size is not None and (not isinstance(size, int) or size < 0):
+            return jsonify({'error': 'Invalid upload size'}), 400
+        data.pop('image_data', None)
+        # 幂等键在创建时记下，提交时用它去重
+        if request.headers.get('Idempotency-Key'):
+            data.setdefault('client_msg_id', request.headers['Idempotency-Key'])
+        upload_id = upload_store.create(data, size)
+        logging.info(f"Upload session created: {upload_id}, size: {size}")
+        return upload_offset_response(upload_id, 0, 201)
+    except uploads.UploadTooLarge as e:
+        return jsonify({'error': str(e)}), 413
+    except Exception as e:
+        logging.error(f"Error creating upload: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/uploads/<upload_id>', methods=['GET'])
+def get_upload(upload_id):
+    """查询已收到的字节数"""
+    try:
+        return upload_offset_response(upload_id, upload_store.info(upload_id)['offset'])
+    except uploads.UploadNotFound:
+        return jsonify({'error': 'Upload not found'}), 404
+
+@app.route('/api/uploads/<upload_id>', methods=['PUT'])
+def put_upload_chunk(upload_id):
+    """上传一块数据：偏移量放在查询参数offset或请求头Upload-Offset里，必须等于已收到的字节数"""
+    try:
+        offset = request.args.get('offset', request.headers.get('Upload-Offset'))
+        if offset is None or not offset.isdigit():
+            return jsonify({'error': 'Upload offset is required'}), 400
+        new_offset = upload_store.write(upload_id, int(offset), request.stream, UPLOAD_READ_SIZE)
+        return upload_offset_response(upload_id, new_offset)
+    except uploads.UploadNotFound:
+        return jsonify({'error': 'Upload not found'}), 404
+    except uploads.OffsetMismatch as e:
+        return upload_offset_response(upload_id, e.offset, 409)
+    except uploads.UploadTooLarge as e:
+        return jsonify({'error': str(e)}), 413
+    except Exception as e:
+        logging.error(f"Error receiving upload chunk: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/uploads/<upload_id>/commit', methods=['POST'])
+def commit_upload(upload_id):
+    """上传完成，生成消息；入库成功后删除会话"""
+    try:
+        metadata, image = upload_store.read(upload_id)
+        data = dict(metadata)
+        data['image_data'] = base64.b64encode(image).decode('ascii')
+        data.setdefault('type', 'mixed' if image else 'text')
+        response, status = save_message(data)
+        if status in (200, 202):
+            upload_store.delete(upload_id)
+        return response, status
+    except uploads.UploadNotFound:
+        return jsonify({'error': 'Upload not found'}), 404
+    except uploads.OffsetMismatch as e:
+        return upload_offset_response(upload_id, e.offset, 409)
+    except Exception as e:
+        logging.error(f"Error committing upload: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/uploads/<upload_id>', methods=['DELETE'])
+def delete_upload(upload_id):
+    """放弃上传"""
+    try:
+        upload_store.info(upload_id)
+    except uploads.UploadNotFound:
+        return jsonify({'error': 'Upload not found'}), 404
+    upload_store.delete(upload_id)
+    return jsonify({'success': True})
+
+class ResponseCache:
+    """消息列表响应缓存
+    
+    按查询条件缓存序列化好的JSON（以及gzip压缩后的）响应体，缓存项记录生成时的
+    notifier.state()，有写入后自然失效。多个相同的请求同时到达时只有一个去查库生成，
+    其余的等它生成完直接复用结果。
+    """
+    
+    def __init__(self, settings):
+        self.enabled = settings.get('enabled', True)
+        self.max_entries = settings.get('max_entries', 32)
+        self.max_bytes = settings.get('max_bytes', 64 * 1024 * 1024)
+        self.compress = settings.get('compress', True)
+        self.compress_level = settings.get('compress_level', 6)
+        self.min_compress_size = settings.get('min_compress_size', 1024)
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()  # 查询条件 -> (状态, 响应体, 压缩后的响应体)
+        self.building = {}  # (查询条件, 状态) -> {'done': 生成完成的Event, 'result': 生成的结果}
+        self.stats = {'hits': 0, 'misses': 0, 'coalesced': 0, 'uncacheable': 0}
+    
+    def get(self, key, state, build):
+        """返回(响应体, 压缩后的响应体或None)，缓存没有时调用build()生成响应体
+        
+        同时到达的相同请求直接拿生成者的结果，结果太大没有缓存时也一样，不会一个接一个地重新生成。
+        """
+        while True:
+            with self.lock:
+                entry = self.entries.get(key)
+                if entry and entry[0] == state:
+                    self.entries.move_to_end(key)
+                    self.stats['hits'] += 1
+                    return entry[1], entry[2]
+                pending = self.building.get((key, state))
+                if pending is None:
+                    pending = self.building[(key, state)] = {'done': threading.Event(), 'result': None}
+                    self.stats['misses'] += 1
+                    break
+                self.stats['coalesced'] += 1
+            # 已有相同的请求在生成，等它完成后直接用它的结果（生成失败时重新来过）
+            pending['done'].wait()
+            if pending['result'] is not None:
+                return pending['result']
+        
+        try:
+            body = build()
+            compressed = None
+            if self.compress and len(body) >= self.min_compress_size:
+                compressed = gzip.compress(body, self.compress_level)
+            pending['result'] = (body, compressed)
+            with self.lock:
+                if len(body) + len(compressed or b'') <= self.max_bytes:
+                    self.entries[key] = (state, body, compressed)
+                    self.entries.move_to_end(key)
+                    self._evict()
+                else:
+                    self.stats['uncacheable'] += 1
+            return body, compressed
+        finally:
+            with self.lock:
+                self.building.pop((key, state), None)
+            pending['done'].set()
+    
+    def _evict(self):
+        """超过条数或总大小时淘汰最久没用的缓存项"""
+        total = sum(len(body) + len(compressed or b'') for _, body, compressed in self.entries.values())
+        while self.entries and (len(self.entries) > self.max_entries or total > self.max_bytes):
+            _, (_, body, compressed) = self.entries.popitem(last=False)
+            total -= len(body) + len(compressed or b'')
+    
+    def snapshot(self):
+        with self.lock:
+            return {
+                'enabled': True,
+                'entries': len(self.entries),
+                'bytes': sum(len(body) + len(compressed or b'') for _, body, compressed in self.entries.values()),
+                **self.stats
+            }
+
+response_cache = None
+
+def setup_response_cache(workers=1):
+    """根据配置创建消息列表响应缓存；多进程模式下每个工作进程各缓存一份，max_bytes按进程数均分"""
+    global response_cache
+    settings = CONFIG.get('response_cache', {})
+    if not settings.get('enabled', True):
+        logging.info("Response cache disabled")
+        return
+    response_cache = ResponseCache(settings)
+    response_cache.max_bytes //= workers
+    logging.info(f"Response cache enabled: max {response_cache.max_entries} entries, "
+                 f"compress={response_cache.compress}")
+
+class PollAdvisor:
+    """根据正在轮询的客户端数给出建议的轮询间隔（响应头X-Poll-Interval）
+    
+    window秒内轮询过消息列表的客户端有N个，要让总的轮询速率不超过max_polls_per_second，
+    每个客户端的间隔至少是N/max_polls_per_second秒；客户端少时就是默认的interval，最长max_interval。
+    一屋子客户端同时在线时服务器靠它自动让大家放慢，不需要改客户端配置。
+    """
+    
+    def __init__(self, interval=2, max_interval=60, max_polls_per_second=20, window=30):
+        self.interval = interval
+        self.max_interval = max_interval
+        self.max_polls_per_second = max_polls_per_second
+        self.window = window
+        self.lock = threading.Lock()
+        self.clients = {}  # 客户端 -> 最近一次轮询的时间
+        self.stats = {'polls': 0}
+    
+    def record(self, key):
+        """记下一次轮询，返回建议的间隔秒数"""
+        now = time.monotonic()
+        with self.lock:
+            self.clients[key] = now
+            self.stats['polls'] += 1
+            if len(self.clients) > 1 and now - min(self.clients.values()) > self.window:
+                self.clients = {client: seen for client, seen in self.clients.items() if now - seen <= self.window}
+            return self._advised(len(self.clients))
+    
+    def _advised(self, clients):
+        advised = max(self.interval, clients / self.max_polls_per_second) if self.max_polls_per_second > 0 else self.interval
+        return round(min(self.max_interval, advised), 1)
+    
+    def snapshot(self):
+        with self.lock:
+            return {
+                'enabled': True,
+                'active_clients': len(self.clients),
+                'advised_interval': self._advised(len(self.clients)),
+                'max_polls_per_second': self.max_polls_per_second,
+                **self.stats
+            }
+
+poll_advisor = None
+
+def setup_poll_advisor(workers=1):
+    """根据配置创建轮询间隔建议；多进程模式下每个工作进程只看到一部分轮询，max_polls_per_second按进程数均分"""
+    global poll_advisor
+    settings = CONFIG.get('polling', {})
+    if not settings.get('enabled', True):
+        logging.info("Poll interval advice disabled")
+        return
+    poll_advisor = PollAdvisor(
+        interval=settings.get('interval', 2),
+        max_interval=settings.get('max_interval', 60),
+        max_polls_per_second=settings.get('max_polls_per_second', 20) / workers,
+        window=settings.get('window', 30)
+    )
+    logging.info(f"Poll interval advice enabled: {poll_advisor.interval}s, "
+                 f"at most {poll_advisor.max_polls_per_second} polls/s")
+
+def build_messages_body(priorities, since, version, use_msgpack=False, fields=None):
+    """查库并序列化消息列表响应体（JSON或MessagePack），fields给出时只查这些列"""
+    # 分区归并需要timestamp列
+    columns = ', '.join(dict.fromkeys((fields or ()) + ('timestamp',))) if fields else '*'
+    conn = get_db_connection()
+    try:
+        if priorities:
+            where = f"priority IN ({','.join('?' * len(priorities))})"
+            rows = storage.select_messages(conn, where, priorities, since=since, columns=columns)
+        else:
+            rows = storage.select_messages(conn, since=since, columns=columns)
+        
+        # 转换为字典列表
+        messages = [row_to_message(row, fields) for row in rows]
+    finally:
+        conn.close()
+    
+    payload = {
+        'messages': messages,
+        'total': len(messages),
+        'version': version
+    }
+    return codec.msgpack_dumps(payload) if use_msgpack else codec.json_dumps(payload)
+
+def build_messages_by_ids_body(ids, version, use_msgpack=False, fields=None):
+    """按ID列表查询消息，按请求的顺序返回，找不到的ID放在missing里"""
+    conn = get_db_connection()
+    try:
+        rows = storage.find_messages(conn, ids, ', '.join(fields) if fields else '*')
+        found = {row['id']: row for row in rows}
+    finally:
+        conn.close()
+    
+    payload = {
+        'messages': [row_to_message(found[message_id], fields) for message_id in ids if message_id in found],
+        'missing': [message_id for message_id in ids if message_id not in found],
+        'version': version
+    }
+    payload['total'] = len(payload['messages'])
+    return codec.msgpack_dumps(payload) if use_msgpack else codec.json_dumps(payload)
+
 @app.route('/api/messages', methods=['GET'])
 def get_messages():
+    """获取消息列表
+    
+    查询参数:
+        priority: 只返回指定优先级的消息，逗号分隔，如 high,critical
+        since: ISO格式时间，只返回这之后的消息（只扫描相关的时间分区）
+        wait: 长轮询等待秒数，配合version使用，最多60秒
+        version: 客户端上次拿到的版本号，版本号没变时等待新消息
+        ids: 按ID批量获取消息，逗号分隔，如 1,2,3（按请求的顺序返回，找不到的ID在missing里；忽略其他筛选条件）
+        fields: 只返回这些字段，逗号分隔，如 id,title,timestamp（id总会返回），例如列表不带image_data、再按ids取图片
+    """
     try:
-        # 从数据库获取所有消息，按时间倒序
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        cursor.execute('SELECT * FROM messages ORDER BY timestamp DESC')
-        rows = cursor.fetchall()
-        conn.close()
+        fields = None
+        if request.args.get('fields'):
+            fields = parse_fields(request.args['fields'])
+            if fields is None:
+                return jsonify({'error': 'Invalid fields'}), 400
         
-        # 转换为字典列表
-        messages = []
-        for row in rows:
-            messages.append({
-                'id': row['id'],
-                'type': row['type'],
-                'timestamp': row['timestamp'],
-                'content': row['content'],
-                'image_data': row['image_data'],
-                'title': row['title']
-            })
+        if request.args.get('ids') is not None:
+            ids = parse_id_list(request.args['ids'])
+            if ids is None:
+                return jsonify({'error': 'Invalid ids'}), 400
+            max_ids = get_config_value('limits', 'max_ids_per_request', 500)
+            if len(ids) > max_ids:
+                return jsonify({'error': f'Too many ids, at most {max_ids}'}), 400
+            use_msgpack = wants_msgpack()
+            body = build_messages_by_ids_body(ids, notifier.version, use_msgpack, fields)
+            response = Response(body, mimetype=codec.MSGPACK_MIMETYPE if use_msgpack else codec.JSON_MIMETYPE)
+            response.vary.add('Accept')
+            return response
         
-        return jsonify({
-            'messages': messages,
-            'total': len(messages)
-        }), 200
+        priorities = None
+        if request.args.get('priority'):
+            priorities = parse_priority_filter(request.args['priority'])
+            if priorities is None:
+                return jsonify({'error': 'Invalid priority filter'}), 400
+        
+        since = request.args.get('since')
+        if since:
+            try:
+                since = datetime.fromisoformat(since).isoformat()
+            except ValueError:
+                return jsonify({'error': 'Invalid since timestamp'}), 400
+        
+        # 长轮询：版本号没有变化时等待新消息或超时
+        wait = request.args.get('wait', 0, type=float)
+        since_version = request.args.get('version', type=int)
+        if wait > 0 and since_version == notifier.version:
+            notifier.wait_for_change(since_version, min(wait, 60))
+        
+        # 先取状态再查库：查询期间有写入时，结果按旧状态缓存，下一个请求会重新生成
+        state = notifier.state()
+        version = state[1]
+        use_msgpack = wants_msgpack()
+        build = lambda: build_messages_body(priorities, since, version, use_msgpack, fields)
+        if response_cache:
+            body, compressed = response_cache.get((tuple(priorities or ()), since, use_msgpack, fields), state, build)
+        else:
+            body, compressed = build(), None
+        
+        response = Response(body, mimetype=codec.MSGPACK_MIMETYPE if use_msgpack else codec.JSON_MIMETYPE)
+        response.vary.add('Accept')
+        response.vary.add('Accept-Encoding')
+        if poll_advisor:
+            response.headers['X-Poll-Interval'] = str(poll_advisor.record(request.remote_addr))
+        if compressed and 'gzip' in request.headers.get('Accept-Encoding', ''):
+            response.set_data(compressed)
+            response.headers['Content-Encoding'] = 'gzip'
+        return response
         
     except Exception as e:
         logging.error(f"Error getting messages: {str(e)}")
@@ -164,24 +1399,31 @@ def get_messages():
 def get_message(message_id):
     try:
         conn = get_db_connection()
-        cursor = conn.cursor()
-        cursor.execute('SELECT * FROM messages WHERE id = ?', (message_id,))
-        row = cursor.fetchone()
+        row = storage.find_message(conn, message_id)
         conn.close()
         
         if not row:
             return jsonify({'error': 'Message not found'}), 404
             
-        message = {
-            'id': row['id'],
-            'type': row['type'],
-            'timestamp': row['timestamp'],
-            'content': row['content'],
-            'image_data': row['image_data'],
-            'title': row['title']
-        }
+        return make_data_response(row_to_message(row))
+        
+    except Exception as e:
+        logging.error(f"Error getting message {message_id}: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/messages/<int:message_id>/original', methods=['GET'])
+def get_original_image(message_id):
+    """获取入库转码前保留的原图（image_policy.keep_original开启时才有）"""
+    try:
+        conn = get_db_connection()
+        row = storage.find_message(conn, message_id, 'original_image_data')
+        conn.close()
+        
+        if not row or not row['original_image_data']:
+            return jsonify({'error': 'Original image not found'}), 404
         
-        return jsonify(message), 200
+        binary_data = base64.b64decode(row['original_image_data'])
+        return Response(binary_data, mimetype=f"image/{guess_image_extension(binary_data)}")
         
     except Exception as e:
         logging.error(f"Error getting message {message_id}: {str(e)}")
@@ -191,9 +1433,8 @@ def get_message(message_id):
 def delete_message(message_id):
     try:
         conn = get_db_connection()
-        cursor = conn.cursor()
-        cursor.execute('DELETE FROM messages WHERE id = ?', (message_id,))
-        affected_rows = cursor.rowcount
+        storage.begin_write(conn)
+        affected_rows = storage.delete_ids(conn, [message_id])
         conn.commit()
         conn.close()
         
@@ -201,46 +1442,331 @@ def delete_message(message_id):
             return jsonify({'error': 'Message not found'}), 404
             
         logging.info(f"Deleted message: {message_id}")
+        notifier.notify()
         return jsonify({'success': True}), 200
         
     except Exception as e:
         logging.error(f"Error deleting message {message_id}: {str(e)}")
         return jsonify({'error': str(e)}), 500
 
+# 按条件批量删除支持的条件
+DELETE_FILTER_KEYS = {'older_than', 'channel', 'type'}
+
+def build_delete_filter(criteria):
+    """根据批量删除条件生成(WHERE子句, 参数, 截止时间)，条件非法时抛出ValueError
+    
+    支持的条件（同时给出时取交集）:
+        older_than: ISO格式时间，删除早于该时间的消息
+        channel: 频道
+        type: 消息类型
+    截止时间单独返回，整个分区都早于它时可以直接删除分区。
+    有不认识的条件时拒绝（拼错的条件被忽略会删掉比预期多的消息）。
+    """
+    unknown = set(criteria) - DELETE_FILTER_KEYS
+    if unknown:
+        raise ValueError(f"Unknown delete filter: {', '.join(sorted(unknown))}")
+    clauses = []
+    params = []
+    before = None
+    if 'older_than' in criteria:
+        try:
+            before = datetime.fromisoformat(str(criteria['older_than'])).isoformat()
+        except ValueError:
+            raise ValueError('Invalid older_than timestamp')
+    if 'channel' in criteria:
+        clauses.append('channel = ?')
+        params.append(str(criteria['channel']))
+    if 'type' in criteria:
+        clauses.append('type = ?')
+        params.append(str(criteria['type']))
+    if not clauses and not before:
+        raise ValueError('No delete filter given')
+    return ' AND '.join(clauses), params, before
+
 @app.route('/api/messages', methods=['DELETE'])
 def delete_all_messages():
-    """删除所有消息"""
+    """删除消息
+    
+    不带请求体时删除所有消息；请求体为JSON时批量删除：
+        {"ids": [1, 2, 3]} 按ID列表删除
+        {"older_than": "...", "channel": "...", "type": "..."} 按条件删除
+    所有删除在一个事务中完成，返回实际删除的条数。
+    请求体是空对象、没有可用条件或无法解析时返回400，不会当成删除全部。
+    """
     try:
+        criteria = request.get_json(silent=True)
+        if criteria is None and request.get_data():
+            return jsonify({'error': 'Invalid delete request'}), 400
+        if criteria is not None and not isinstance(criteria, dict):
+            return jsonify({'error': 'Invalid delete request'}), 400
+        
         conn = get_db_connection()
-        cursor = conn.cursor()
+        try:
+            storage.begin_write(conn)
+            if criteria is None:
+                # 删除所有分区
+                count = drop_all_messages(conn)
+            elif 'ids' in criteria:
+                try:
+                    if not isinstance(criteria['ids'], list):
+                        raise TypeError
+                    ids = [int(i) for i in criteria['ids']]
+                except (TypeError, ValueError):
+                    return jsonify({'error': 'Invalid id list'}), 400
+                count = storage.delete_ids(conn, ids)
+            else:
+                try:
+                    where, params, before = build_delete_filter(criteria)
+                except ValueError as e:
+                    return jsonify({'error': str(e)}), 400
+                count = storage.delete_messages(conn, where, params, before)
+            conn.commit()
+        finally:
+            conn.close()
         
-        # 先获取要删除的消息数量
-        cursor.execute('SELECT COUNT(*) FROM messages')
-        count = cursor.fetchone()[0]
+        if criteria is not None:
+            logging.info(f"Bulk deleted messages: {count} messages removed")
+        else:
+            logging.info(f"Deleted all messages: {count} messages removed")
+        notifier.notify()
+        return jsonify({
+            'success': True,
+            'deleted_count': count
+        }), 200
         
-        # 删除所有消息
-        cursor.execute('DELETE FROM messages')
-        cursor.execute('DELETE FROM sqlite_sequence WHERE name=\'messages\'')
-        conn.commit()
+    except Exception as e:
+        logging.error(f"Error deleting messages: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
+# 导出/导入时每批处理的消息条数，图片较大，批次不宜过大
+ARCHIVE_BATCH_SIZE = 100
+
+def iter_message_rows():
+    """按分区、按ID顺序分批遍历所有消息
+    
+    每批用新的短查询读取，内存占用与消息总数无关，也不会长时间占着读锁挡住写入。
+    """
+    conn = get_db_connection()
+    try:
+        yield from storage.iter_messages_by_id(conn, ARCHIVE_BATCH_SIZE)
+    finally:
         conn.close()
+
+def guess_image_extension(binary_data):
+    """根据文件头判断图片格式，返回扩展名"""
+    if binary_data.startswith(b'\x89PNG'):
+        return 'png'
+    if binary_data.startswith(b'\xff\xd8'):
+        return 'jpg'
+    if binary_data.startswith(b'BM'):
+        return 'bmp'
+    if binary_data.startswith(b'GIF8'):
+        return 'gif'
+    if binary_data[:4] == b'RIFF' and binary_data[8:12] == b'WEBP':
+        return 'webp'
+    return 'bin'
+
+class TarStreamBuffer:
+    """tarfile流式写入的目标，写入的数据由生成器及时取走"""
+    
+    def __init__(self):
+        self.chunks = []
+    
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+    
+    def drain(self):
+        data = b''.join(self.chunks)
+        self.chunks = []
+        return data
+
+def add_tar_file(tar, name, data, mtime):
+    """向tar流中添加一个文件"""
+    info = tarfile.TarInfo(name)
+    info.size = len(data)
+    info.mtime = mtime
+    tar.addfile(info, io.BytesIO(data))
+
+def generate_ndjson_export():
+    """逐条生成NDJSON格式的消息"""
+    for row in iter_message_rows():
+        yield codec.json_dumps(row_to_message(row)) + b'\n'
+
+def generate_tar_export():
+    """逐条生成tar流：每条消息一个JSON文件，图片解码后单独存为文件
+    
+    图片文件写在对应的JSON之前，导入时读到JSON就能拿到它的图片。
+    """
+    buffer = TarStreamBuffer()
+    tar = tarfile.open(fileobj=buffer, mode='w|')
+    now = int(time.time())
+    for row in iter_message_rows():
+        message = row_to_message(row)
+        if message['image_data']:
+            binary_data = base64.b64decode(message['image_data'])
+            image_file = f"images/{message['id']}.{guess_image_extension(binary_data)}"
+            add_tar_file(tar, image_file, binary_data, now)
+            message['image_data'] = ''
+            message['image_file'] = image_file
+        add_tar_file(tar, f"messages/{message['id']}.json",
+                     codec.json_dumps(message), now)
+        yield buffer.drain()
+    tar.close()
+    yield buffer.drain()
+
+@app.route('/api/export', methods=['GET'])
+def export_messages():
+    """流式导出所有消息，用于归档
+    
+    查询参数:
+        format: ndjson（默认，每行一条消息，图片为base64）或 tar（图片单独存为文件）
+    """
+    export_format = request.args.get('format', 'ndjson')
+    filename = datetime.now().strftime('messages_%Y%m%d_%H%M%S')
+    if export_format == 'ndjson':
+        response = Response(generate_ndjson_export(), mimetype='application/x-ndjson')
+        filename += '.ndjson'
+    elif export_format == 'tar':
+        response = Response(generate_tar_export(), mimetype='application/x-tar')
+        filename += '.tar'
+    else:
+        return jsonify({'error': 'Invalid export format'}), 400
+    
+    response.headers['Content-Disposition'] = f'attachment; filename={filename}'
+    logging.info(f"Exporting messages as {export_format}")
+    return response
+
+def record_to_message(record):
+    """把导入的记录整理成消息字典，记录非法时抛出ValueError"""
+    if not isinstance(record, dict):
+        raise ValueError('Record is not an object')
+    if record.get('type') not in ['text', 'image', 'mixed']:
+        raise ValueError('Invalid message type')
+    priority = record.get('priority') or 'normal'
+    if priority not in PRIORITIES:
+        raise ValueError('Invalid message priority')
+    return {
+        'id': record.get('id'),
+        'type': record['type'],
+        'timestamp': datetime.fromisoformat(record.get('timestamp') or datetime.now().isoformat()).isoformat(),
+        'content': record.get('content') or '',
+        'image_data': record.get('image_data') or '',
+        'title': record.get('title') or '无标题',
+        'priority': priority,
+        'channel': record.get('channel') or ''
+    }
+
+def iter_ndjson_records(stream):
+    """逐行读取NDJSON，返回(行号, 记录)，解析失败的行记录为异常对象"""
+    for line_number, line in enumerate(stream, 1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            yield line_number, codec.json_loads(line)
+        except ValueError as e:
+            yield line_number, e
+
+def iter_tar_records(stream):
+    """流式读取导出的tar包，把图片文件还原为base64后附到对应的消息上"""
+    pending_images = {}
+    with tarfile.open(fileobj=stream, mode='r|') as tar:
+        for member in tar:
+            if not member.isfile():
+                continue
+            data = tar.extractfile(member).read()
+            if member.name.startswith('images/'):
+                pending_images[member.name] = data
+            elif member.name.endswith('.json'):
+                try:
+                    record = codec.json_loads(data)
+                except ValueError as e:
+                    yield member.name, e
+                    continue
+                image_file = record.pop('image_file', None) if isinstance(record, dict) else None
+                if image_file in pending_images:
+                    record['image_data'] = base64.b64encode(pending_images.pop(image_file)).decode('utf-8')
+                yield member.name, record
+
+def import_batch(cursor, batch, keep_ids):
+    """写入一批导入的消息（按原时间写入对应的分区），keep_ids时保留原ID（已存在的ID跳过），返回写入条数"""
+    conn = cursor.connection
+    mode = get_partition_mode()
+    written = 0
+    storage.begin_write(conn)
+    for message in batch:
+        if keep_ids and isinstance(message['id'], int) and message['id'] > 0:
+            written += storage.insert_message_if_absent(conn, message, mode)
+        else:
+            storage.insert_message(conn, dict(message, id=None), mode)
+            written += 1
+    return written
+
+@app.route('/api/import', methods=['POST'])
+def import_messages():
+    """从导出文件批量恢复消息，流式读取请求体，分批提交
+    
+    请求体为 /api/export 导出的NDJSON或tar（Content-Type: application/x-tar）。
+    查询参数:
+        keep_ids: 1（默认）保留原消息ID，ID已存在的消息跳过；0 重新分配ID
+    """
+    try:
+        keep_ids = request.args.get('keep_ids', '1') != '0'
+        if request.mimetype == 'application/x-tar':
+            records = iter_tar_records(request.stream)
+        else:
+            records = iter_ndjson_records(request.stream)
         
-        logging.info(f"Deleted all messages: {count} messages removed")
+        imported = 0
+        skipped = 0
+        errors = []
+        batch = []
+        conn = get_db_connection()
+        try:
+            cursor = conn.cursor()
+            for position, record in records:
+                try:
+                    if isinstance(record, Exception):
+                        raise ValueError(str(record))
+                    batch.append(record_to_message(record))
+                except ValueError as e:
+                    skipped += 1
+                    if len(errors) < 10:
+                        errors.append(f"{position}: {str(e)}")
+                    continue
+                if len(batch) >= ARCHIVE_BATCH_SIZE:
+                    written = import_batch(cursor, batch, keep_ids)
+                    conn.commit()
+                    imported += written
+                    skipped += len(batch) - written
+                    batch = []
+            if batch:
+                written = import_batch(cursor, batch, keep_ids)
+                conn.commit()
+                imported += written
+                skipped += len(batch) - written
+        finally:
+            conn.close()
+        
+        logging.info(f"Imported messages: {imported} imported, {skipped} skipped")
+        notifier.notify()
         return jsonify({
             'success': True,
-            'deleted_count': count
+            'imported': imported,
+            'skipped': skipped,
+            'errors': errors
         }), 200
         
     except Exception as e:
-        logging.error(f"Error deleting all messages: {str(e)}")
+        logging.error(f"Error importing messages: {str(e)}")
         return jsonify({'error': str(e)}), 500
 
 @app.route('/api/health', methods=['GET'])
 def health_check():
     try:
         conn = get_db_connection()
-        cursor = conn.cursor()
-        cursor.execute('SELECT COUNT(*) FROM messages')
-        count = cursor.fetchone()[0]
+        count = storage.count_messages(conn)
         conn.close()
         
         return jsonify({
@@ -253,22 +1779,110 @@ def health_check():
         logging.error(f"Error in health check: {str(e)}")
         return jsonify({'error': str(e)}), 500
 
+@app.route('/api/maintenance', methods=['GET'])
+def get_maintenance_status():
+    """数据库维护状态：最近一次各项维护的报告和下次计划运行的时间"""
+    return jsonify({
+        'reports': db_maintenance.snapshot() if db_maintenance else {},
+        'schedule': scheduler.snapshot() if scheduler else {}
+    }), 200
+
+@app.route('/api/maintenance/<task>', methods=['POST'])
+def run_maintenance(task):
+    """立即执行一项数据库维护（vacuum、optimize或checkpoint），返回回收的字节数和耗时"""
+    try:
+        if task not in ('vacuum', 'optimize', 'checkpoint'):
+            return jsonify({'error': 'Unknown maintenance task'}), 400
+        if not db_maintenance:
+            return jsonify({'error': 'Maintenance is not enabled'}), 503
+        report = getattr(db_maintenance, task)()
+        return jsonify({'success': True, 'report': report}), 200
+    except Exception as e:
+        logging.error(f"Error running maintenance {task}: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/metrics', methods=['GET'])
+def get_metrics():
+    """运行状态指标，用于调优限流等参数"""
+    return jsonify({
+        'timestamp': datetime.now().isoformat(),
+        'rate_limiter': rate_limiter.snapshot() if rate_limiter else {'enabled': False},
+        'image_policy': image_policy.snapshot() if image_policy else {'enabled': False},
+        'response_cache': response_cache.snapshot() if response_cache else {'enabled': False},
+        'polling': poll_advisor.snapshot() if poll_advisor else {'enabled': False}
+    }), 200
+
 if __name__ == '__main__':
     setup_logging()
     config = load_config()
+    CONFIG.update(config)
     
     # 初始化数据库
     init_database()
     
-    # 设置定时任务
-    setup_scheduler()
+    # 选择JSON库
+    setup_serialization()
+    
+    # 数据库维护（必要时切换为增量回收模式）
+    setup_maintenance()
     
-    logging.info("Starting message server...")
-    logging.info(f"Server will run on {config['server']['host']}:{config['server']['port']}")
+    host = config['server']['host']
+    port = config['server']['port']
+    workers = get_config_value('server', 'workers', 1)
+    if workers > 1 and not cluster.prefork_supported():
+        logging.warning("Multi-process mode is not supported on this platform, running a single process")
+        workers = 1
     
-    app.run(
-        host=config['server']['host'],
-        port=config['server']['port'],
-        debug=True,
-        threaded=True
-    )
\ No newline at end of file
+    if workers > 1:
+        # 多进程模式：定时任务只在0号工作进程运行，其余初始化在每个工作进程里各做一遍
+        run_dir = get_config_value('server', 'run_dir') or os.path.join(tempfile.gettempdir(), f"msg-server-{port}")
+        
+        def start_worker(index):
+            notifier.broadcaster = cluster.ChangeBroadcaster(run_dir, notifier.apply_remote)
+            if index == 0:
+                setup_scheduler()
+            setup_rate_limiter(workers)
+            setup_image_policy()
+            setup_upload_limits()
+            setup_upload_sessions()
+            setup_response_cache(workers)
+            setup_poll_advisor(workers)
+        
+        # 限流、响应缓存和轮询建议的状态是每个工作进程各自一份，配置的总量按进程数均分
+        logging.warning(f"Rate limit, response cache and poll advice state is kept per worker process: "
+                        f"rate_per_second, burst, response_cache.max_bytes and max_polls_per_second "
+                        f"are divided by {workers}; a single sender's limit is only approximate")
+        logging.info("Starting message server...")
+        logging.info(f"Server will run on {host}:{port} with {workers} worker processes")
+        cluster.run_prefork(app, host, port, workers, run_dir, start_worker)
+    else:
+        # 设置定时任务
+        setup_scheduler()
+        
+        # 设置发送限流
+        setup_rate_limiter()
+        
+        # 设置入库图片处理策略
+        setup_image_policy()
+        
+        # 设置请求体大小限制
+        setup_upload_limits()
+        
+        # 设置断点续传会话存储
+        setup_upload_sessions()
+        
+        # 设置消息列表响应缓存
+        setup_response_cache()
+        
+        # 设置建议的轮询间隔
+        setup_poll_advisor()
+        
+        logging.info("Starting message server...")
+        logging.info(f"Server will run on {host}:{port}")
+        
+        app.run(
+            host=host,
+            port=port,
+            debug=True,
+            threaded=True
+        )
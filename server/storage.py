@@ -0,0 +1,334 @@
+"""
+分区存储
+功能：按天或按周把消息存到不同的表（messages_d20250824 / messages_w20250818），
+partitions表记录每个分区覆盖的时间范围和ID范围。查询时跨分区合并结果，
+过期数据直接DROP整个分区表，不需要逐行DELETE。
+
+旧版本的单表messages会被登记为一个分区（覆盖升级前已有消息的时间范围），不需要搬数据。
+"""
+
+import heapq
+from datetime import datetime, timedelta
+
+# 旧版本的单表
+LEGACY_TABLE = 'messages'
+# 旧版单表分区的时间下限
+MIN_TIMESTAMP = '0000-01-01T00:00:00'
+
+PARTITION_SCHEMA = '''
+    id INTEGER PRIMARY KEY,
+    type TEXT NOT NULL,
+    timestamp TEXT NOT NULL,
+    content TEXT,
+    image_data TEXT,
+    title TEXT,
+    priority TEXT NOT NULL DEFAULT 'normal',
+    channel TEXT NOT NULL DEFAULT '',
+    original_image_data TEXT
+'''
+
+MESSAGE_COLUMNS = ['id', 'type', 'timestamp', 'content', 'image_data', 'title',
+                   'priority', 'channel', 'original_image_data']
+
+# 旧版单表升级时需要补上的列
+LEGACY_COLUMNS = [
+    ('priority', "TEXT NOT NULL DEFAULT 'normal'"),
+    ('channel', "TEXT NOT NULL DEFAULT ''"),
+    ('original_image_data', "TEXT")
+]
+
+# 按ID批量操作时每批的ID数量，避免超过SQLite的参数个数限制
+ID_CHUNK_SIZE = 500
+
+
+def init_storage(conn):
+    """创建分区目录表和ID序列表，旧版单表登记为分区"""
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS partitions (
+            name TEXT PRIMARY KEY,
+            period_start TEXT NOT NULL,
+            period_end TEXT NOT NULL,
+            min_id INTEGER,
+            max_id INTEGER
+        )
+    ''')
+    # 消息ID在所有分区间全局递增，由这个表分配
+    conn.execute('CREATE TABLE IF NOT EXISTS message_seq (id INTEGER PRIMARY KEY AUTOINCREMENT)')
+
+    legacy = conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (LEGACY_TABLE,)).fetchone()
+    registered = conn.execute('SELECT 1 FROM partitions WHERE name = ?', (LEGACY_TABLE,)).fetchone()
+    if legacy and not registered:
+        migrate_legacy_table(conn)
+        return True
+    return False
+
+
+def migrate_legacy_table(conn):
+    """把旧版的单表messages登记为一个分区"""
+    columns = [row[1] for row in conn.execute(f'PRAGMA table_info({LEGACY_TABLE})')]
+    for column, definition in LEGACY_COLUMNS:
+        if column not in columns:
+            conn.execute(f"ALTER TABLE {LEGACY_TABLE} ADD COLUMN {column} {definition}")
+    create_partition_indexes(conn, LEGACY_TABLE)
+
+    min_id, max_id, last_timestamp = conn.execute(
+        f'SELECT MIN(id), MAX(id), MAX(timestamp) FROM {LEGACY_TABLE}').fetchone()
+    # 分区只覆盖到旧表里最后一条消息，之后的消息（包括导入的）进入新分区，
+    # 这样旧表也能按保留期整体删除
+    try:
+        period_end = (datetime.fromisoformat(last_timestamp) + timedelta(microseconds=1)).isoformat()
+    except (TypeError, ValueError):
+        period_end = datetime.now().isoformat()
+    conn.execute('INSERT INTO partitions (name, period_start, period_end, min_id, max_id) VALUES (?, ?, ?, ?, ?)',
+                 (LEGACY_TABLE, MIN_TIMESTAMP, period_end, min_id, max_id))
+
+    # 新ID从旧表用过的最大ID之后开始
+    row = conn.execute("SELECT seq FROM sqlite_sequence WHERE name = ?", (LEGACY_TABLE,)).fetchone()
+    reserve_ids(conn, max(row[0] if row else 0, max_id or 0))
+
+
+def create_partition_indexes(conn, name):
+    conn.execute(f'CREATE INDEX IF NOT EXISTS idx_{name}_timestamp ON {name}(timestamp)')
+    conn.execute(f'CREATE INDEX IF NOT EXISTS idx_{name}_priority ON {name}(priority, timestamp)')
+    conn.execute(f'CREATE INDEX IF NOT EXISTS idx_{name}_channel ON {name}(channel, timestamp)')
+
+
+def partition_period(timestamp, mode):
+    """计算时间戳所属分区，返回(表名, 开始时间, 结束时间)
+
+    参数:
+        timestamp (str): ISO格式时间
+        mode (str): 'day' 按天分区，'week' 按周分区（周一开始）
+    """
+    dt = datetime.fromisoformat(timestamp).replace(tzinfo=None)
+    day = dt.replace(hour=0, minute=0, second=0, microsecond=0)
+    if mode == 'week':
+        start = day - timedelta(days=day.weekday())
+        end = start + timedelta(days=7)
+        name = f"messages_w{start:%Y%m%d}"
+    else:
+        start = day
+        end = start + timedelta(days=1)
+        name = f"messages_d{start:%Y%m%d}"
+    return name, start.isoformat(), end.isoformat()
+
+
+def get_partition(conn, timestamp, mode):
+    """获取时间戳所属的分区表名，分区不存在时创建"""
+    row = conn.execute('''
+        SELECT name FROM partitions WHERE period_start <= ? AND period_end > ?
+        ORDER BY period_start DESC LIMIT 1
+    ''', (timestamp, timestamp)).fetchone()
+    if row:
+        return row[0]
+
+    name, start, end = partition_period(timestamp, mode)
+    conn.execute(f'CREATE TABLE IF NOT EXISTS {name} ({PARTITION_SCHEMA})')
+    create_partition_indexes(conn, name)
+    conn.execute('INSERT OR IGNORE INTO partitions (name, period_start, period_end) VALUES (?, ?, ?)',
+                 (name, start, end))
+    return name
+
+
+def begin_write(conn):
+    """开始写事务并立即获取写锁
+
+    多个工作进程共享数据库时，先读后写的普通事务在升级写锁时可能直接失败（不会等待），
+    所有写操作都先用BEGIN IMMEDIATE拿到写锁，排队等待由busy_timeout处理。
+    """
+    if not conn.in_transaction:
+        conn.execute('BEGIN IMMEDIATE')
+
+
+def allocate_id(conn):
+    """分配一个新的全局消息ID"""
+    message_id = conn.execute('INSERT INTO message_seq DEFAULT VALUES').lastrowid
+    conn.execute('DELETE FROM message_seq WHERE id = ?', (message_id,))
+    return message_id
+
+
+def reserve_ids(conn, max_id):
+    """保证之后分配的ID大于max_id（导入保留原ID时使用）"""
+    row = conn.execute("SELECT seq FROM sqlite_sequence WHERE name = 'message_seq'").fetchone()
+    if row is None:
+        conn.execute("INSERT INTO sqlite_sequence (name, seq) VALUES ('message_seq', ?)", (max_id,))
+    elif row[0] < max_id:
+        conn.execute("UPDATE sqlite_sequence SET seq = ? WHERE name = 'message_seq'", (max_id,))
+
+
+def insert_message(conn, message, mode):
+    """插入一条消息到所属分区，返回消息ID
+
+    message中带id时使用该ID（导入时），否则分配新ID。
+    """
+    message_id = message.get('id') or allocate_id(conn)
+    name = get_partition(conn, message['timestamp'], mode)
+    values = dict(message, id=message_id)
+    conn.execute(f'''
+        INSERT INTO {name} ({', '.join(MESSAGE_COLUMNS)})
+        VALUES ({', '.join('?' * len(MESSAGE_COLUMNS))})
+    ''', [values.get(column) for column in MESSAGE_COLUMNS])
+    conn.execute('''
+        UPDATE partitions SET min_id = MIN(COALESCE(min_id, ?), ?), max_id = MAX(COALESCE(max_id, ?), ?)
+        WHERE name = ?
+    ''', (message_id, message_id, message_id, message_id, name))
+    return message_id
+
+
+def insert_message_if_absent(conn, message, mode):
+    """带原ID插入消息，ID已存在时跳过，返回是否插入"""
+    if find_message(conn, message['id'], 'id'):
+        return False
+    insert_message(conn, message, mode)
+    reserve_ids(conn, message['id'])
+    return True
+
+
+def list_partitions(conn, since=None, oldest_first=False):
+    """返回分区列表[(表名, 开始时间, 结束时间)]，since给出时只返回可能包含该时间之后消息的分区"""
+    order = 'ASC' if oldest_first else 'DESC'
+    if since:
+        rows = conn.execute(f'SELECT name, period_start, period_end FROM partitions WHERE period_end > ? '
+                            f'ORDER BY period_start {order}', (since,))
+    else:
+        rows = conn.execute(f'SELECT name, period_start, period_end FROM partitions ORDER BY period_start {order}')
+    return [tuple(row) for row in rows]
+
+
+def partitions_for_ids(conn, low, high):
+    """返回ID范围与[low, high]有交集的分区表名"""
+    rows = conn.execute('SELECT name FROM partitions WHERE min_id <= ? AND max_id >= ?', (high, low))
+    return [row[0] for row in rows]
+
+
+def select_messages(conn, where=None, params=(), since=None, columns='*'):
+    """跨分区查询消息，按时间倒序逐行返回
+
+    参数:
+        where (str): 附加的WHERE条件（不含WHERE关键字）
+        params: where中的参数
+        since (str): 只查这个时间之后的消息，只会扫描相关的分区
+        columns (str): 查询的列，必须包含timestamp
+    """
+    clauses = []
+    query_params = list(params)
+    if where:
+        clauses.append(f'({where})')
+    if since:
+        clauses.append('timestamp >= ?')
+        query_params.append(since)
+    where_sql = f" WHERE {' AND '.join(clauses)}" if clauses else ''
+
+    cursors = [
+        conn.execute(f'SELECT {columns} FROM {name}{where_sql} ORDER BY timestamp DESC', query_params)
+        for name, _, _ in list_partitions(conn, since)
+    ]
+    if len(cursors) == 1:
+        return iter(cursors[0])
+    # 各分区已按时间倒序，归并即可，不需要把结果全部读出来排序
+    return heapq.merge(*cursors, key=lambda row: row['timestamp'], reverse=True)
+
+
+def find_message(conn, message_id, columns='*'):
+    """按ID查找消息，只查ID范围覆盖它的分区，不存在返回None"""
+    for name in partitions_for_ids(conn, message_id, message_id):
+        row = conn.execute(f'SELECT {columns} FROM {name} WHERE id = ?', (message_id,)).fetchone()
+        if row:
+            return row
+    return None
+
+
+def find_messages(conn, message_ids, columns='*'):
+    """按ID列表查找消息，分批IN查询，只查ID范围覆盖它们的分区；返回行的列表（顺序不定），columns必须包含id"""
+    ids = sorted(set(message_ids))
+    rows = []
+    for start in range(0, len(ids), ID_CHUNK_SIZE):
+        chunk = ids[start:start + ID_CHUNK_SIZE]
+        placeholders = ','.join('?' * len(chunk))
+        for name in partitions_for_ids(conn, chunk[0], chunk[-1]):
+            rows.extend(conn.execute(f'SELECT {columns} FROM {name} WHERE id IN ({placeholders})', chunk))
+    return rows
+
+
+def iter_messages_by_id(conn, batch_size):
+    """按分区、按ID分批遍历所有消息（导出用）
+
+    每批是一个新的短查询（id > 上一批最后的ID），不会长时间占着读锁。
+    """
+    for name, _, _ in list_partitions(conn, oldest_first=True):
+        last_id = 0
+        while True:
+            rows = conn.execute(f'SELECT * FROM {name} WHERE id > ? ORDER BY id LIMIT ?',
+                                (last_id, batch_size)).fetchall()
+            if not rows:
+                break
+            yield from rows
+            last_id = rows[-1]['id']
+
+
+def count_messages(conn):
+    """统计所有分区的消息总数"""
+    return sum(conn.execute(f'SELECT COUNT(*) FROM {name}').fetchone()[0] for name, _, _ in list_partitions(conn))
+
+
+def delete_ids(conn, message_ids):
+    """按ID列表删除消息，返回删除条数"""
+    ids = sorted(set(message_ids))
+    count = 0
+    for start in range(0, len(ids), ID_CHUNK_SIZE):
+        chunk = ids[start:start + ID_CHUNK_SIZE]
+        placeholders = ','.join('?' * len(chunk))
+        for name in partitions_for_ids(conn, chunk[0], chunk[-1]):
+            count += conn.execute(f'DELETE FROM {name} WHERE id IN ({placeholders})', chunk).rowcount
+    return count
+
+
+def delete_messages(conn, where=None, params=(), before=None):
+    """按条件删除消息，返回删除条数
+
+    参数:
+        where (str): 附加的WHERE条件
+        params: where中的参数
+        before (str): 只删这个时间之前的消息；整个分区都早于它且没有其他条件时直接DROP分区
+    """
+    count = 0
+    for name, start, end in list_partitions(conn):
+        if before and start >= before:
+            continue
+        if before and end <= before and not where:
+            count += drop_partition(conn, name)
+            continue
+        clauses = []
+        query_params = list(params)
+        if where:
+            clauses.append(f'({where})')
+        if before:
+            clauses.append('timestamp < ?')
+            query_params.append(before)
+        where_sql = f" WHERE {' AND '.join(clauses)}" if clauses else ''
+        count += conn.execute(f'DELETE FROM {name}{where_sql}', query_params).rowcount
+    return count
+
+
+def drop_partition(conn, name):
+    """删除整个分区表，返回其中的消息条数"""
+    count = conn.execute(f'SELECT COUNT(*) FROM {name}').fetchone()[0]
+    conn.execute(f'DROP TABLE IF EXISTS {name}')
+    conn.execute('DELETE FROM partitions WHERE name = ?', (name,))
+    return count
+
+
+def drop_partitions_before(conn, cutoff):
+    """删除结束时间不晚于cutoff的分区（保留期清理），返回[(表名, 消息条数)]"""
+    dropped = []
+    for name, _, end in list_partitions(conn, oldest_first=True):
+        if end <= cutoff:
+            dropped.append((name, drop_partition(conn, name)))
+    return dropped
+
+
+def drop_all(conn):
+    """删除所有分区并重置ID序列，返回删除的消息条数"""
+    count = sum(drop_partition(conn, name) for name, _, _ in list_partitions(conn))
+    conn.execute("DELETE FROM sqlite_sequence WHERE name IN ('message_seq', ?)", (LEGACY_TABLE,))
+    return count
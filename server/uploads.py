@@ -0,0 +1,148 @@
+"""
+断点续传上传会话
+功能：大图片分块上传。先创建会话（记录消息字段），再按偏移量逐块PUT，收到的数据直接追加到磁盘上的临时文件，
+连接中途断开时已收到的部分保留下来，客户端查询已收到的偏移量后从断点继续；全部上传完后提交，生成消息。
+超过session_ttl没有提交的会话由定时任务清理。
+"""
+
+import json
+import logging
+import os
+import re
+import threading
+import time
+import uuid
+
+_UPLOAD_ID = re.compile(r'^[0-9a-f]{32}$')
+
+
+class UploadNotFound(KeyError):
+    """上传会话不存在（已提交、已过期或ID无效）"""
+
+
+class OffsetMismatch(ValueError):
+    """PUT的偏移量和已收到的字节数不一致"""
+
+    def __init__(self, offset):
+        super().__init__(f"Upload offset is {offset}")
+        self.offset = offset
+
+
+class UploadTooLarge(ValueError):
+    """上传的数据超过大小限制"""
+
+    def __init__(self, limit):
+        super().__init__(f"Upload exceeds {limit} bytes")
+        self.limit = limit
+
+
+class UploadStore:
+    """上传会话存储：每个会话是目录下的 <id>.json（消息字段）和 <id>.part（已收到的数据）
+
+    同一个会话的写入在进程内串行；多进程模式下各进程共用目录，靠偏移量检查避免错位
+    （同一个客户端本来就是按顺序一块一块上传的）。
+
+    参数:
+        directory: 存放会话文件的目录
+        max_bytes: 单个上传的大小上限
+        session_ttl: 会话最长保留时间（秒）
+    """
+
+    def __init__(self, directory, max_bytes, session_ttl=86400):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.session_ttl = session_ttl
+        self.lock = threading.Lock()
+        self.session_locks = {}
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, upload_id, suffix):
+        if not _UPLOAD_ID.match(upload_id or ''):
+            raise UploadNotFound(upload_id)
+        return os.path.join(self.directory, upload_id + suffix)
+
+    def _session_lock(self, upload_id):
+        with self.lock:
+            return self.session_locks.setdefault(upload_id, threading.Lock())
+
+    def create(self, metadata, size=None):
+        """创建会话，metadata是消息字段，size是客户端声明的总字节数（可选），返回会话ID"""
+        if size is not None and size > self.max_bytes:
+            raise UploadTooLarge(self.max_bytes)
+        upload_id = uuid.uuid4().hex
+        open(self._path(upload_id, '.part'), 'wb').close()
+        with open(self._path(upload_id, '.json'), 'w', encoding='utf-8') as f:
+            json.dump({'metadata': metadata, 'size': size, 'created_at': time.time()}, f, ensure_ascii=False)
+        return upload_id
+
+    def info(self, upload_id):
+        """返回会话信息：已收到的字节数offset、声明的总大小size、消息字段metadata"""
+        try:
+            with open(self._path(upload_id, '.json'), 'r', encoding='utf-8') as f:
+                session = json.load(f)
+            session['offset'] = os.path.getsize(self._path(upload_id, '.part'))
+        except (OSError, ValueError):
+            raise UploadNotFound(upload_id)
+        return session
+
+    def write(self, upload_id, offset, stream, read_size=64 * 1024):
+        """从offset处追加stream里的数据，返回新的偏移量
+
+        偏移量和已收到的字节数不一致时抛出OffsetMismatch；超过大小上限时丢弃这次写入的数据并抛出UploadTooLarge。
+        客户端中途断开时保留已收到的部分，客户端查询偏移量后续传。
+        """
+        session = self.info(upload_id)
+        limit = min(self.max_bytes, session['size']) if session['size'] is not None else self.max_bytes
+        with self._session_lock(upload_id):
+            with open(self._path(upload_id, '.part'), 'ab') as f:
+                current = f.tell()
+                if offset != current:
+                    raise OffsetMismatch(current)
+                while True:
+                    try:
+                        chunk = stream.read(read_size)
+                    except Exception as e:
+                        logging.warning(f"Upload {upload_id} interrupted at {f.tell()} bytes: {str(e)}")
+                        break
+                    if not chunk:
+                        break
+                    if f.tell() + len(chunk) > limit:
+                        f.truncate(offset)
+                        raise UploadTooLarge(limit)
+                    f.write(chunk)
+                return f.tell()
+
+    def read(self, upload_id):
+        """读取全部数据，声明了总大小而数据不完整时抛出OffsetMismatch"""
+        session = self.info(upload_id)
+        if session['size'] is not None and session['offset'] != session['size']:
+            raise OffsetMismatch(session['offset'])
+        with open(self._path(upload_id, '.part'), 'rb') as f:
+            return session['metadata'], f.read()
+
+    def delete(self, upload_id):
+        for suffix in ('.part', '.json'):
+            try:
+                os.remove(self._path(upload_id, suffix))
+            except OSError:
+                pass
+        with self.lock:
+            self.session_locks.pop(upload_id, None)
+
+    def expire(self):
+        """删除超过session_ttl的会话，返回删除的数量"""
+        deadline = time.time() - self.session_ttl
+        removed = 0
+        for name in os.listdir(self.directory):
+            upload_id, suffix = os.path.splitext(name)
+            if suffix != '.json' or not _UPLOAD_ID.match(upload_id):
+                continue
+            try:
+                if os.path.getmtime(os.path.join(self.directory, name)) < deadline:
+                    self.delete(upload_id)
+                    removed += 1
+            except OSError:
+                pass
+        if removed:
+            logging.info(f"Expired {removed} unfinished upload sessions")
+        return removed
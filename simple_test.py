@@ -51,7 +51,8 @@ def send_mixed_message(image_path, text_content, title="图文消息", server_ur
         
         # 向服务器发送POST请求，提交消息数据
         # 使用json参数自动将Python字典转换为JSON格式
-        response = requests.post(f"{server_url}/api/messages", json=message_data)
+        # timeout：连接5秒、等待响应30秒，服务器没响应时不会一直卡住脚本
+        response = requests.post(f"{server_url}/api/messages", json=message_data, timeout=(5, 30))
         
         # 打印服务器响应的HTTP状态码
         # 200表示成功，其他状态码表示各种错误
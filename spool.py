@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+离线消息暂存（spool）
+功能：服务器连不上时，把没发出去的消息存到本地SQLite文件里，图片复制一份到暂存目录
+（脚本接着截图覆盖原文件也不影响），等服务器恢复后由发送器按先后顺序补发。
+暂存有总大小和条数上限，超过时先淘汰最早的消息。
+
+同一个暂存文件可以被多个脚本进程共用（SQLite自带文件锁），万一同一条消息被补发两次，
+服务端会按client_msg_id去重。
+"""
+
+import json
+import logging
+import os
+import shutil
+import sqlite3
+import threading
+import time
+
+logger = logging.getLogger('sender')
+
+
+class MessageSpool:
+    """离线消息暂存
+
+    参数:
+        path (str): SQLite文件路径，图片复制到同目录下的 images 文件夹
+        max_bytes (int): 暂存的总大小上限（消息内容加图片，字节）
+        max_messages (int): 暂存的消息条数上限
+    """
+
+    def __init__(self, path, max_bytes=200 * 1024 * 1024, max_messages=10000):
+        self.path = os.path.abspath(path)
+        self.image_dir = os.path.join(os.path.dirname(self.path), 'images')
+        self.max_bytes = max_bytes
+        self.max_messages = max_messages
+        os.makedirs(self.image_dir, exist_ok=True)
+
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(self.path, timeout=10, check_same_thread=False, isolation_level=None)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        self.conn.execute('''
+            CREATE TABLE IF NOT EXISTS spool (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                client_msg_id TEXT UNIQUE,
+                message TEXT NOT NULL,
+                image_file TEXT,
+                size INTEGER NOT NULL,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                created_at REAL NOT NULL
+            )
+        ''')
+
+    def put(self, message):
+        """暂存一条消息（sender里的消息字典），返回因超出上限被淘汰的条数"""
+        image_file = None
+        size = 0
+        if message.get('image_path'):
+            extension = os.path.splitext(message['image_path'])[1]
+            image_file = os.path.join(self.image_dir, f"{message['client_msg_id']}{extension}")
+            try:
+                shutil.copyfile(message['image_path'], image_file)
+                size += os.path.getsize(image_file)
+            except OSError as e:
+                logger.error(f"Cannot spool image {message['image_path']}: {str(e)}")
+                image_file = None
+        record = dict(message, image_path=image_file,
+                      image_name=message.get('image_name') or
+                      (os.path.basename(message['image_path']) if message.get('image_path') else None))
+        text = json.dumps(record, ensure_ascii=False)
+        size += len(text.encode('utf-8'))
+
+        with self.lock:
+            self.conn.execute('BEGIN IMMEDIATE')
+            try:
+                self.conn.execute(
+                    'INSERT OR REPLACE INTO spool (client_msg_id, message, image_file, size, created_at) '
+                    'VALUES (?, ?, ?, ?, ?)',
+                    (message['client_msg_id'], text, image_file, size, time.time()))
+                evicted = self._evict()
+                self.conn.execute('COMMIT')
+            except Exception:
+                self.conn.execute('ROLLBACK')
+                raise
+        self._remove_files(evicted)
+        if evicted:
+            logger.warning(f"Spool full, evicted {len(evicted)} oldest messages")
+        return len(evicted)
+
+    def _evict(self):
+        """超出上限时删除最早的消息，返回要删除的图片文件（在持有锁和事务中调用）"""
+        count, total = self.conn.execute('SELECT COUNT(*), COALESCE(SUM(size), 0) FROM spool').fetchone()
+        evicted = []
+        cursor = self.conn.execute('SELECT id, image_file, size FROM spool ORDER BY id')
+        for row_id, image_file, size in cursor:
+            if count <= self.max_messages and total <= self.max_bytes:
+                break
+            evicted.append((row_id, image_file))
+            count -= 1
+            total -= size
+        cursor.close()
+        self.conn.executemany('DELETE FROM spool WHERE id = ?', [(row_id,) for row_id, _ in evicted])
+        return evicted
+
+    def peek(self, limit):
+        """按暂存顺序取出最早的limit条消息（不删除），返回[(id, 消息字典)]"""
+        with self.lock:
+            rows = self.conn.execute('SELECT id, message FROM spool ORDER BY id LIMIT ?', (limit,)).fetchall()
+        return [(row_id, json.loads(text)) for row_id, text in rows]
+
+    def remove(self, ids):
+        """删除已发送（或已放弃）的消息和它们的图片"""
+        if not ids:
+            return
+        with self.lock:
+            placeholders = ','.join('?' * len(ids))
+            rows = self.conn.execute(f'SELECT id, image_file FROM spool WHERE id IN ({placeholders})',
+                                     list(ids)).fetchall()
+            self.conn.execute(f'DELETE FROM spool WHERE id IN ({placeholders})', list(ids))
+        self._remove_files(rows)
+
+    def mark_attempt(self, row_id, message):
+        """记录一次失败的补发，同时保存消息的最新状态（例如断点续传的会话ID）"""
+        with self.lock:
+            self.conn.execute('UPDATE spool SET attempts = attempts + 1, message = ? WHERE id = ?',
+                              (json.dumps(message, ensure_ascii=False), row_id))
+
+    def _remove_files(self, rows):
+        for _, image_file in rows:
+            if image_file:
+                try:
+                    os.remove(image_file)
+                except OSError:
+                    pass
+
+    def stats(self):
+        with self.lock:
+            count, total = self.conn.execute('SELECT COUNT(*), COALESCE(SUM(size), 0) FROM spool').fetchone()
+        return {'messages': count, 'bytes': total}
+
+    def __len__(self):
+        with self.lock:
+            return self.conn.execute('SELECT COUNT(*) FROM spool').fetchone()[0]
+
+    def close(self):
+        with self.lock:
+            self.conn.close()